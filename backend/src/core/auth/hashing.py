@@ -0,0 +1,110 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from src.core.metrics import Counter, Gauge
+
+
+# 执行 bcrypt 的工作线程（或进程）数，也是同时进行的哈希运算上限；0 表示在事件循环里直接计算
+AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# thread 或 process；bcrypt 计算时会释放 GIL，一般用线程池即可
+AUTH_HASH_EXECUTOR = os.environ.get("AUTH_HASH_EXECUTOR", "thread")
+
+# 使用 passlib 的 CryptContext 来处理密码哈希
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+hash_queue_depth = Gauge("auth_hash_queue_depth", "等待空闲工作线程的密码哈希运算数")
+hash_active = Gauge("auth_hash_active", "正在执行的密码哈希运算数")
+hash_seconds = Counter("auth_hash_seconds_total", "密码哈希运算累计耗时（秒）")
+
+_executor: Optional[Executor] = None
+_limit: Optional[asyncio.Semaphore] = None
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+async def _run(func, *args):
+    """在工作池中执行 func，超出并发上限的调用排队等待"""
+    global _executor, _limit
+    if AUTH_HASH_WORKERS <= 0:
+        return func(*args)
+    if _executor is None:
+        if AUTH_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=AUTH_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+        _limit = asyncio.Semaphore(AUTH_HASH_WORKERS)
+
+    loop = asyncio.get_running_loop()
+    hash_queue_depth.inc()
+    try:
+        await _limit.acquire()
+    finally:
+        hash_queue_depth.dec()
+    hash_active.inc()
+    started = loop.time()
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        hash_seconds.inc(loop.time() - started)
+        hash_active.dec()
+        _limit.release()
+
+
+async def hash_password(password: str) -> str:
+    """
+    在工作池中计算密码的 bcrypt 哈希。
+
+    参数:
+        password (str): 明文密码。
+
+    返回:
+        str: 哈希后的密码。
+    """
+    return await _run(_hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """
+    在工作池中验证明文密码是否与哈希密码匹配。
+
+    参数:
+        plain_password (str): 明文密码。
+        hashed_password (str): 数据库中保存的哈希密码。
+
+    返回:
+        bool: 是否匹配。
+    """
+    return await _run(_verify, plain_password, hashed_password)
+
+
+def shutdown() -> None:
+    """关闭工作池，下次使用时会按当前配置重新创建"""
+    global _executor, _limit
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = _limit = None
+
+
+def register_hashing(app) -> None:
+    """
+    在 FastAPI 应用关闭时释放密码哈希的工作池。
+
+    参数:
+        app: FastAPI 应用实例。
+
+    返回:
+        None
+    """
+    @app.on_event("shutdown")
+    async def close_hashing():
+        shutdown()
@@ -1,4 +1,5 @@
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -9,9 +10,10 @@
 from jose import JWTError, jwt
 from tortoise.exceptions import DoesNotExist
 
+from src.core.auth.user_cache import user_cache
 from src.core.schemas.token import TokenData
-from src.core.schemas.users import UserOutSchema
-from src.core.database.models import Users
+from src.core.schemas.users import CurrentUser
+from src.core.database.reaper import live_users
 
 
 # 从环境变量中获取密钥，用于加密和解密 JWT
@@ -20,6 +22,8 @@
 ALGORITHM = "HS256"
 # 访问令牌过期时间（分钟）
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 管理员用户名，逗号分隔，可以访问 /admin 下查看所有用户数据的接口
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
 
 class OAuth2PasswordBearerCookie(OAuth2):
@@ -59,6 +63,8 @@ async def __call__(self, request: Request) -> Optional[str]:
 
 # 创建一个 OAuth2PasswordBearerCookie 实例，用于从 cookie 中获取访问令牌
 security = OAuth2PasswordBearerCookie(token_url="/login")
+# 不强制登录的版本，没有令牌时返回 None（例如登出）
+optional_security = OAuth2PasswordBearerCookie(token_url="/login", auto_error=False)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -87,6 +93,11 @@ async def get_current_user(token: str = Depends(security)):
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    # 令牌已经验证过且尚未过期时直接返回缓存的用户，不再解码和查库
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+
     try:
         # 解码 JWT，获取 payload
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -101,13 +112,21 @@ async def get_current_user(token: str = Depends(security)):
         # 如果 JWT 解码失败，抛出 credentials_exception
         raise credentials_exception
 
+    started = time.perf_counter()
     try:
-        # 根据用户名从数据库中查询用户，并返回 UserOutSchema 格式的用户数据
-        user = await UserOutSchema.from_queryset_single(
-            Users.get(username=token_data.username)
-        )
+        # 根据用户名从数据库中只取出身份字段，缓存的条目不随用户的会话和消息变多而变大
+        row = await live_users().get(username=token_data.username).values("id", "username")
     except DoesNotExist:
         # 如果用户不存在，抛出 credentials_exception
         raise credentials_exception
+    user = CurrentUser(**row)
+
+    user_cache.put(token, user, payload.get("exp"), time.perf_counter() - started)
+    return user
+
 
-    return user
\ No newline at end of file
+async def get_admin_user(current_user: CurrentUser = Depends(get_current_user)):
+    # 已登录但不在 ADMIN_USERNAMES 中的用户返回 403
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return current_user
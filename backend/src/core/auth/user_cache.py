@@ -0,0 +1,109 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from src.core.metrics import Counter, Gauge
+
+
+# 缓存的最长有效期（秒）；用户被删除时会主动失效，这里限制的是多进程部署下其他进程的陈旧时间
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+# 最多缓存的令牌数，0 表示关闭缓存
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+user_cache_hits = Counter("user_cache_hits_total", "无需查询数据库即完成认证的请求数")
+user_cache_misses = Counter("user_cache_misses_total", "需要查询数据库加载用户的请求数")
+user_cache_saved_seconds = Counter("user_cache_saved_seconds_total", "缓存命中节省的数据库查询耗时估计（秒）")
+user_cache_entries = Gauge("user_cache_entries", "用户缓存当前的条目数")
+
+
+class UserCache:
+    """
+    按访问令牌缓存 get_current_user 解析出的用户，带 TTL 的 LRU。
+
+    条目的有效期不超过令牌本身的过期时间；同一用户的全部令牌可以通过
+    invalidate_user() 一并失效。
+    """
+
+    _EWMA_ALPHA = 0.2
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, int, object]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        # 未命中时数据库查询耗时的滑动平均，用来估算命中节省的时间
+        self._avg_lookup_seconds = 0.0
+
+    def get(self, token: str) -> Optional[object]:
+        """
+        取出令牌对应的用户。
+
+        参数:
+            token (str): 访问令牌。
+
+        返回:
+            Optional[object]: 缓存的用户，未命中或已过期返回 None。
+        """
+        entry = self._entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(token)
+            user_cache_misses.inc()
+            return None
+        self._entries.move_to_end(token)
+        user_cache_hits.inc()
+        user_cache_saved_seconds.inc(self._avg_lookup_seconds)
+        return entry[2]
+
+    def put(self, token: str, user, token_expires_at: Optional[float], lookup_seconds: float) -> None:
+        """
+        缓存一次数据库查询的结果。
+
+        参数:
+            token (str): 访问令牌。
+            user (CurrentUser): 查询到的用户身份。
+            token_expires_at (Optional[float]): 令牌的过期时间（UNIX 时间戳）。
+            lookup_seconds (float): 本次数据库查询的耗时。
+
+        返回:
+            None
+        """
+        self._avg_lookup_seconds += self._EWMA_ALPHA * (lookup_seconds - self._avg_lookup_seconds)
+        if not self.max_entries:
+            return
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        self._remove(token)
+        self._entries[token] = (time.monotonic() + ttl, user.id, user)
+        self._tokens_by_user.setdefault(user.id, set()).add(token)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        user_cache_entries.set(len(self._entries))
+
+    def invalidate_token(self, token: str) -> None:
+        """丢弃单个令牌的缓存（例如用户登出）"""
+        self._remove(token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """丢弃某个用户所有令牌的缓存（例如用户被删除）"""
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            self._remove(token)
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1]]
+        user_cache_entries.set(len(self._entries))
+
+
+user_cache = UserCache(max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
@@ -0,0 +1,266 @@
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from tortoise import timezone
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from src.core.database.models import ChatSession, Conversation, Users
+from src.core.database.summaries import summarize_rows, update_session_summaries
+
+
+# 导出文件格式的版本，写在第一行
+EXPORT_VERSION = 1
+# 导出时每次查询的行数
+EXPORT_CHUNK_ROWS = 2000
+# 导入时每个事务写入的消息数
+IMPORT_BATCH_ROWS = 1000
+# gzip 压缩级别：1 级的压缩速度约是 6 级的五倍，文件大三成左右，导出的瓶颈不在网络时选前者
+_GZIP_LEVEL = 1
+
+_SESSION_COLUMNS = ("id", "title", "created_at", "summary")
+_MESSAGE_COLUMNS = ("id", "session_id", "timestamp", "user_message", "ai_message", "truncated")
+
+
+class ImportFormatError(ValueError):
+    """导入的文件不是有效的导出格式"""
+
+    def __init__(self, line: int, reason: str):
+        super().__init__(f"Line {line}: {reason}")
+        self.line = line
+
+
+def _line(kind: str, columns: Tuple[str, ...], row: tuple) -> bytes:
+    return orjson.dumps({"type": kind, **dict(zip(columns, row))}) + b"\n"
+
+
+async def _session_messages(session_ids: List[int], chunk_rows: int) -> AsyncIterator[List[tuple]]:
+    """按 (session_id, timestamp, id) 的 keyset 分批读取一组会话的消息，正好走会话消息的索引"""
+    after: Optional[tuple] = None
+    while True:
+        query = Conversation.filter(session_id__in=session_ids)
+        if after is not None:
+            session_id, timestamp, row_id = after
+            query = query.filter(
+                Q(session_id__gt=session_id)
+                | Q(session_id=session_id, timestamp__gt=timestamp)
+                | Q(session_id=session_id, timestamp=timestamp, id__gt=row_id)
+            )
+        rows = await query.order_by("session_id", "timestamp", "id").limit(chunk_rows).values_list(*_MESSAGE_COLUMNS)
+        if rows:
+            yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = rows[-1]
+        after = (last[1], last[2], last[0])
+
+
+async def _orphan_messages(user_id: int, chunk_rows: int) -> AsyncIterator[List[tuple]]:
+    """不属于任何会话的消息（单轮对话模式），按 ID 分批读取"""
+    after = 0
+    while True:
+        rows = await Conversation.filter(
+            user_id=user_id, session_id=None, id__gt=after
+        ).order_by("id").limit(chunk_rows).values_list(*_MESSAGE_COLUMNS)
+        if rows:
+            yield rows
+        if len(rows) < chunk_rows:
+            return
+        after = rows[-1][0]
+
+
+async def export_history(user_id: int, chunk_rows: int = EXPORT_CHUNK_ROWS) -> AsyncIterator[bytes]:
+    """
+    以 gzip 压缩的 NDJSON 流式导出用户的全部会话和消息，内存占用与历史记录的多少无关。
+
+    第一行是 {"type": "export", ...} 文件头，之后每批先输出一组会话（type 为 session），
+    再输出这些会话的消息（type 为 message，按会话和时间排序），最后是不属于会话的消息。
+    数据库按 keyset 分批读取，每批编码、压缩后立即产出。
+
+    参数:
+        user_id (int): 用户 ID。
+        chunk_rows (int): 每次查询的行数。
+
+    返回:
+        AsyncIterator[bytes]: 拼接后即为完整 .ndjson.gz 文件的字节块。
+    """
+    compressor = zlib.compressobj(_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    username = (await Users.filter(id=user_id).values_list("username", flat=True)) or [None]
+    yield compressor.compress(orjson.dumps({
+        "type": "export", "version": EXPORT_VERSION, "user_id": user_id,
+        "username": username[0], "exported_at": timezone.now(),
+    }) + b"\n")
+
+    after = 0
+    while True:
+        # 已删除、等待后台清理的会话不导出
+        sessions = await ChatSession.filter(
+            user_id=user_id, id__gt=after, deleted_at=None
+        ).order_by("id").limit(chunk_rows).values_list(*_SESSION_COLUMNS)
+        if not sessions:
+            break
+        yield compressor.compress(b"".join(_line("session", _SESSION_COLUMNS, row) for row in sessions))
+        async for rows in _session_messages([row[0] for row in sessions], chunk_rows):
+            yield compressor.compress(b"".join(_line("message", _MESSAGE_COLUMNS, row) for row in rows))
+        if len(sessions) < chunk_rows:
+            break
+        after = sessions[-1][0]
+
+    async for rows in _orphan_messages(user_id, chunk_rows):
+        yield compressor.compress(b"".join(_line("message", _MESSAGE_COLUMNS, row) for row in rows))
+    yield compressor.flush()
+
+
+class _Identity:
+    """与 zlib 解压对象接口相同、原样返回的占位，用于未压缩的 .ndjson"""
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """把 gzip（或未压缩）的字节流解压并按行切分"""
+    decompressor = None
+    tail = b""
+    count = 0
+    async for data in chunks:
+        if not data:
+            continue
+        if decompressor is None:
+            # 按 gzip 的魔数判断，允许直接导入解压后的文件
+            gzipped = data[:2] == b"\x1f\x8b"
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else _Identity()
+        try:
+            data = decompressor.decompress(data)
+        except zlib.error:
+            raise ImportFormatError(count + 1, "corrupt gzip data")
+        lines = (tail + data).split(b"\n")
+        tail = lines.pop()
+        count += len(lines)
+        for line in lines:
+            yield line
+    if decompressor is not None:
+        tail += decompressor.flush()
+    if tail:
+        yield tail
+
+
+def _parse_time(value, number: int) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ImportFormatError(number, f"invalid time {value!r}")
+
+
+async def import_history(
+    user_id: int,
+    chunks: AsyncIterator[bytes],
+    batch_rows: int = IMPORT_BATCH_ROWS,
+) -> Dict[str, int]:
+    """
+    把 export_history 导出的文件导入为用户的新会话和消息。
+
+    会话和消息都以新 ID 插入（同一文件导入两次会得到两份），时间和截断标记保留原值。
+    每攒够 batch_rows 条消息在一个事务中写入：先逐个创建这一批引用到的会话以拿到新 ID
+    （连同由这一批消息算出的条数、最后活动时间和预览），再批量插入消息。
+    中途遇到格式错误时抛出 ImportFormatError，之前已提交的批次保留。
+
+    参数:
+        user_id (int): 导入到的用户。
+        chunks (AsyncIterator[bytes]): 文件内容的字节块，可以是 gzip 压缩的。
+        batch_rows (int): 每个事务写入的消息数。
+
+    返回:
+        Dict[str, int]: 导入的会话数 sessions 和消息数 messages。
+
+    异常:
+        ImportFormatError: 文件格式不正确。
+    """
+    # 导出文件中的会话 ID -> 新会话 ID
+    session_ids: Dict[int, int] = {}
+    # 还没有创建的会话：导出文件中的会话 ID -> 字段
+    pending_sessions: Dict[int, dict] = {}
+    pending_messages: List[dict] = []
+    counts = {"sessions": 0, "messages": 0}
+
+    async def write(final: bool = False) -> None:
+        # 导出文件中一组会话排在它们的消息之前，只创建这一批消息引用到的会话（最后一批创建剩下的），
+        # 新会话直接带上冗余字段，之前批次已创建的会话再单独更新
+        summaries = summarize_rows((message, True) for message in pending_messages)
+        creating = [old_id for old_id in pending_sessions if final or old_id in summaries]
+        async with in_transaction():
+            for old_id in creating:
+                fields = pending_sessions.pop(old_id)
+                created_at = fields.pop("created_at") or timezone.now()
+                count, last_activity, preview = summaries.pop(old_id, (0, created_at, None))
+                session = await ChatSession.create(
+                    user_id=user_id, created_at=created_at, last_activity=last_activity,
+                    message_count=count, last_message_preview=preview, **fields
+                )
+                session_ids[old_id] = session.id
+            earlier = [
+                (message, True) for message in pending_messages if message["session_id"] in summaries
+            ]
+            for message in pending_messages:
+                if message["session_id"] is not None:
+                    message["session_id"] = session_ids[message["session_id"]]
+            await Conversation.bulk_create([
+                Conversation(user_id=user_id, **message) for message in pending_messages
+            ])
+            await update_session_summaries(earlier)
+        counts["sessions"] += len(creating)
+        counts["messages"] += len(pending_messages)
+        pending_messages.clear()
+
+    number = 0
+    async for line in _lines(chunks):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+            kind = record["type"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            raise ImportFormatError(number, "not an export record")
+        if number == 1:
+            if kind != "export" or record.get("version") != EXPORT_VERSION:
+                raise ImportFormatError(number, "missing or unsupported export header")
+            continue
+        if kind == "session":
+            old_id = record.get("id")
+            if not isinstance(old_id, int) or old_id in session_ids or old_id in pending_sessions:
+                raise ImportFormatError(number, "invalid or duplicate session id")
+            pending_sessions[old_id] = {
+                "title": str(record.get("title") or "")[:200],
+                "summary": record.get("summary"),
+                "created_at": _parse_time(record.get("created_at"), number),
+            }
+        elif kind == "message":
+            session_id = record.get("session_id")
+            if session_id is not None and session_id not in session_ids and session_id not in pending_sessions:
+                raise ImportFormatError(number, f"message refers to unknown session {session_id}")
+            if not isinstance(record.get("user_message"), str) or not isinstance(record.get("ai_message"), str):
+                raise ImportFormatError(number, "message text is missing")
+            pending_messages.append({
+                "session_id": session_id,
+                "user_message": record["user_message"],
+                "ai_message": record["ai_message"],
+                "timestamp": _parse_time(record.get("timestamp"), number),
+                "truncated": bool(record.get("truncated")),
+            })
+            if len(pending_messages) >= batch_rows:
+                await write()
+        else:
+            raise ImportFormatError(number, f"unknown record type {kind!r}")
+    if number == 0:
+        raise ImportFormatError(1, "file is empty")
+    if pending_sessions or pending_messages:
+        await write(final=True)
+    return counts
@@ -0,0 +1,113 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from tortoise.expressions import Q
+
+
+# 单页最多返回的条数；不传 limit 的旧调用也按这个上限截断
+MAX_PAGE_LIMIT = 1000
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """
+    把一页最后一行的排序键编码为不透明的游标。
+
+    参数:
+        sort_value (datetime): 排序时间字段的值。
+        row_id (int): 行 ID，用于区分同一时间的多行。
+
+    返回:
+        str: URL 安全的游标字符串。
+    """
+    raw = f"{sort_value.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析 encode_cursor 生成的游标。
+
+    参数:
+        cursor (str): 游标字符串。
+
+    返回:
+        Tuple[datetime, int]: 排序时间和行 ID。
+
+    异常:
+        HTTPException: 游标格式不正确，抛出 400 错误。
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sort_value, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(field: str, cursor: Optional[str], descending: bool) -> Q:
+    """
+    构造 (field, id) 上的 keyset 条件，取游标之后的行。
+
+    参数:
+        field (str): 排序时间字段名。
+        cursor (Optional[str]): 上一页返回的游标，为空表示第一页。
+        descending (bool): 是否按倒序分页。
+
+    返回:
+        Q: Tortoise 查询条件。
+    """
+    if not cursor:
+        return Q()
+    sort_value, row_id = decode_cursor(cursor)
+    op = "lt" if descending else "gt"
+    return Q(**{f"{field}__{op}": sort_value}) | Q(**{field: sort_value, f"id__{op}": row_id})
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """
+    解析逗号分隔的字段投影参数。
+
+    参数:
+        fields (Optional[str]): 请求的字段，为空表示全部字段。
+        allowed (Sequence[str]): 允许投影的字段。
+
+    返回:
+        List[str]: 按 allowed 顺序排列的字段列表。
+
+    异常:
+        HTTPException: 包含未知字段时抛出 400 错误。
+    """
+    if not fields:
+        return list(allowed)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in allowed if name in requested]
+
+
+def next_cursor(rows: List[tuple], limit: int, sort_index: int, id_index: int) -> Optional[str]:
+    """
+    多取一行判断是否还有下一页：有则截掉多出的行并返回下一页游标。
+
+    参数:
+        rows (List[tuple]): 按 limit + 1 查询得到的 values_list 行，会被原地截断。
+        limit (int): 本页条数。
+        sort_index (int): 排序时间字段在行中的位置。
+        id_index (int): id 在行中的位置。
+
+    返回:
+        Optional[str]: 下一页游标，没有下一页则为 None。
+    """
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    last = rows[-1]
+    return encode_cursor(last[sort_index], last[id_index])
+
+
+def query_columns(selected: Sequence[str], *keys: str) -> List[str]:
+    """在投影字段后面补上分页需要、但没有被请求的排序键"""
+    return [*selected, *(key for key in keys if key not in selected)]
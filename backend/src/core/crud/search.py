@@ -0,0 +1,199 @@
+import html
+import os
+import re
+from typing import Callable, List, Optional
+
+from tortoise.connection import connections
+from tortoise.exceptions import OperationalError
+
+from src.core.database.models import ChatSession, Conversation
+
+
+# 全文检索使用的 Postgres 文本搜索配置；中文内容需要安装 zhparser 等分词扩展后改为对应的配置
+SEARCH_TS_CONFIG = os.environ.get("SEARCH_TS_CONFIG", "simple")
+# 单页最多返回的搜索结果数
+MAX_SEARCH_LIMIT = 100
+
+# ts_headline 高亮标记用私有区字符，HTML 转义之后再替换成 <mark>，避免回答中的 HTML 被原样输出
+_START_SEL, _STOP_SEL = "\ue000", "\ue001"
+_HEADLINE_OPTIONS = f"StartSel={_START_SEL}, StopSel={_STOP_SEL}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+_VECTOR_COLUMN = "search_vector"
+_INDEX_NAME = "conversation_search_vector_idx"
+_TRIGGER_FUNCTION = "conversation_search_vector_update"
+_TRIGGER_NAME = "conversation_search_vector_trigger"
+
+
+class SearchUnavailableError(Exception):
+    """数据库不是 Postgres，或全文索引尚未初始化"""
+
+
+def _ts_config() -> str:
+    # 配置名只能拼进 SQL，不能作为参数传入，这里限制为合法的标识符
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", SEARCH_TS_CONFIG):
+        raise ValueError(f"Invalid SEARCH_TS_CONFIG: {SEARCH_TS_CONFIG!r}")
+    return SEARCH_TS_CONFIG
+
+
+def _vector_sql(prefix: str = "") -> str:
+    """用户消息权重 A、回答权重 B，提问命中的排在前面"""
+    config = _ts_config()
+    return (
+        f"setweight(to_tsvector('{config}', coalesce({prefix}user_message, '')), 'A') || "
+        f"setweight(to_tsvector('{config}', coalesce({prefix}ai_message, '')), 'B')"
+    )
+
+
+def _client():
+    client = connections.get("default")
+    if client.capabilities.dialect != "postgres":
+        raise SearchUnavailableError("Full-text search requires PostgreSQL")
+    return client
+
+
+async def install_search_trigger() -> None:
+    """
+    添加 search_vector 列和维护它的触发器，之后插入或修改消息内容时由数据库增量更新。
+
+    语句都是幂等的，可以重复执行；已有的行需要再用 backfill_search_vectors 补齐。
+
+    返回:
+        None
+
+    异常:
+        SearchUnavailableError: 数据库不是 Postgres。
+    """
+    client = _client()
+    table = Conversation._meta.db_table
+    await client.execute_script(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {_VECTOR_COLUMN} tsvector")
+    await client.execute_script(
+        f"""
+        CREATE OR REPLACE FUNCTION {_TRIGGER_FUNCTION}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{_VECTOR_COLUMN} := {_vector_sql("NEW.")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    await client.execute_script(f"DROP TRIGGER IF EXISTS {_TRIGGER_NAME} ON {table}")
+    await client.execute_script(
+        f"CREATE TRIGGER {_TRIGGER_NAME} BEFORE INSERT OR UPDATE OF user_message, ai_message "
+        f"ON {table} FOR EACH ROW EXECUTE FUNCTION {_TRIGGER_FUNCTION}()"
+    )
+
+
+async def backfill_search_vectors(
+    batch_size: int = 5000,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    按 ID 区间分批为还没有 search_vector 的行补齐索引内容，每批一个短事务，不长时间锁表。
+
+    参数:
+        batch_size (int): 每批覆盖的 ID 区间长度。
+        progress (Optional[Callable[[int, int], None]]): 每批结束后以（已处理到的 ID，最大 ID）回调。
+
+    返回:
+        int: 更新的行数。
+
+    异常:
+        SearchUnavailableError: 数据库不是 Postgres。
+    """
+    client = _client()
+    table = Conversation._meta.db_table
+    rows = await client.execute_query_dict(
+        f"SELECT min(id) AS low, max(id) AS high FROM {table} WHERE {_VECTOR_COLUMN} IS NULL"
+    )
+    low, high = rows[0]["low"], rows[0]["high"]
+    if low is None:
+        return 0
+
+    updated = 0
+    start = low - 1
+    while start < high:
+        end = min(start + batch_size, high)
+        count, _ = await client.execute_query(
+            f"UPDATE {table} SET {_VECTOR_COLUMN} = {_vector_sql()} "
+            f"WHERE id > $1 AND id <= $2 AND {_VECTOR_COLUMN} IS NULL",
+            [start, end],
+        )
+        updated += count
+        start = end
+        if progress is not None:
+            progress(end, high)
+    return updated
+
+
+async def create_search_index() -> None:
+    """
+    在 search_vector 上建 GIN 索引。
+
+    使用 CONCURRENTLY，建索引期间不阻塞对话记录的写入；补齐已有的行之后再建，只需扫描一遍。
+
+    返回:
+        None
+
+    异常:
+        SearchUnavailableError: 数据库不是 Postgres。
+    """
+    client = _client()
+    await client.execute_script(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {_INDEX_NAME} "
+        f"ON {Conversation._meta.db_table} USING GIN ({_VECTOR_COLUMN})"
+    )
+
+
+def _highlight(snippet: Optional[str]) -> str:
+    escaped = html.escape(snippet or "")
+    return escaped.replace(_START_SEL, "<mark>").replace(_STOP_SEL, "</mark>")
+
+
+async def search_conversations(user_id: int, query: str, limit: int, offset: int = 0) -> List[dict]:
+    """
+    在用户所有会话的对话记录中全文检索，按相关度排序。
+
+    先用 GIN 索引筛出命中的行并排序分页，只对当前页的行生成高亮片段（ts_headline 开销较大）。
+
+    参数:
+        user_id (int): 用户 ID，只检索该用户的会话。
+        query (str): 搜索词，支持 websearch 语法（"短语"、or、-排除）。
+        limit (int): 单页条数。
+        offset (int): 跳过的条数。
+
+    返回:
+        List[dict]: 每条结果含 id、session_id、session_title、timestamp、rank，
+            以及 HTML 转义后用 <mark> 标出命中词的 user_snippet、ai_snippet。
+
+    异常:
+        SearchUnavailableError: 数据库不是 Postgres，或尚未执行 search-index 命令。
+    """
+    client = _client()
+    config = _ts_config()
+    sql = f"""
+        WITH q AS (SELECT websearch_to_tsquery('{config}', $2) AS query),
+        hits AS (
+            SELECT c.id, c.session_id, s.title AS session_title, c.timestamp,
+                   c.user_message, c.ai_message, ts_rank_cd(c.{_VECTOR_COLUMN}, q.query) AS rank
+            FROM {Conversation._meta.db_table} c
+            JOIN {ChatSession._meta.db_table} s ON s.id = c.session_id
+            CROSS JOIN q
+            WHERE s.user_id = $1 AND s.deleted_at IS NULL AND c.{_VECTOR_COLUMN} @@ q.query
+            ORDER BY rank DESC, c.id DESC
+            LIMIT $3 OFFSET $4
+        )
+        SELECT hits.id, hits.session_id, hits.session_title, hits.timestamp, hits.rank,
+               ts_headline('{config}', hits.user_message, q.query, '{_HEADLINE_OPTIONS}') AS user_snippet,
+               ts_headline('{config}', hits.ai_message, q.query, '{_HEADLINE_OPTIONS}') AS ai_snippet
+        FROM hits CROSS JOIN q
+        ORDER BY hits.rank DESC, hits.id DESC
+    """
+    try:
+        rows = await client.execute_query_dict(sql, [user_id, query, limit, offset])
+    except OperationalError as e:
+        raise SearchUnavailableError(f"Search index not initialized: {e}")
+    for row in rows:
+        row["rank"] = round(row["rank"], 6)
+        row["user_snippet"] = _highlight(row["user_snippet"])
+        row["ai_snippet"] = _highlight(row["ai_snippet"])
+    return rows
@@ -0,0 +1,49 @@
+from typing import Iterator, Mapping, Optional, Sequence
+
+import orjson
+from fastapi.responses import Response, StreamingResponse
+
+
+# 每批编码的行数；结果超过一批时改为分批流式返回，不在内存里拼出整个数组
+STREAM_BATCH_ROWS = 500
+
+
+def encode_rows(columns: Sequence[str], rows: Sequence[tuple]) -> Iterator[bytes]:
+    """
+    把 values_list() 查出的元组直接编码为 JSON 对象数组，按批产出字节块。
+
+    参数:
+        columns (Sequence[str]): 输出的字段名，与行中前 len(columns) 个值一一对应，
+            行尾多出的值（例如只用于分页的排序键）会被忽略。
+        rows (Sequence[tuple]): 查询结果。
+
+    返回:
+        Iterator[bytes]: 拼接后即为完整 JSON 数组的字节块。
+    """
+    yield b"["
+    for start in range(0, len(rows), STREAM_BATCH_ROWS):
+        batch = orjson.dumps([dict(zip(columns, row)) for row in rows[start:start + STREAM_BATCH_ROWS]])
+        # 去掉每批自带的方括号，批与批之间用逗号连接
+        yield batch[1:-1] if start == 0 else b"," + batch[1:-1]
+    yield b"]"
+
+
+def rows_response(
+    columns: Sequence[str],
+    rows: Sequence[tuple],
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """
+    跳过 ORM 实例化和 Pydantic 校验，直接返回查询结果的 JSON。
+
+    参数:
+        columns (Sequence[str]): 输出的字段名，见 encode_rows。
+        rows (Sequence[tuple]): 查询结果。
+        headers (Optional[Mapping[str, str]]): 额外的响应头。
+
+    返回:
+        Response: 一批以内是普通响应，否则是流式响应。
+    """
+    if len(rows) <= STREAM_BATCH_ROWS:
+        return Response(b"".join(encode_rows(columns, rows)), media_type="application/json", headers=headers)
+    return StreamingResponse(encode_rows(columns, rows), media_type="application/json", headers=headers)
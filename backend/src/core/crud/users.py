@@ -1,15 +1,15 @@
 from fastapi import HTTPException
-from passlib.context import CryptContext
-from tortoise.exceptions import DoesNotExist, IntegrityError
+from tortoise import timezone
+from tortoise.exceptions import IntegrityError
 
+from src.core.auth.hashing import hash_password
+from src.core.auth.user_cache import user_cache
 from src.core.database.models import Users
+from src.core.database.reaper import live_users, reaper
 from src.core.schemas.token import Status
 from src.core.schemas.users import UserOutSchema
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
 async def create_user(user) -> UserOutSchema:
     """
     创建一个新用户。
@@ -23,7 +23,7 @@ async def create_user(user) -> UserOutSchema:
     异常:
         HTTPException: 如果用户名已存在，抛出 401 错误。
     """
-    user.password = pwd_context.encrypt(user.password)
+    user.password = await hash_password(user.password)
 
     try:
         user_obj = await Users.create(**user.dict(exclude_unset=True))
@@ -37,9 +37,13 @@ async def delete_user(user_id, current_user) -> Status:
     """
     删除指定 ID 的用户。
 
+    只给用户打上删除标记：令牌和登录立即失效，会话和消息不再可见；
+    这些数据由后台清理分批删除，接口的耗时与用户的历史记录多少无关。
+    用户名在清理完成之前仍被占用。
+
     参数:
         user_id (int): 要删除的用户 ID。
-        current_user (UserOutSchema): 当前登录的用户信息。
+        current_user (CurrentUser): 当前登录的用户信息。
 
     返回:
         Status: 删除操作的状态信息。
@@ -47,15 +51,16 @@ async def delete_user(user_id, current_user) -> Status:
     异常:
         HTTPException: 如果用户未找到或没有权限删除，抛出 404 或 403 错误。
     """
-    try:
-        db_user = await UserOutSchema.from_queryset_single(Users.get(id=user_id))
-    except DoesNotExist:
+    # 只查是否存在，不需要取出用户数据
+    if not await live_users().filter(id=user_id).exists():
         raise HTTPException(status_code=404, detail=f"User {user_id} not found")
 
-    if db_user.id == current_user.id:
-        deleted_count = await Users.filter(id=user_id).delete()
+    if user_id == current_user.id:
+        deleted_count = await Users.filter(id=user_id, deleted_at=None).update(deleted_at=timezone.now())
+        user_cache.invalidate_user(user_id)
         if not deleted_count:
             raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+        reaper.wake()
         return Status(message=f"Deleted user {user_id}")
 
     raise HTTPException(status_code=403, detail=f"Not authorized to delete")
\ No newline at end of file
@@ -10,6 +10,7 @@ class Users(models.Model):
     password = fields.CharField(max_length=128, null=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     modified_at = fields.DatetimeField(auto_now=True)
+    deleted_at = fields.DatetimeField(null=True, index=True)  # 删除标记，由后台清理连同下属的行删掉
 
 # 单条对话记录
 class Conversation(models.Model):
@@ -23,6 +24,11 @@ class Conversation(models.Model):
         related_name='conversations',
         null=True  # 允许单对话模式为空
     )
+    truncated = fields.BooleanField(default=False)  # 客户端中途断开，ai_message 只是部分回答
+
+    class Meta:
+        # 会话内按时间的 keyset 分页；按用户查找不属于会话的消息（导出、删除用户）
+        indexes = (("session_id", "timestamp", "id"), ("user_id", "session_id"))
 
 # 聊天对话容器
 class ChatSession(models.Model):
@@ -30,7 +36,76 @@ class ChatSession(models.Model):
     user = fields.ForeignKeyField('models.Users', related_name='sessions')
     title = fields.CharField(max_length=200)  # 对话标题
     created_at = fields.DatetimeField(auto_now_add=True)
+    summary = fields.TextField(null=True)  # 较早轮次的滚动摘要，用于多轮上下文
+    deleted_at = fields.DatetimeField(null=True, index=True)  # 删除标记，由后台清理连同消息删掉
+    # 侧边栏用的冗余字段，写入对话记录时增量维护（已有数据用 manage.py backfill-sessions 补齐）
+    message_count = fields.IntField(default=0)
+    last_message_preview = fields.CharField(max_length=200, null=True)
+    last_activity = fields.DatetimeField(auto_now_add=True)  # 最后一轮的时间，没有消息时为创建时间
     conversations = fields.ReverseRelation['Conversation']  # 反向关系
 
+    class Meta:
+        # 用户会话列表按创建时间的 keyset 分页；侧边栏按最后活动时间的 keyset 分页
+        indexes = (("user_id", "created_at", "id"), ("user_id", "last_activity", "id"))
+
+# 会话的 Ollama context 向量（从内存缓存中淘汰时落库）
+class SessionContext(models.Model):
+    session = fields.OneToOneField('models.ChatSession', related_name='ollama_context', pk=True)
+    model = fields.CharField(max_length=100)  # 生成该 context 的模型，换模型后不可复用
+    tokens = fields.BinaryField()  # int32 数组的原始字节
+    turns = fields.IntField(default=0)  # 生成该 context 时会话的轮数，之后又有新的轮次写入则不可复用
+    updated_at = fields.DatetimeField(auto_now=True)
+
+# 离线批量推理任务
+class BatchJob(models.Model):
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.Users', related_name='batch_jobs')
+    model = fields.CharField(max_length=100)
+    options = fields.JSONField(null=True)  # 随每个提示词发送给 Ollama 的 options
+    status = fields.CharField(max_length=16, default="queued")  # queued / running / completed / cancelled
+    total = fields.IntField()
+    completed = fields.IntField(default=0)
+    failed = fields.IntField(default=0)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        indexes = (("user_id", "created_at", "id"),)
+
+# 批量任务中的一个提示词及其结果
+class BatchItem(models.Model):
+    id = fields.IntField(pk=True)
+    job = fields.ForeignKeyField('models.BatchJob', related_name='items')
+    index = fields.IntField()  # 在任务中的序号，从 0 开始
+    prompt = fields.TextField()
+    status = fields.CharField(max_length=16, default="pending")  # pending / running / done / failed
+    attempts = fields.IntField(default=0)  # 失败的次数
+    claimed_at = fields.DatetimeField(null=True)  # 处理中的租约时间，进程退出后租约过期即可被重新领取
+    result = fields.BinaryField(null=True)  # zlib 压缩的 UTF-8 回答
+    error = fields.CharField(max_length=500, null=True)
+    prompt_eval_count = fields.IntField(null=True)
+    eval_count = fields.IntField(null=True)
+
+    class Meta:
+        unique_together = (("job_id", "index"),)
+        # 按任务顺序领取待处理的提示词
+        indexes = (("status", "job_id", "index"),)
+
+# 每个用户每个模型每小时的 token 用量（由内存中的累计定期写入）
+class TokenUsage(models.Model):
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.Users', related_name='token_usage')
+    model = fields.CharField(max_length=100)
+    period = fields.DatetimeField()  # 所在小时的开始时间（UTC）
+    requests = fields.IntField(default=0)
+    prompt_tokens = fields.BigIntField(default=0)
+    completion_tokens = fields.BigIntField(default=0)
+    eval_ms = fields.BigIntField(default=0)  # Ollama 报告的生成耗时合计（毫秒）
+
+    class Meta:
+        unique_together = (("user_id", "model", "period"),)
+        # 按时间范围汇总所有用户的用量
+        indexes = (("period", "user_id"),)
+
 def __str__(self):
     return f"{self.title}, {self.author_id} on {self.created_at}"
\ No newline at end of file
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from tortoise import timezone
+
+from src.core.database.models import (
+    BatchItem, BatchJob, ChatSession, Conversation, SessionContext, TokenUsage, Users,
+)
+from src.core.metrics import Counter, Gauge
+from src.core.ollama.batch import ACTIVE_JOB_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+# 每条 DELETE 语句最多删除的行数
+REAPER_BATCH_ROWS = int(os.environ.get("REAPER_BATCH_ROWS", "1000"))
+# 两批之间暂停多久（秒），把数据库让给正常的读写
+REAPER_BATCH_PAUSE = float(os.environ.get("REAPER_BATCH_PAUSE", "0.05"))
+# 没有被唤醒时多久（秒）检查一次新的删除标记
+REAPER_INTERVAL = float(os.environ.get("REAPER_INTERVAL", "30"))
+
+reaper_rows_deleted = Counter("reaper_rows_deleted_total", "后台清理删除的行数", ["table"])
+reaper_batches = Counter("reaper_batches_total", "后台清理执行的 DELETE 批次数")
+reaper_reaped = Counter("reaper_reaped_total", "清理完成的删除标记数", ["kind"])
+reaper_failures = Counter("reaper_failures_total", "后台清理失败的次数")
+reaper_pending = Gauge("reaper_pending", "等待清理的会话和用户删除标记数")
+reaper_seconds = Gauge("reaper_last_reap_seconds", "最近一个删除标记从开始清理到完成的秒数")
+
+
+def live_sessions():
+    """没有删除标记、所属用户也没有删除标记的会话"""
+    return ChatSession.filter(deleted_at=None, user__deleted_at=None)
+
+
+def live_users():
+    """没有删除标记的用户"""
+    return Users.filter(deleted_at=None)
+
+
+class _Stopped(Exception):
+    """清理中途收到 close()，删除标记保留，下次启动后继续"""
+
+
+class Reaper:
+    """
+    软删除的会话和用户的后台清理。
+
+    删除接口只给会话或用户打上 deleted_at 标记（一条按主键的 UPDATE，立即对所有查询隐藏），
+    这里再按标记的先后把它们连同下属的行删掉：每条 DELETE 最多 batch_rows 行，各自是一个短事务，
+    批次之间暂停 pause 秒，不会像一次性级联删除那样长时间持锁、挡住其他写入。
+    标记保存在数据库中，进程重启后从剩下的标记继续。
+    """
+
+    def __init__(self, batch_rows: int, pause: float, interval: float):
+        self.batch_rows = batch_rows
+        self.pause = pause
+        self.interval = interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def wake(self) -> None:
+        """有新的删除标记，尽快开始清理"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """在事件循环中启动清理任务"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        停止清理任务。正在执行的一批删除完成后退出，没有清理完的标记留到下次启动。
+
+        返回:
+            None
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.reap_pending()
+            except _Stopped:
+                return
+            except Exception:
+                reaper_failures.inc()
+                logger.exception("Failed to reap deleted sessions and users")
+
+    async def reap_pending(self) -> int:
+        """
+        按标记的先后清理当前所有删除标记：先是单独删除的会话，再是用户。
+
+        返回:
+            int: 清理完成的标记数。
+        """
+        reaped = 0
+        while True:
+            await self._update_pending()
+            session_id = await ChatSession.filter(deleted_at__isnull=False).order_by(
+                "deleted_at", "id"
+            ).limit(1).values_list("id", flat=True)
+            if session_id:
+                await self._timed(self._reap_session(session_id[0]), "session")
+                reaped += 1
+                continue
+            user_id = await Users.filter(deleted_at__isnull=False).order_by(
+                "deleted_at", "id"
+            ).limit(1).values_list("id", flat=True)
+            if user_id:
+                await self._timed(self._reap_user(user_id[0]), "user")
+                reaped += 1
+                continue
+            return reaped
+
+    async def _update_pending(self) -> None:
+        reaper_pending.set(
+            await ChatSession.filter(deleted_at__isnull=False).count()
+            + await Users.filter(deleted_at__isnull=False).count()
+        )
+
+    async def _timed(self, reap, kind: str) -> None:
+        started = time.monotonic()
+        await reap
+        reaper_seconds.set(round(time.monotonic() - started, 3))
+        reaper_reaped.labels(kind).inc()
+
+    async def _delete_batches(self, model, **filters) -> None:
+        """按主键分批删除满足条件的行，每批之间暂停"""
+        table = model._meta.db_table
+        while True:
+            if self._stopping:
+                raise _Stopped()
+            ids = await model.filter(**filters).limit(self.batch_rows).values_list("id", flat=True)
+            if not ids:
+                return
+            deleted = await model.filter(id__in=ids).delete()
+            reaper_batches.inc()
+            reaper_rows_deleted.labels(table).inc(deleted)
+            await asyncio.sleep(self.pause)
+
+    async def _reap_session(self, session_id: int) -> None:
+        await self._delete_batches(Conversation, session_id=session_id)
+        await SessionContext.filter(session_id=session_id).delete()
+        # 清理期间仍在生成的回答可能又写入了几行，由外键的级联一并删除
+        await ChatSession.filter(id=session_id).delete()
+        reaper_rows_deleted.labels(ChatSession._meta.db_table).inc()
+
+    async def _reap_user(self, user_id: int) -> None:
+        while True:
+            session_ids = await ChatSession.filter(user_id=user_id).order_by("id").limit(
+                self.batch_rows
+            ).values_list("id", flat=True)
+            if not session_ids:
+                break
+            for session_id in session_ids:
+                if self._stopping:
+                    raise _Stopped()
+                await self._reap_session(session_id)
+        # 不属于会话的单轮对话
+        await self._delete_batches(Conversation, user_id=user_id)
+        await self._delete_batches(TokenUsage, user_id=user_id)
+        # 先取消任务，批量任务的执行器不再领取它们的提示词
+        await BatchJob.filter(user_id=user_id, status__in=ACTIVE_JOB_STATUSES).update(
+            status="cancelled", finished_at=timezone.now()
+        )
+        await self._delete_batches(BatchItem, job__user_id=user_id)
+        await self._delete_batches(BatchJob, user_id=user_id)
+        await Users.filter(id=user_id).delete()
+        reaper_rows_deleted.labels(Users._meta.db_table).inc()
+
+
+reaper = Reaper(
+    batch_rows=REAPER_BATCH_ROWS,
+    pause=REAPER_BATCH_PAUSE,
+    interval=REAPER_INTERVAL,
+)
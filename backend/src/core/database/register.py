@@ -2,6 +2,9 @@
 
 from tortoise import Tortoise
 
+from src.core.database.reaper import reaper
+from src.core.database.writer import conversation_writer
+
 
 def register_tortoise(
     app,
@@ -22,7 +25,7 @@ def register_tortoise(
     @app.on_event("startup")
     async def init_orm():
         """
-        在应用启动时初始化 Tortoise ORM。
+        在应用启动时初始化 Tortoise ORM，并启动对话记录的批量写入和已删除数据的后台清理。
 
         返回:
             None
@@ -30,13 +33,17 @@ async def init_orm():
         await Tortoise.init(config=config)
         if generate_schemas:
             await Tortoise.generate_schemas()
+        conversation_writer.start()
+        reaper.start()
 
     @app.on_event("shutdown")
     async def close_orm():
         """
-        在应用关闭时关闭 Tortoise ORM 的连接。
+        在应用关闭时停止后台清理，写完所有待写入的对话记录，再关闭 Tortoise ORM 的连接。
 
         返回:
             None
         """
+        await reaper.close()
+        await conversation_writer.close()
         await Tortoise.close_connections()
@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from tortoise import timezone
+from tortoise.expressions import F, Q
+from tortoise.functions import Count
+
+from src.core.database.models import ChatSession, Conversation
+
+
+# 最后一条消息预览的最大字符数（与 ChatSession.last_message_preview 的长度一致）
+SESSION_PREVIEW_CHARS = 200
+
+
+def message_preview(user_message: Optional[str], ai_message: Optional[str]) -> Optional[str]:
+    """一轮对话的预览：折叠空白后的回答，回答为空（例如生成失败）时用提问"""
+    text = " ".join((ai_message or user_message or "").split())
+    return text[:SESSION_PREVIEW_CHARS] or None
+
+
+def summarize_rows(rows: Iterable[Tuple[dict, bool]]) -> Dict[int, Tuple[int, datetime, Optional[str]]]:
+    """
+    按会话汇总一批对话记录。
+
+    参数:
+        rows (Iterable[Tuple[dict, bool]]): (对话记录的字段, 是否为新插入的行)，字段中需要有
+            session_id、timestamp、user_message 和 ai_message；不属于会话的行被忽略。
+
+    返回:
+        Dict[int, Tuple[int, datetime, Optional[str]]]: 会话 ID -> (新插入的行数, 最新一行的时间, 最新一行的预览)。
+    """
+    now = timezone.now()
+    added: Dict[int, int] = {}
+    # 会话 ID -> (时间, 最新的一行)
+    latest: Dict[int, Tuple[datetime, dict]] = {}
+    for row, inserted in rows:
+        session_id = row.get("session_id")
+        if session_id is None:
+            continue
+        added[session_id] = added.get(session_id, 0) + inserted
+        timestamp = row.get("timestamp") or now
+        if session_id not in latest or timestamp >= latest[session_id][0]:
+            latest[session_id] = (timestamp, row)
+    return {
+        session_id: (added[session_id], timestamp, message_preview(row.get("user_message"), row.get("ai_message")))
+        for session_id, (timestamp, row) in latest.items()
+    }
+
+
+async def update_session_summaries(rows: Iterable[Tuple[dict, bool]]) -> None:
+    """
+    把刚写入的对话记录计入所属会话的冗余字段。
+
+    新插入的行增加 message_count；时间不早于会话当前 last_activity（或会话还没有消息）的行刷新
+    last_activity 和 last_message_preview，乱序写入的较早轮次不会让它们回退。每个会话通常只需一条 UPDATE。
+
+    参数:
+        rows (Iterable[Tuple[dict, bool]]): 同 summarize_rows。
+
+    返回:
+        None
+    """
+    for session_id, (added, timestamp, preview) in summarize_rows(rows).items():
+        fields = {"last_activity": timestamp, "last_message_preview": preview}
+        if added:
+            fields["message_count"] = F("message_count") + added
+        # 还没有消息的会话，last_activity 是创建时间，导入的旧消息也可能早于它
+        updated = await ChatSession.filter(
+            Q(last_activity__lte=timestamp) | Q(message_count=0), id=session_id
+        ).update(**fields)
+        if not updated and added:
+            # 会话已有更新的活动，只增加条数
+            await ChatSession.filter(id=session_id).update(message_count=F("message_count") + added)
+
+
+async def backfill_session_summaries(
+    batch_size: int = 500,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    按会话 ID 分批根据已有的对话记录重新计算会话的冗余字段，用于上线这些字段之前的数据。
+
+    结果由对话记录直接算出，可以重复执行；补齐期间正在写入的会话，条数可能差刚写入的几轮，
+    再执行一次即可。
+
+    参数:
+        batch_size (int): 每批处理的会话数。
+        progress (Optional[Callable[[int, int], None]]): 每批结束后以（已处理到的会话 ID，最大会话 ID）回调。
+
+    返回:
+        int: 更新的会话数。
+    """
+    high = await ChatSession.all().order_by("-id").limit(1).values_list("id", flat=True)
+    if not high:
+        return 0
+    updated = 0
+    after = 0
+    while True:
+        session_ids = await ChatSession.filter(id__gt=after).order_by("id").limit(batch_size).values_list(
+            "id", flat=True
+        )
+        if not session_ids:
+            return updated
+        counts = dict(
+            await Conversation.filter(session_id__in=session_ids).annotate(count=Count("id")).group_by(
+                "session_id"
+            ).values_list("session_id", "count")
+        )
+        for session_id in session_ids:
+            last = await Conversation.filter(session_id=session_id).order_by("-timestamp", "-id").limit(
+                1
+            ).values_list("timestamp", "user_message", "ai_message")
+            if last:
+                timestamp, user_message, ai_message = last[0]
+                await ChatSession.filter(id=session_id).update(
+                    message_count=counts.get(session_id, 0),
+                    last_activity=timestamp,
+                    last_message_preview=message_preview(user_message, ai_message),
+                )
+            else:
+                await ChatSession.filter(id=session_id).update(
+                    message_count=0, last_activity=F("created_at"), last_message_preview=None
+                )
+        updated += len(session_ids)
+        after = session_ids[-1]
+        if progress is not None:
+            progress(after, high[0])
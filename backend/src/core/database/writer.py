@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from tortoise import timezone
+
+from src.core.database.models import Conversation
+from src.core.database.summaries import update_session_summaries
+from src.core.metrics import Counter, Gauge
+
+
+logger = logging.getLogger(__name__)
+
+# 攒够这么多条待写入的对话就立即批量写入
+CONVERSATION_BATCH_SIZE = int(os.environ.get("CONVERSATION_BATCH_SIZE", "100"))
+# 最多间隔多久（秒）写入一次
+CONVERSATION_FLUSH_INTERVAL = float(os.environ.get("CONVERSATION_FLUSH_INTERVAL", "0.5"))
+# 生成中的回答每隔多久（秒）把已生成的部分写入数据库，进程中途退出时最多丢失这段时间的内容
+CONVERSATION_CHECKPOINT_INTERVAL = float(os.environ.get("CONVERSATION_CHECKPOINT_INTERVAL", "5"))
+
+conversation_rows_written = Counter("conversation_rows_written_total", "批量写入的对话记录数")
+conversation_flushes = Counter("conversation_flushes_total", "对话记录的写入批次数")
+conversation_checkpoints = Counter("conversation_checkpoints_total", "生成中的回答写入检查点的次数")
+conversation_write_failures = Counter("conversation_write_failures_total", "写入失败被丢弃的对话记录数")
+conversation_pending = Gauge("conversation_pending", "等待写入的对话记录数")
+
+
+class Turn:
+    """
+    一轮对话的写入句柄。
+
+    生成过程中用 append() 记录新生成的文本，结束时交给 ConversationWriter.finish()；
+    检查点写入后行已存在，之后的写入改为更新这一行。
+    """
+
+    __slots__ = ("fields", "parts", "truncated", "done", "row_id", "started", "_persisted")
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+        self.parts: List[str] = []
+        self.truncated = True
+        self.done = False
+        self.row_id: Optional[int] = None
+        self.started = time.monotonic()
+        # 最近一次写入数据库时已生成的片段数，没有新内容时不再写检查点
+        self._persisted = -1
+
+    def append(self, text: str) -> None:
+        self.parts.append(text)
+
+    @property
+    def ai_message(self) -> str:
+        return "".join(self.parts)
+
+    def _row(self) -> dict:
+        self._persisted = len(self.parts)
+        return {**self.fields, "ai_message": self.ai_message, "truncated": self.truncated}
+
+
+class ConversationWriter:
+    """
+    对话记录的后写（write-behind）队列。
+
+    结束的轮次先进入内存队列，按数量或时间批量 INSERT；长时间生成中的轮次定期写检查点。
+    close() 停止后台任务，把生成中的轮次标记为截断，并写完所有待写入的记录。
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, checkpoint_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        # 生成中的轮次
+        self._active: Dict[Turn, None] = {}
+        # 等待写入的轮次（按加入顺序）
+        self._dirty: Dict[Turn, None] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def begin(self, **fields) -> Turn:
+        """
+        开始一轮对话。
+
+        参数:
+            **fields: Conversation 的其余字段（user_id、session_id、user_message 等）。
+
+        返回:
+            Turn: 本轮的写入句柄。
+        """
+        fields.setdefault("timestamp", timezone.now())
+        turn = Turn(fields)
+        self._active[turn] = None
+        return turn
+
+    def finish(self, turn: Turn, ai_message: str, truncated: bool = False) -> None:
+        """
+        结束一轮对话，记录排队等待批量写入。
+
+        参数:
+            turn (Turn): begin() 返回的句柄。
+            ai_message (str): 完整（或截断时已生成的部分）回答。
+            truncated (bool): 回答是否不完整。
+
+        返回:
+            None
+        """
+        if turn.done:
+            return
+        turn.parts = [ai_message]
+        turn.truncated = truncated
+        turn.done = True
+        self._active.pop(turn, None)
+        self._mark_dirty(turn)
+
+    def _mark_dirty(self, turn: Turn) -> None:
+        self._dirty[turn] = None
+        conversation_pending.set(len(self._dirty))
+        if len(self._dirty) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """在事件循环中启动定时写入任务"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        停止定时写入，把生成中的轮次按截断写入，并写完所有待写入的记录。
+
+        返回:
+            None
+        """
+        if self._task is not None:
+            # 不能直接取消：正在进行的写入被打断会丢数据
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        for turn in list(self._active):
+            self.finish(turn, turn.ai_message, truncated=True)
+        await self.flush()
+
+    async def _run(self) -> None:
+        last_checkpoint = time.monotonic()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            now = time.monotonic()
+            if self.checkpoint_interval > 0 and now - last_checkpoint >= self.checkpoint_interval:
+                last_checkpoint = now
+                self._checkpoint(now)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush conversations")
+
+    def _checkpoint(self, now: float) -> None:
+        for turn in self._active:
+            if now - turn.started >= self.checkpoint_interval and len(turn.parts) != turn._persisted:
+                conversation_checkpoints.inc()
+                self._mark_dirty(turn)
+
+    async def flush(self) -> None:
+        """写入当前所有待写入的记录"""
+        async with self._lock:
+            while self._dirty:
+                batch = list(self._dirty)[: max(self.batch_size, 1)]
+                for turn in batch:
+                    del self._dirty[turn]
+                conversation_pending.set(len(self._dirty))
+                await self._write(batch)
+
+    async def _write(self, batch: List[Turn]) -> None:
+        conversation_flushes.inc()
+        # 生成中的轮次需要拿到行 ID 以便后续更新，只有已结束且从未写过的可以批量插入
+        inserts = {turn: turn._row() for turn in batch if turn.row_id is None and turn.done}
+        # 写入成功的 (行, 是否新插入)，最后一并计入会话的冗余字段
+        written = []
+        if inserts:
+            try:
+                await Conversation.bulk_create([Conversation(**row) for row in inserts.values()])
+                conversation_rows_written.inc(len(inserts))
+                written.extend((row, True) for row in inserts.values())
+            except Exception:
+                logger.exception("Bulk insert of %d conversations failed, retrying row by row", len(inserts))
+                inserts = {}
+        for turn in batch:
+            if turn in inserts:
+                continue
+            row = turn._row()
+            try:
+                if turn.row_id is None:
+                    turn.row_id = (await Conversation.create(**row)).id
+                    written.append((row, True))
+                else:
+                    await Conversation.filter(id=turn.row_id).update(
+                        ai_message=row["ai_message"], truncated=row["truncated"]
+                    )
+                    written.append((row, False))
+                conversation_rows_written.inc()
+            except Exception:
+                conversation_write_failures.inc()
+                logger.exception("Failed to write conversation of session %s", row.get("session_id"))
+        if written:
+            try:
+                await update_session_summaries(written)
+            except Exception:
+                logger.exception("Failed to update session summaries")
+
+
+conversation_writer = ConversationWriter(
+    batch_size=CONVERSATION_BATCH_SIZE,
+    flush_interval=CONVERSATION_FLUSH_INTERVAL,
+    checkpoint_interval=CONVERSATION_CHECKPOINT_INTERVAL,
+)
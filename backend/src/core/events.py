@@ -0,0 +1,104 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Set, Tuple
+
+from src.core.metrics import Counter, Gauge
+
+
+events_published = Counter("events_published_total", "推送给客户端的会话事件数")
+events_dropped = Counter("events_dropped_total", "订阅者处理不过来被丢弃的事件数")
+event_subscribers = Gauge("event_subscribers", "当前订阅会话事件的连接数")
+
+# 没有事件时发送 SSE 注释的间隔（秒），防止代理断开空闲连接，也能及时发现客户端已断开
+HEARTBEAT_INTERVAL = 15.0
+
+
+class EventHub:
+    """
+    按用户分发的进程内事件（例如会话标题更新）。
+
+    每个订阅者一个有界队列；客户端处理不过来时丢弃最旧的事件，发布方永不阻塞。
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._closed = False
+
+    def publish(self, user_id: int, kind: str, data: dict) -> None:
+        """
+        向该用户的所有订阅者发布事件，没有订阅者时直接丢弃。
+
+        参数:
+            user_id (int): 用户 ID。
+            kind (str): 事件类型。
+            data (dict): 事件数据。
+
+        返回:
+            None
+        """
+        if self._closed:
+            # 订阅队列里已经放了结束标记，不能再被挤掉
+            return
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+                events_dropped.inc()
+            queue.put_nowait((kind, data))
+            events_published.inc()
+
+    async def subscribe(self, user_id: int) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        订阅该用户的事件，直到调用方停止迭代或 close()；空闲时每隔 HEARTBEAT_INTERVAL 产出一次 ("ping", {})。
+
+        参数:
+            user_id (int): 用户 ID。
+
+        返回:
+            AsyncIterator[Tuple[str, dict]]: (事件类型, 数据)。
+        """
+        if self._closed:
+            return
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        event_subscribers.inc()
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield "ping", {}
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            event_subscribers.dec()
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def close(self) -> None:
+        """结束所有订阅（进程排空时调用），客户端按 SSE 的重连机制连到其他进程"""
+        self._closed = True
+        for queue in (queue for subscribers in self._subscribers.values() for queue in subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+async def sse_frames(events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[str]:
+    """把事件编码为 Server-Sent Events，心跳编码为注释行"""
+    try:
+        async for kind, data in events:
+            if kind == "ping":
+                yield ": ping\n\n"
+            else:
+                yield f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    finally:
+        await events.aclose()
+
+
+event_hub = EventHub()
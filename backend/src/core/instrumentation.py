@@ -0,0 +1,236 @@
+import contextvars
+import functools
+import os
+import sys
+import time
+from typing import Optional
+
+from src.core.metrics import Counter, Gauge, Histogram
+
+
+# 是否采集请求级别的指标；关闭后不安装中间件、不包装数据库客户端，各个埋点直接返回
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（流式响应算到最后一个字节）",
+    labelnames=("method", "route", "status"),
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+http_errors = Counter("http_errors_total", "返回 5xx 或抛出异常的 HTTP 请求数", labelnames=("route", "status"))
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "单条数据库查询的耗时", labelnames=("route",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+chat_stage_seconds = Histogram(
+    "chat_stage_duration_seconds", "对话请求各阶段的耗时", labelnames=("endpoint", "stage"),
+)
+chat_ttft_seconds = Histogram(
+    "chat_time_to_first_token_seconds", "从收到请求到发出第一个 token 的耗时", labelnames=("endpoint",),
+)
+chat_ttft_by_load_seconds = Histogram(
+    "chat_time_to_first_token_by_load_seconds",
+    "首 token 延迟按模型是否需要冷加载区分（Ollama 返回的 load_duration 超过 COLD_LOAD_SECONDS 记为 cold）",
+    labelnames=("endpoint", "load"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+chat_tokens_per_second = Histogram(
+    "chat_tokens_per_second", "首 token 之后的生成速度", labelnames=("endpoint",),
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500),
+)
+chat_active_streams = Gauge("chat_active_streams", "正在向客户端输出的流式响应数")
+chat_stream_errors = Counter("chat_stream_errors_total", "流式响应中输出的错误事件数", labelnames=("endpoint",))
+
+# 模型加载耗时超过该值（秒）视为冷加载
+COLD_LOAD_SECONDS = 0.5
+
+# 当前请求的 ASGI scope；路由匹配后 scope["route"] 即为命中的路由
+_current_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("current_scope", default=None)
+
+
+def _route_of(scope: Optional[dict]) -> str:
+    route = scope.get("route") if scope else None
+    # 未匹配的路径不作为标签，避免标签数量失控
+    return getattr(route, "path", None) or ("unmatched" if scope else "background")
+
+
+class MetricsMiddleware:
+    """记录每个 HTTP 请求的耗时和错误，流式响应在发送完最后一块后才算结束"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _current_scope.set(scope)
+        started = time.perf_counter()
+        status = 500
+        observed = False
+
+        def observe() -> None:
+            nonlocal observed
+            if observed:
+                return
+            observed = True
+            route = _route_of(scope)
+            http_request_seconds.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
+            if status >= 500:
+                http_errors.labels(route, str(status)).inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                observe()
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            # 异常或客户端中途断开时也要记录
+            observe()
+            _current_scope.reset(token)
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            db_query_seconds.labels(_route_of(_current_scope.get())).observe(time.perf_counter() - started)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_db_client(client) -> None:
+    """
+    包装 Tortoise 数据库客户端的执行方法，按路由记录每条查询的耗时。
+
+    包装的是客户端的类，以及同一模块中的事务客户端类（它继承客户端并重写了部分方法）。
+
+    参数:
+        client: connections.get() 返回的客户端。
+
+    返回:
+        None
+    """
+    classes = [type(client)]
+    transaction_class = getattr(sys.modules[type(client).__module__], "TransactionWrapper", None)
+    if transaction_class is not None:
+        classes.append(transaction_class)
+    for cls in classes:
+        for name in ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script"):
+            # 只包装类自己定义的方法，继承来的已经在父类上包装过
+            method = cls.__dict__.get(name)
+            if method is None or getattr(method, "__instrumented__", False):
+                continue
+            setattr(cls, name, _timed(method))
+
+
+class StageTimer:
+    """
+    记录一次对话请求各阶段的耗时，以及首 token 延迟和生成速度。
+
+    stage() 记录从上一个阶段结束到现在的耗时；流式输出部分由 stream_response 调用
+    stream_started / event / stream_finished。
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = self._mark = time.perf_counter()
+        self._first_token: Optional[float] = None
+        self._tokens = 0
+        self._eval_count: Optional[int] = None
+
+    def stage(self, name: str) -> None:
+        now = time.perf_counter()
+        chat_stage_seconds.labels(self.endpoint, name).observe(now - self._mark)
+        self._mark = now
+
+    def stream_started(self) -> None:
+        chat_active_streams.inc()
+
+    def event(self, kind: str, data: dict) -> None:
+        if kind == "token":
+            self._tokens += 1
+            if self._first_token is None:
+                self._first_token = time.perf_counter()
+                chat_ttft_seconds.labels(self.endpoint).observe(self._first_token - self.started)
+                self.stage("first_token")
+        elif kind == "stats":
+            self._eval_count = data.get("eval_count")
+            load_duration = data.get("load_duration")
+            if self._first_token is not None and load_duration is not None:
+                load = "cold" if load_duration / 1e9 > COLD_LOAD_SECONDS else "warm"
+                chat_ttft_by_load_seconds.labels(self.endpoint, load).observe(self._first_token - self.started)
+        elif kind == "error":
+            chat_stream_errors.labels(self.endpoint).inc()
+
+    def stream_finished(self) -> None:
+        chat_active_streams.dec()
+        if self._first_token is None:
+            return
+        self.stage("streaming")
+        elapsed = self._mark - self._first_token
+        tokens = self._eval_count or self._tokens
+        if elapsed > 0 and tokens > 1:
+            chat_tokens_per_second.labels(self.endpoint).observe(tokens / elapsed)
+
+
+class _NullTimer(StageTimer):
+    """关闭指标时使用的空实现"""
+
+    def __init__(self):
+        pass
+
+    def stage(self, name: str) -> None:
+        pass
+
+    def stream_started(self) -> None:
+        pass
+
+    def event(self, kind: str, data: dict) -> None:
+        pass
+
+    def stream_finished(self) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def stage_timer(endpoint: str) -> StageTimer:
+    """返回对话请求的阶段计时器，关闭指标时返回什么都不做的计时器"""
+    return StageTimer(endpoint) if METRICS_ENABLED else _NULL_TIMER
+
+
+def register_metrics(app) -> None:
+    """
+    安装请求指标中间件，并在数据库初始化后包装数据库客户端。
+
+    需要在 register_tortoise 之后调用，关闭指标时什么都不做。
+
+    参数:
+        app: FastAPI 应用实例。
+
+    返回:
+        None
+    """
+    if not METRICS_ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+
+    @app.on_event("startup")
+    async def instrument_db():
+        from tortoise.connection import connections
+
+        for client in connections.all():
+            instrument_db_client(client)
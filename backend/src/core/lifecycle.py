@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from src.core.events import event_hub
+from src.core.metrics import Gauge
+
+
+logger = logging.getLogger(__name__)
+
+# 从开始导入 src.main 到启动事件全部完成的时间预算（秒），超出时记录警告
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "10"))
+# 收到 SIGTERM 后等待进行中的流式响应和生成结束的最长时间（秒），超时的生成截断保存
+WEB_DRAIN_TIMEOUT = float(os.environ.get("WEB_DRAIN_TIMEOUT", "60"))
+
+startup_phase_seconds = Gauge("startup_phase_seconds", "启动各阶段的耗时（秒）", labelnames=("phase",))
+startup_seconds = Gauge("startup_seconds", "从开始导入应用到可以接收请求的总耗时（秒）")
+worker_draining = Gauge("worker_draining", "本进程是否正在排空（收到 SIGTERM 后为 1）")
+
+
+class StartupTimer:
+    """
+    按顺序记录启动各阶段的耗时。
+
+    计时从导入本模块开始（src.main 第一行导入它；src.serve 的工作进程在加载应用之前就已导入），phase() 记录从上一个阶段结束到现在的耗时，
+    finish() 在启动事件全部完成后汇总并与预算比较。加载完应用到开始执行启动事件之间由服务器决定
+    （测试工具可能先做别的事），不计入总耗时。
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self._mark = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.total: Optional[float] = None
+
+    def resume(self) -> None:
+        """从现在开始计下一个阶段，之前未记录的时间不计入"""
+        self._mark = time.perf_counter()
+
+    def phase(self, name: str) -> None:
+        now = time.perf_counter()
+        self.phases[name] = now - self._mark
+        startup_phase_seconds.labels(name).set(self.phases[name])
+        self._mark = now
+
+    def finish(self) -> None:
+        self.total = sum(self.phases.values())
+        startup_seconds.set(self.total)
+        breakdown = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        if self.total > self.budget:
+            logger.warning(
+                "Startup took %.2fs, over the %.2fs budget (%s)", self.total, self.budget, breakdown
+            )
+        else:
+            logger.info("Startup took %.2fs (%s)", self.total, breakdown)
+
+
+class DrainState:
+    """
+    进程的排空状态：收到 SIGTERM 后不再就绪，进行中的流式响应在 timeout 秒内继续输出到结束。
+
+    begin() 由信号处理函数调用，监听者（例如结束长连接的事件订阅）通过事件循环在之后执行。
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.started_at: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def draining(self) -> bool:
+        return self.started_at is not None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """记录工作进程的事件循环，begin() 通过它调用监听者"""
+        self._loop = loop
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        self._listeners.append(callback)
+
+    def begin(self) -> None:
+        """开始排空，可重复调用；信号处理函数中调用是安全的"""
+        if self.started_at is not None:
+            return
+        self.started_at = time.monotonic()
+        worker_draining.set(1)
+        if self._loop is not None and not self._loop.is_closed():
+            for callback in self._listeners:
+                self._loop.call_soon_threadsafe(callback)
+
+    def remaining(self) -> float:
+        """排空预算还剩的秒数，没有在排空时为完整的 timeout"""
+        if self.started_at is None:
+            return self.timeout
+        return max(0.0, self.timeout - (time.monotonic() - self.started_at))
+
+
+startup_timer = StartupTimer(STARTUP_BUDGET_SECONDS)
+drain = DrainState(WEB_DRAIN_TIMEOUT)
+
+
+def register_lifecycle(app) -> None:
+    """
+    记录启动事件的耗时并汇总启动时间，开始排空时结束会话事件的订阅
+    （需要在其他 register_* 之后调用，才能把它们的启动事件都计入）。
+
+    参数:
+        app: FastAPI 应用实例。
+
+    返回:
+        None
+    """
+    startup_timer.phase("app")
+
+    async def begin_startup():
+        """在第一个启动事件之前开始计启动事件的耗时"""
+        startup_timer.resume()
+
+    app.router.on_startup.insert(0, begin_startup)
+
+    @app.on_event("startup")
+    async def finish_startup():
+        """
+        在最后一个启动事件中记录启动事件的耗时并与启动预算比较。
+
+        返回:
+            None
+        """
+        startup_timer.phase("startup_events")
+        startup_timer.finish()
+        drain.bind(asyncio.get_running_loop())
+        # SSE 订阅没有尽头，不主动结束会一直占到排空超时
+        drain.add_listener(event_hub.close)
@@ -0,0 +1,148 @@
+import bisect
+import math
+from typing import Dict, List, Sequence, Tuple
+
+
+# 进程内指标注册表：指标名 -> 指标对象
+REGISTRY: Dict[str, "Counter"] = {}
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Counter:
+    """只增不减的计数器；带标签时通过 labels() 取得每组标签值对应的子计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.value = 0.0
+        self._children: Dict[Tuple[str, ...], "Counter"] = {}
+        REGISTRY[name] = self
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def labels(self, *values: str) -> "Counter":
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self) -> "Counter":
+        child = object.__new__(type(self))
+        child.value = 0.0
+        return child
+
+    def _samples(self, name: str, labels: str) -> List[Tuple[str, str, float]]:
+        return [(name, labels, self.value)]
+
+
+class Gauge(Counter):
+    """可增可减、也可直接设置的瞬时值"""
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram(Counter):
+    """按上界分桶统计观测值的分布"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+        self._reset()
+
+    def _reset(self) -> None:
+        # 每个桶只记落在该区间的次数，输出时再累加；最后一个桶对应 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.value = 0.0
+
+    def _new_child(self) -> "Histogram":
+        child = object.__new__(Histogram)
+        child.buckets = self.buckets
+        child._reset()
+        return child
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        # value 记录观测次数，/stats 中展示的就是它
+        self.value += 1
+
+    def _samples(self, name: str, labels: str) -> List[Tuple[str, str, float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            samples.append((f"{name}_bucket", _join_labels(labels, f'le="{le}"'), cumulative))
+        samples.append((f"{name}_sum", labels, self.sum))
+        samples.append((f"{name}_count", labels, self.value))
+        return samples
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _join_labels(*parts: str) -> str:
+    return ",".join(part for part in parts if part)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def snapshot() -> Dict[str, float]:
+    """
+    返回当前所有不带标签的指标的取值（直方图为观测次数）。
+
+    返回:
+        Dict[str, float]: 指标名到取值的映射。
+    """
+    return {name: metric.value for name, metric in sorted(REGISTRY.items()) if not metric.labelnames}
+
+
+def render_prometheus() -> str:
+    """
+    按 Prometheus 文本格式（0.0.4）输出所有指标。
+
+    返回:
+        str: 指标文本。
+    """
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f"# HELP {name} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        if metric.labelnames:
+            series = [
+                (_join_labels(*(f'{key}="{_escape(value)}"' for key, value in zip(metric.labelnames, values))), child)
+                for values, child in sorted(metric._children.items())
+            ]
+        else:
+            series = [("", metric)]
+        for labels, item in series:
+            for sample, sample_labels, value in item._samples(name, labels):
+                suffix = f"{{{sample_labels}}}" if sample_labels else ""
+                lines.append(f"{sample}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Set
+
+import httpx
+
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+
+
+logger = logging.getLogger(__name__)
+
+healthy_backends = Gauge("ollama_healthy_backends", "当前可用的 Ollama 后端数")
+backend_ejections = Counter("ollama_backend_ejections_total", "后端因连续失败被摘除的次数")
+backend_failovers = Counter("ollama_backend_failovers_total", "首个 token 前失败并切换到其他后端的次数")
+
+
+def normalize_model(model: str) -> str:
+    """Ollama 中不带标签的模型名等价于 :latest"""
+    return model if ":" in model else f"{model}:latest"
+
+
+class OllamaBackend:
+    """单个 Ollama 实例及其运行状态"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        # 最近一次探测到已加载到内存的模型
+        self.loaded_models: Set[str] = set()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def __repr__(self) -> str:
+        return f"OllamaBackend({self.base_url!r}, healthy={self.healthy}, outstanding={self.outstanding})"
+
+
+class BackendPool:
+    """
+    多个 Ollama 后端组成的负载均衡池。
+
+    选择顺序：健康的后端优先，其中已加载目标模型的优先（避免冷加载），
+    再按未完成请求数从少到多。后台定期调用 /api/ps 探测健康状态和已加载模型，
+    连续失败的后端被摘除，探测成功后重新加入。
+    """
+
+    def __init__(
+        self,
+        base_urls: Iterable[str],
+        eject_after_failures: int = 2,
+        health_interval: float = 5.0,
+        health_timeout: float = 2.0,
+    ):
+        self.backends: List[OllamaBackend] = [OllamaBackend(url) for url in base_urls]
+        if not self.backends:
+            raise ValueError("At least one Ollama backend URL is required")
+        self.eject_after_failures = eject_after_failures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._health_task: Optional[asyncio.Task] = None
+        healthy_backends.set(len(self.backends))
+
+    def candidates(self, model: str) -> List[OllamaBackend]:
+        """
+        按优先级返回可尝试的后端列表，用于首选和故障转移。
+
+        参数:
+            model (str): 请求的模型名称。
+
+        返回:
+            List[OllamaBackend]: 排好序的后端；全部不健康时仍返回所有后端作为最后手段。
+        """
+        model = normalize_model(model)
+        healthy = [b for b in self.backends if b.healthy]
+        pool = healthy or self.backends
+        return sorted(pool, key=lambda b: (model not in b.loaded_models, b.outstanding))
+
+    def mark_success(self, backend: OllamaBackend, model: Optional[str] = None) -> None:
+        backend.failures = 0
+        if model:
+            backend.loaded_models.add(normalize_model(model))
+        if not backend.healthy:
+            backend.healthy = True
+            logger.info("Ollama backend %s re-admitted", backend.base_url)
+            self._update_gauge()
+
+    def mark_failure(self, backend: OllamaBackend) -> None:
+        backend.failures += 1
+        if backend.healthy and backend.failures >= self.eject_after_failures:
+            backend.healthy = False
+            backend.loaded_models.clear()
+            backend_ejections.inc()
+            logger.warning("Ollama backend %s ejected after %d failures", backend.base_url, backend.failures)
+            self._update_gauge()
+
+    def _update_gauge(self) -> None:
+        healthy_backends.set(sum(1 for b in self.backends if b.healthy))
+
+    async def probe(self, backend: OllamaBackend, client: httpx.AsyncClient) -> None:
+        """
+        探测一个后端：成功则刷新已加载模型列表，失败计入连续失败次数。
+
+        参数:
+            backend (OllamaBackend): 要探测的后端。
+            client (httpx.AsyncClient): 共享的连接池。
+
+        返回:
+            None
+        """
+        try:
+            response = await client.get(backend.url("/api/ps"), timeout=self.health_timeout)
+            response.raise_for_status()
+            models = response.json().get("models") or []
+            loaded = {normalize_model(m.get("name") or m.get("model", "")) for m in models}
+        except (httpx.HTTPError, ValueError, AttributeError, TypeError):
+            # 连不上、返回错误状态，或者响应体不是预期的格式，都算一次失败
+            self.mark_failure(backend)
+            return
+
+        backend.loaded_models = loaded
+        self.mark_success(backend)
+
+    async def probe_all(self, client: httpx.AsyncClient) -> None:
+        await asyncio.gather(*(self.probe(b, client) for b in self.backends))
+
+    def start(self, client: httpx.AsyncClient) -> None:
+        """启动后台健康检查"""
+        if self._health_task is None:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(client))
+
+    async def stop(self) -> None:
+        """停止后台健康检查"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    async def _health_loop(self, client: httpx.AsyncClient) -> None:
+        while True:
+            try:
+                await self.probe_all(client)
+            except Exception:
+                # 探测任务一旦退出，被摘除的后端就再也不会重新加入
+                logger.exception("Failed to probe Ollama backends")
+            await asyncio.sleep(self.health_interval)
+
+
+pool = BackendPool(
+    config.OLLAMA_BASE_URLS,
+    eject_after_failures=config.OLLAMA_EJECT_AFTER_FAILURES,
+    health_interval=config.OLLAMA_HEALTH_INTERVAL,
+    health_timeout=config.OLLAMA_HEALTH_TIMEOUT,
+)
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import zlib
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from tortoise import timezone
+from tortoise.expressions import F, Q
+from tortoise.transactions import in_transaction
+
+from src.core.database.models import BatchItem, BatchJob
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.client import OllamaError, chunk_text, iter_chunks, open_stream
+from src.core.ollama.scheduler import Slot, scheduler
+from src.core.ollama.usage import usage_ledger
+
+
+logger = logging.getLogger(__name__)
+
+batch_items_completed = Counter("batch_items_completed_total", "完成的批量提示词数")
+batch_items_failed = Counter("batch_items_failed_total", "多次尝试后仍失败的批量提示词数")
+batch_items_preempted = Counter("batch_items_preempted_total", "为排队的用户请求让出名额、稍后重试的批量提示词数")
+batch_tokens = Counter("batch_generated_tokens_total", "批量任务生成的 token 数")
+batch_items_running = Gauge("batch_items_running", "本进程正在生成的批量提示词数")
+
+# 还会继续处理的任务状态
+ACTIVE_JOB_STATUSES = ("queued", "running")
+# 已经有结果（成功或最终失败）的提示词状态
+FINISHED_ITEM_STATUSES = ("done", "failed")
+
+# 写入时的 zlib 压缩级别，模型输出的文本通常能压到原来的三分之一左右
+_COMPRESS_LEVEL = 6
+
+
+def compress_result(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), _COMPRESS_LEVEL)
+
+
+def decompress_result(data: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(data).decode("utf-8") if data is not None else None
+
+
+async def create_job(user_id: int, model: str, prompts: List[str], options: Optional[dict] = None) -> BatchJob:
+    """
+    创建批量任务并唤醒 worker。
+
+    参数:
+        user_id (int): 提交任务的用户。
+        model (str): 使用的模型。
+        prompts (List[str]): 按顺序处理的提示词。
+        options (Optional[dict]): 随每个提示词发送给 Ollama 的 options。
+
+    返回:
+        BatchJob: 新建的任务。
+    """
+    async with in_transaction():
+        job = await BatchJob.create(user_id=user_id, model=model, options=options, total=len(prompts))
+        await BatchItem.bulk_create(
+            [BatchItem(job_id=job.id, index=index, prompt=prompt) for index, prompt in enumerate(prompts)],
+            batch_size=1000,
+        )
+    batch_runner.notify()
+    return job
+
+
+class _Preempted(Exception):
+    """有用户请求在排队，批量提示词让出名额"""
+
+
+class BatchRunner:
+    """
+    在空闲时段处理批量任务的 worker 池。
+
+    提示词存在数据库中，worker 按任务顺序领取：先以后台优先级拿到模型名额（排在所有用户请求之后，
+    且不占满全部名额），再用带租约的 UPDATE 领取提示词，多个进程同时运行也不会重复处理。
+    处理期间定期续约；进程退出或崩溃后，租约过期的提示词被重新领取，已完成的结果不受影响。
+    开启 preempt 时，生成中发现有用户请求在排队就中止当前提示词、让出名额，稍后重新排队。
+    """
+
+    def __init__(self, workers: int, lease: float, max_attempts: int, poll_interval: float, preempt: bool):
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.preempt = preempt
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Event] = None
+        # 本进程正在处理的提示词：提示词 ID -> (任务 ID, 处理任务)
+        self._running: Dict[int, Tuple[int, asyncio.Task]] = {}
+
+    def notify(self) -> None:
+        """有新任务时唤醒空闲的 worker"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_progress(self, timeout: float) -> None:
+        """等待本进程有提示词处理完，最多等待 timeout 秒（其他进程的进度只能靠超时后重新查询）"""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify_progress(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    def cancel_job(self, job_id: int) -> None:
+        """中止本进程中属于该任务的生成（任务状态由调用方先改为 cancelled）"""
+        for running_job_id, task in self._running.values():
+            if running_job_id == job_id:
+                task.cancel()
+
+    def start(self) -> None:
+        """启动 worker"""
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self) -> None:
+        """停止 worker，正在处理的提示词放回待处理，下次启动时继续"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def _claimable(self) -> Q:
+        expired = timezone.now() - timedelta(seconds=self.lease)
+        return Q(status="pending") | Q(status="running", claimed_at__lt=expired)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                claimed = await self._claim()
+            except Exception:
+                logger.exception("Failed to claim batch items")
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            item, slot = claimed
+            task = asyncio.get_running_loop().create_task(self._process(item, slot))
+            self._running[item["id"]] = (item["job_id"], task)
+            batch_items_running.set(len(self._running))
+            try:
+                # 不直接 await task：任务被 cancel_job 取消时不应连带结束 worker
+                await asyncio.wait((task,))
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.wait((task,))
+                del self._running[item["id"]]
+                batch_items_running.set(len(self._running))
+
+    async def _claim(self) -> Optional[Tuple[dict, Slot]]:
+        """拿到下一个提示词所用模型的后台名额，再领取该模型的一个提示词"""
+        head = await BatchItem.filter(
+            self._claimable(), job__status__in=ACTIVE_JOB_STATUSES
+        ).order_by("job_id", "index").limit(1).values_list("job__model", flat=True)
+        if not head:
+            return None
+        model = head[0]
+
+        slot = await scheduler.acquire_background(model)
+        try:
+            # 等待名额期间提示词可能已被其他 worker 领走，按顺序逐个尝试
+            candidates = await BatchItem.filter(
+                self._claimable(), job__status__in=ACTIVE_JOB_STATUSES, job__model=model
+            ).order_by("job_id", "index").limit(self.workers + 1).values(
+                "id", "job_id", "prompt", "attempts", "job__user_id", "job__model", "job__options"
+            )
+            for item in candidates:
+                claimed = await BatchItem.filter(self._claimable(), id=item["id"]).update(
+                    status="running", claimed_at=timezone.now()
+                )
+                if claimed:
+                    await BatchJob.filter(id=item["job_id"], status="queued").update(status="running")
+                    return item, slot
+        except BaseException:
+            slot.release()
+            raise
+        slot.release()
+        return None
+
+    async def _process(self, item: dict, slot: Slot) -> None:
+        renew = asyncio.get_running_loop().create_task(self._renew(item["id"], item["job_id"]))
+        failed = False
+        try:
+            text, stats = await self._generate(item["job__model"], item["prompt"], item["job__options"])
+        except _Preempted:
+            batch_items_preempted.inc()
+            await self._release_item(item["id"])
+        except OllamaError as e:
+            failed = True
+            await self._fail_item(item, e.detail)
+        except asyncio.CancelledError:
+            # 进程退出或任务被取消，放回待处理
+            with anyio.CancelScope(shield=True):
+                await self._release_item(item["id"])
+            raise
+        except Exception as e:
+            logger.exception("Batch item %s failed", item["id"])
+            failed = True
+            await self._fail_item(item, str(e))
+        else:
+            await BatchItem.filter(id=item["id"]).update(
+                status="done",
+                result=compress_result(text),
+                error=None,
+                prompt_eval_count=stats.get("prompt_eval_count"),
+                eval_count=stats.get("eval_count"),
+                claimed_at=None,
+            )
+            await BatchJob.filter(id=item["job_id"]).update(completed=F("completed") + 1)
+            batch_items_completed.inc()
+            batch_tokens.inc(stats.get("eval_count") or 0)
+            # 批量任务只在空闲时段运行，计入用量但不受额度限制
+            usage_ledger.record(item["job__user_id"], item["job__model"], stats)
+        finally:
+            renew.cancel()
+            slot.release()
+        await self._finish_job_if_done(item["job_id"])
+        self._notify_progress()
+        if failed:
+            # Ollama 不可用时不要连续领取、很快耗尽所有提示词的重试次数
+            await asyncio.sleep(self.poll_interval)
+
+    async def _generate(self, model: str, prompt: str, options: Optional[dict]) -> Tuple[str, dict]:
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if options:
+            payload["options"] = options
+        chunks = iter_chunks(await open_stream("/api/generate", payload))
+        parts, stats = [], {}
+        try:
+            async for chunk in chunks:
+                if chunk is None:
+                    continue
+                if "error" in chunk:
+                    raise OllamaError(502, str(chunk["error"]))
+                parts.append(chunk_text(chunk))
+                if chunk.get("done"):
+                    stats = chunk
+                elif self.preempt and scheduler.users_waiting(model):
+                    raise _Preempted()
+        finally:
+            with anyio.CancelScope(shield=True):
+                await chunks.aclose()
+        return "".join(parts), stats
+
+    async def _renew(self, item_id: int, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await BatchItem.filter(id=item_id, status="running").update(claimed_at=timezone.now())
+            # 其他进程取消的任务只能在这里发现
+            if await BatchJob.filter(id=job_id, status="cancelled").exists():
+                self.cancel_job(job_id)
+                return
+
+    async def _release_item(self, item_id: int) -> None:
+        await BatchItem.filter(id=item_id, status="running").update(status="pending", claimed_at=None)
+
+    async def _fail_item(self, item: dict, error: str) -> None:
+        attempts = item["attempts"] + 1
+        if attempts < self.max_attempts:
+            logger.warning("Batch item %s failed (attempt %d), will retry: %s", item["id"], attempts, error)
+            await BatchItem.filter(id=item["id"]).update(status="pending", attempts=attempts, claimed_at=None)
+            return
+        await BatchItem.filter(id=item["id"]).update(
+            status="failed", attempts=attempts, error=error[:500], claimed_at=None
+        )
+        await BatchJob.filter(id=item["job_id"]).update(failed=F("failed") + 1)
+        batch_items_failed.inc()
+
+    async def _finish_job_if_done(self, job_id: int) -> None:
+        if not await BatchItem.filter(job_id=job_id, status__in=("pending", "running")).exists():
+            await BatchJob.filter(id=job_id, status__in=ACTIVE_JOB_STATUSES).update(
+                status="completed", finished_at=timezone.now()
+            )
+
+
+batch_runner = BatchRunner(
+    workers=config.OLLAMA_BATCH_WORKERS,
+    lease=config.OLLAMA_BATCH_LEASE,
+    max_attempts=config.OLLAMA_BATCH_MAX_ATTEMPTS,
+    poll_interval=config.OLLAMA_BATCH_POLL_INTERVAL,
+    preempt=config.OLLAMA_BATCH_PREEMPT,
+)
@@ -0,0 +1,110 @@
+import time
+from typing import AsyncIterator, Optional
+
+import anyio
+from starlette.requests import Request
+
+from src.core.metrics import Counter
+from src.core.ollama.client import chunk_text
+
+
+cancelled_generations = Counter(
+    "ollama_cancelled_generations_total", "客户端断开后被中止的 Ollama 生成次数"
+)
+cancelled_tokens = Counter(
+    "ollama_cancelled_tokens_total", "被中止的生成在中断前已经产出的 token 数"
+)
+tokens_saved = Counter(
+    "ollama_tokens_saved_total", "中止生成估算节省下来的 token 数"
+)
+
+# 流式响应中两次检查客户端是否断开的最小间隔（秒）
+_DISCONNECT_CHECK_INTERVAL = 0.5
+# 已完成生成的平均输出 token 数（指数滑动平均），用于估算中止生成节省的 token
+_EWMA_ALPHA = 0.1
+_avg_completion_tokens: Optional[float] = None
+
+
+def _observe_completion(tokens: int) -> None:
+    global _avg_completion_tokens
+    if _avg_completion_tokens is None:
+        _avg_completion_tokens = float(tokens)
+    else:
+        _avg_completion_tokens += _EWMA_ALPHA * (tokens - _avg_completion_tokens)
+
+
+class GenerationTracker:
+    """
+    跟踪一次 Ollama 流式生成的进度。
+
+    生成在收到 done 块或上游正常结束时视为完成，上游返回错误时视为失败；
+    两者都不是的在 close() 时记为被中止，并按已完成生成的平均长度估算节省的 token 数。
+    """
+
+    def __init__(self):
+        self.tokens = 0
+        self.finished = False
+        self.failed = False
+
+    @property
+    def cancelled(self) -> bool:
+        return not self.finished and not self.failed
+
+    def feed(self, chunk: dict) -> None:
+        """记录一个已解析的 NDJSON 块"""
+        if chunk_text(chunk):
+            self.tokens += 1
+        if chunk.get("done"):
+            self.finished = True
+            _observe_completion(chunk.get("eval_count") or self.tokens)
+
+    def finish(self) -> None:
+        """上游流正常结束（可能没有 done 块）"""
+        self.finished = True
+
+    def fail(self) -> None:
+        """上游在生成中途返回了错误"""
+        self.failed = True
+
+    async def close(self, chunks: AsyncIterator) -> None:
+        """
+        关闭上游流并记录取消统计。
+
+        客户端断开时生成器所在的任务已被取消，这里用 shield 保证上游连接一定会被关闭，
+        Ollama 随即停止生成。
+
+        参数:
+            chunks (AsyncIterator): iter_chunks 返回的异步生成器。
+
+        返回:
+            None
+        """
+        with anyio.CancelScope(shield=True):
+            await chunks.aclose()
+
+        if self.cancelled:
+            cancelled_generations.inc()
+            cancelled_tokens.inc(self.tokens)
+            if _avg_completion_tokens is not None:
+                tokens_saved.inc(max(0.0, _avg_completion_tokens - self.tokens))
+
+
+class DisconnectCheck:
+    """
+    流式响应中主动检查客户端是否断开（部分服务器不会在断开时取消生成器）。
+
+    is_disconnected() 每次都要调用一次 ASGI receive，逐个 token 检查的开销落在最热的路径上；
+    这里最多每隔 interval 秒真正检查一次，其余时候直接返回 False。
+    """
+
+    def __init__(self, request: Request, interval: float = _DISCONNECT_CHECK_INTERVAL):
+        self.request = request
+        self.interval = interval
+        self._next_check = time.monotonic() + interval
+
+    async def disconnected(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.interval
+        return await self.request.is_disconnected()
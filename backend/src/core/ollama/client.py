@@ -0,0 +1,268 @@
+import json
+from typing import AsyncIterator, List, Optional
+
+import anyio
+import httpx
+
+from src.core.ollama import config
+from src.core.ollama.backends import OllamaBackend, backend_failovers, pool
+
+
+# 全局共享的异步 HTTP 客户端（连接池），在应用启动时创建、关闭时释放
+_client: Optional[httpx.AsyncClient] = None
+
+
+class OllamaError(Exception):
+    """Ollama 请求失败（连接失败或返回非 200 状态码）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def init_client() -> None:
+    """
+    创建共享的 Ollama 连接池。
+
+    返回:
+        None
+    """
+    global _client
+    if _client is not None:
+        return
+
+    limits = httpx.Limits(
+        max_connections=config.OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=config.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.OLLAMA_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=config.OLLAMA_CONNECT_TIMEOUT,
+        read=config.OLLAMA_READ_TIMEOUT,
+        write=config.OLLAMA_WRITE_TIMEOUT,
+        pool=config.OLLAMA_POOL_TIMEOUT,
+    )
+    _client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+async def close_client() -> None:
+    """
+    关闭共享的 Ollama 连接池。
+
+    返回:
+        None
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """返回共享的连接池，未初始化时抛出 RuntimeError"""
+    if _client is None:
+        raise RuntimeError("Ollama client is not initialized, call init_client() first")
+    return _client
+
+
+class OllamaStream:
+    """
+    已经收到首行数据的 Ollama 流式响应，绑定到具体的后端。
+
+    aclose() 可重复调用，负责关闭连接并归还后端的未完成请求计数。
+    """
+
+    def __init__(self, backend: OllamaBackend, model: str, response: httpx.Response,
+                 lines: AsyncIterator[str], first_line: str):
+        self.backend = backend
+        self.model = model
+        self.response = response
+        self._lines = lines
+        self._first_line = first_line
+        self._closed = False
+
+    async def lines(self) -> AsyncIterator[str]:
+        yield self._first_line
+        async for line in self._lines:
+            if line:
+                yield line
+        # 完整读完说明后端和模型都可用
+        pool.mark_success(self.backend, self.model)
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.backend.outstanding -= 1
+        await self.response.aclose()
+
+
+async def _first_line(lines: AsyncIterator[str]) -> str:
+    async for line in lines:
+        if line:
+            return line
+    raise OllamaError(502, "Ollama closed the stream without any data")
+
+
+async def open_stream(path: str, payload: dict) -> OllamaStream:
+    """
+    向 Ollama 发起流式请求，直到收到第一行数据。
+
+    按 BackendPool 的优先级挑选后端；在收到第一行数据之前发生的连接失败、
+    非 200 状态码或错误消息都会切换到下一个后端重试。
+
+    参数:
+        path (str): Ollama 接口路径，例如 "/api/generate"。
+        payload (dict): 请求体，其中 model 字段用于选择后端。
+
+    返回:
+        OllamaStream: 已读取首行的流式响应，调用方负责关闭。
+
+    异常:
+        OllamaError: 所有后端都失败，或请求本身无效（400）。
+    """
+    client = get_client()
+    model = payload.get("model", "")
+    error = OllamaError(502, "No Ollama backend available")
+
+    for attempt, backend in enumerate(pool.candidates(model)):
+        if attempt:
+            backend_failovers.inc()
+        backend.outstanding += 1
+        response = None
+        try:
+            request = client.build_request("POST", backend.url(path), json=payload)
+            response = await client.send(request, stream=True)
+            if response.status_code != 200:
+                body = await response.aread()
+                raise OllamaError(response.status_code, body.decode("utf-8", errors="replace"))
+            lines = response.aiter_lines()
+            first_line = await _first_line(lines)
+            message = _try_parse(first_line).get("error")
+            if message:
+                raise OllamaError(502, message)
+            return OllamaStream(backend, model, response, lines, first_line)
+        except (httpx.HTTPError, OllamaError) as e:
+            error = e if isinstance(e, OllamaError) else OllamaError(502, f"{type(e).__name__}: {e}")
+            await _abandon(backend, response)
+            if error.status_code == 400:
+                # 请求本身有问题，换后端也没用
+                raise error
+            if error.status_code != 404:
+                # 404 只说明该后端没有这个模型，不算后端故障
+                pool.mark_failure(backend)
+        except BaseException:
+            await _abandon(backend, response)
+            raise
+
+    raise error
+
+
+async def _abandon(backend: OllamaBackend, response: Optional[httpx.Response]) -> None:
+    backend.outstanding -= 1
+    if response is not None:
+        with anyio.CancelScope(shield=True):
+            await response.aclose()
+
+
+def _try_parse(line: str) -> dict:
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+async def iter_chunks(stream: OllamaStream) -> AsyncIterator[Optional[dict]]:
+    """
+    逐行异步解析 Ollama 返回的 NDJSON，结束或中断时关闭响应。
+
+    参数:
+        stream (OllamaStream): open_stream 返回的流式响应。
+
+    返回:
+        AsyncIterator[Optional[dict]]: 每行解析出的 JSON 对象，无法解析的行产出 None。
+    """
+    try:
+        async for line in stream.lines():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+    finally:
+        await stream.aclose()
+
+
+def chunk_text(chunk: dict) -> str:
+    """取出 /api/generate 或 /api/chat 返回块中的文本"""
+    if "message" in chunk:
+        return (chunk.get("message") or {}).get("content", "")
+    return chunk.get("response", "")
+
+
+async def generate_text(model: str, prompt: str, **options) -> str:
+    """
+    生成一段完整文本（内部仍走流式接口，以复用后端选择和故障转移）。
+
+    参数:
+        model (str): 模型名称。
+        prompt (str): 提示词。
+        **options: 其他请求体字段，例如 options、keep_alive。
+
+    返回:
+        str: 生成的完整文本。
+
+    异常:
+        OllamaError: 所有后端都失败。
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True, **options}
+    parts = []
+    async for chunk in iter_chunks(await open_stream("/api/generate", payload)):
+        if chunk is not None:
+            parts.append(chunk_text(chunk))
+    return "".join(parts)
+
+
+async def embed(model: str, inputs: List[str]) -> List[List[float]]:
+    """
+    调用 /api/embed 批量生成向量，按与 open_stream 相同的优先级挑选后端并故障转移。
+
+    参数:
+        model (str): 向量模型名称。
+        inputs (List[str]): 要生成向量的文本，过长的由 Ollama 截断。
+
+    返回:
+        List[List[float]]: 与 inputs 一一对应的向量。
+
+    异常:
+        OllamaError: 所有后端都失败，或请求本身无效（400）。
+    """
+    client = get_client()
+    error = OllamaError(502, "No Ollama backend available")
+
+    for attempt, backend in enumerate(pool.candidates(model)):
+        if attempt:
+            backend_failovers.inc()
+        backend.outstanding += 1
+        try:
+            response = await client.post(
+                backend.url("/api/embed"), json={"model": model, "input": inputs, "truncate": True}
+            )
+            if response.status_code != 200:
+                raise OllamaError(response.status_code, response.text)
+            embeddings = response.json().get("embeddings")
+            if not isinstance(embeddings, list) or len(embeddings) != len(inputs):
+                raise OllamaError(502, "Malformed embeddings response")
+            pool.mark_success(backend, model)
+            return embeddings
+        except (httpx.HTTPError, ValueError, OllamaError) as e:
+            error = e if isinstance(e, OllamaError) else OllamaError(502, f"{type(e).__name__}: {e}")
+            if error.status_code == 400:
+                raise error
+            if error.status_code != 404:
+                pool.mark_failure(backend)
+        finally:
+            backend.outstanding -= 1
+
+    raise error
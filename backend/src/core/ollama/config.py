@@ -0,0 +1,161 @@
+import os
+
+
+def _base_urls() -> list:
+    urls = os.environ.get("OLLAMA_BASE_URLS")
+    if not urls:
+        # 兼容旧的 OLLAMA_API_URL（完整的 /api/generate 地址）
+        api_url = os.environ.get("OLLAMA_API_URL", "http://ollama:11434/api/generate")
+        urls = api_url.split("/api/", 1)[0]
+    return [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+
+
+# Ollama 后端地址列表，逗号分隔，例如 "http://gpu1:11434,http://gpu2:11434"
+OLLAMA_BASE_URLS = _base_urls()
+# 健康检查间隔（秒）
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "5"))
+# 健康检查请求的超时时间（秒）
+OLLAMA_HEALTH_TIMEOUT = float(os.environ.get("OLLAMA_HEALTH_TIMEOUT", "2"))
+# 连续失败多少次后将后端摘除，直到健康检查再次成功
+OLLAMA_EJECT_AFTER_FAILURES = int(os.environ.get("OLLAMA_EJECT_AFTER_FAILURES", "2"))
+
+# 连接池中同时打开的最大连接数（所有 Ollama 请求共享）
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "100"))
+# 连接池中保持空闲复用的最大连接数
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# 空闲连接的保活时间（秒）
+OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY", "30"))
+
+# 建立连接的超时时间（秒）
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+# 两次读取之间的超时时间（秒）。模型冷加载可能很慢，默认给得比较宽松
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+# 发送请求体的超时时间（秒）
+OLLAMA_WRITE_TIMEOUT = float(os.environ.get("OLLAMA_WRITE_TIMEOUT", "10"))
+# 等待连接池空出连接的超时时间（秒）
+OLLAMA_POOL_TIMEOUT = float(os.environ.get("OLLAMA_POOL_TIMEOUT", "10"))
+
+# 每个模型默认允许同时进行的生成数
+OLLAMA_MODEL_CONCURRENCY = int(os.environ.get("OLLAMA_MODEL_CONCURRENCY", "4"))
+# 按模型覆盖并发上限，格式为 "model=n,model=n"，例如 "deepseek-r1:latest=2"
+OLLAMA_MODEL_CONCURRENCY_OVERRIDES = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.rpartition("=")
+        for item in os.environ.get("OLLAMA_MODEL_CONCURRENCY_OVERRIDES", "").split(",")
+        if item.strip()
+    )
+}
+# 每个模型最多排队等待的请求数，超过后直接返回 429
+OLLAMA_MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", "64"))
+
+# 多轮对话历史（包括摘要）允许占用的 token 预算
+OLLAMA_HISTORY_TOKEN_BUDGET = int(os.environ.get("OLLAMA_HISTORY_TOKEN_BUDGET", "2048"))
+# 其中滚动摘要最多占用的 token 数
+OLLAMA_SUMMARY_TOKEN_BUDGET = int(os.environ.get("OLLAMA_SUMMARY_TOKEN_BUDGET", "512"))
+# 历史窗口最多保留的轮数
+OLLAMA_HISTORY_MAX_TURNS = int(os.environ.get("OLLAMA_HISTORY_MAX_TURNS", "20"))
+# 进程内最多缓存多少个会话的历史
+OLLAMA_HISTORY_CACHE_SESSIONS = int(os.environ.get("OLLAMA_HISTORY_CACHE_SESSIONS", "1024"))
+# 生成滚动摘要使用的模型，留空则使用会话当前的模型
+OLLAMA_SUMMARY_MODEL = os.environ.get("OLLAMA_SUMMARY_MODEL", "")
+
+# 是否复用 Ollama 返回的 context 向量，避免每轮重新预填充整段历史
+OLLAMA_CONTEXT_REUSE = os.environ.get("OLLAMA_CONTEXT_REUSE", "1") == "1"
+# context 缓存占用内存的上限（字节）
+OLLAMA_CONTEXT_CACHE_BYTES = int(os.environ.get("OLLAMA_CONTEXT_CACHE_BYTES", str(64 * 1024 * 1024)))
+# context 超过这么多 token 时不再复用，退回到按预算组装的历史窗口
+OLLAMA_CONTEXT_MAX_TOKENS = int(os.environ.get("OLLAMA_CONTEXT_MAX_TOKENS", "8192"))
+# 从内存淘汰的 context 是否写入数据库，未命中时再读回
+OLLAMA_CONTEXT_SPILL = os.environ.get("OLLAMA_CONTEXT_SPILL", "0") == "1"
+
+# /chat/stream 响应缓存占用内存的上限（字节），设为 0 关闭缓存（相同请求仍会合并）
+OLLAMA_RESPONSE_CACHE_BYTES = int(os.environ.get("OLLAMA_RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# 响应缓存的过期时间（秒）
+OLLAMA_RESPONSE_CACHE_TTL = float(os.environ.get("OLLAMA_RESPONSE_CACHE_TTL", "600"))
+
+# 流式响应合并相邻 token 的时间窗口（秒），设为 0 则每个 token 单独发送
+OLLAMA_STREAM_COALESCE_WINDOW = float(os.environ.get("OLLAMA_STREAM_COALESCE_WINDOW", "0.02"))
+# 合并的 token 累计到这么多字节时立即发送，不再等待时间窗口结束
+OLLAMA_STREAM_COALESCE_BYTES = int(os.environ.get("OLLAMA_STREAM_COALESCE_BYTES", "512"))
+
+# 是否为历史对话生成向量，并允许会话请求带上用户在其他会话中的相关内容
+OLLAMA_MEMORY_ENABLED = os.environ.get("OLLAMA_MEMORY_ENABLED", "0") == "1"
+# 生成向量使用的模型，更换后已有的索引会被清空重建
+OLLAMA_EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text:latest")
+# 每次 /api/embed 请求最多携带的对话轮数
+OLLAMA_EMBED_BATCH_SIZE = int(os.environ.get("OLLAMA_EMBED_BATCH_SIZE", "32"))
+# 没有新对话时，后台任务检查新对话的间隔（秒）
+OLLAMA_EMBED_INTERVAL = float(os.environ.get("OLLAMA_EMBED_INTERVAL", "2"))
+# 向量索引文件所在的目录（每个用户一组文件）
+OLLAMA_MEMORY_DIR = os.environ.get("OLLAMA_MEMORY_DIR", "./data/memory")
+# 每轮最多注入的相关历史条数
+OLLAMA_MEMORY_TOP_K = int(os.environ.get("OLLAMA_MEMORY_TOP_K", "4"))
+# 注入的相关历史允许占用的 token 预算
+OLLAMA_MEMORY_TOKEN_BUDGET = int(os.environ.get("OLLAMA_MEMORY_TOKEN_BUDGET", "512"))
+# 余弦相似度低于该值的历史不注入
+OLLAMA_MEMORY_MIN_SCORE = float(os.environ.get("OLLAMA_MEMORY_MIN_SCORE", "0.3"))
+
+# 是否根据会话的第一轮对话自动生成标题
+OLLAMA_TITLE_ENABLED = os.environ.get("OLLAMA_TITLE_ENABLED", "1") == "1"
+# 生成标题使用的模型（建议用小模型），留空则使用该会话第一轮的模型
+OLLAMA_TITLE_MODEL = os.environ.get("OLLAMA_TITLE_MODEL", "")
+# 同时生成标题的后台任务数
+OLLAMA_TITLE_WORKERS = int(os.environ.get("OLLAMA_TITLE_WORKERS", "1"))
+# 一次请求最多为多少个会话生成标题
+OLLAMA_TITLE_BATCH_SIZE = int(os.environ.get("OLLAMA_TITLE_BATCH_SIZE", "8"))
+# 凑批次最多等待的时间（秒）
+OLLAMA_TITLE_BATCH_WAIT = float(os.environ.get("OLLAMA_TITLE_BATCH_WAIT", "0.5"))
+# 最多排队等待生成标题的会话数，超过后新的会话保留默认标题
+OLLAMA_TITLE_MAX_PENDING = int(os.environ.get("OLLAMA_TITLE_MAX_PENDING", "1000"))
+
+# 会话生成与 HTTP 连接解耦：每次生成的回放缓冲区大小（字节），超出后丢弃最早的内容
+OLLAMA_GENERATION_BUFFER_BYTES = int(os.environ.get("OLLAMA_GENERATION_BUFFER_BYTES", str(1024 * 1024)))
+# 所有生成的回放缓冲区合计占用内存的上限（字节），超出时先淘汰已结束的生成
+OLLAMA_GENERATION_MAX_BYTES = int(os.environ.get("OLLAMA_GENERATION_MAX_BYTES", str(64 * 1024 * 1024)))
+# 生成结束后回放缓冲区保留的时间（秒），期间断开的客户端仍可接回
+OLLAMA_GENERATION_TTL = float(os.environ.get("OLLAMA_GENERATION_TTL", "120"))
+# 客户端全部断开后生成继续运行的时间（秒），超时无人接回则中止；设为 0 则断开即中止
+OLLAMA_GENERATION_DETACH_TIMEOUT = float(os.environ.get("OLLAMA_GENERATION_DETACH_TIMEOUT", "60"))
+
+# 是否在本进程中运行批量推理任务的后台 worker
+OLLAMA_BATCH_ENABLED = os.environ.get("OLLAMA_BATCH_ENABLED", "1") == "1"
+# 同时处理的提示词数上限，实际并发还受调度器后台名额的限制
+OLLAMA_BATCH_WORKERS = int(os.environ.get("OLLAMA_BATCH_WORKERS", "2"))
+# 单个任务最多包含的提示词数
+OLLAMA_BATCH_MAX_ITEMS = int(os.environ.get("OLLAMA_BATCH_MAX_ITEMS", "10000"))
+# 处理中提示词的租约（秒），处理期间定期续约；进程退出后租约过期的提示词会被重新领取
+OLLAMA_BATCH_LEASE = float(os.environ.get("OLLAMA_BATCH_LEASE", "60"))
+# 单个提示词最多尝试的次数，之后标记为失败
+OLLAMA_BATCH_MAX_ATTEMPTS = int(os.environ.get("OLLAMA_BATCH_MAX_ATTEMPTS", "3"))
+# 没有待处理的提示词时检查新任务的间隔（秒）
+OLLAMA_BATCH_POLL_INTERVAL = float(os.environ.get("OLLAMA_BATCH_POLL_INTERVAL", "2"))
+# 有用户请求在排队时是否中止正在生成的批量提示词，让出名额后再重新排队
+OLLAMA_BATCH_PREEMPT = os.environ.get("OLLAMA_BATCH_PREEMPT", "1") == "1"
+
+# 启动时预热并保持常驻的模型，逗号分隔
+OLLAMA_WARM_MODELS = [m.strip() for m in os.environ.get("OLLAMA_WARM_MODELS", "").split(",") if m.strip()]
+# 预热和保活请求中的 keep_alive，Ollama 在模型空闲这么久后卸载它
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# 向常驻模型发送保活请求的间隔（秒），应小于 OLLAMA_KEEP_ALIVE
+OLLAMA_RESIDENCY_INTERVAL = float(os.environ.get("OLLAMA_RESIDENCY_INTERVAL", "240"))
+# 额外常驻最近请求最多的几个模型，设为 0 只常驻 OLLAMA_WARM_MODELS
+OLLAMA_PIN_TOP_MODELS = int(os.environ.get("OLLAMA_PIN_TOP_MODELS", "0"))
+# 是否主动卸载最近没有请求、也不需要常驻的模型，给其他模型腾出显存
+OLLAMA_EVICT_IDLE_MODELS = os.environ.get("OLLAMA_EVICT_IDLE_MODELS", "0") == "1"
+
+# 按用户和模型累计的 token 用量写入数据库的间隔（秒）
+OLLAMA_USAGE_FLUSH_INTERVAL = float(os.environ.get("OLLAMA_USAGE_FLUSH_INTERVAL", "30"))
+# 每个用户每分钟可用的 token 数（提示词加回答），设为 0 不限制
+OLLAMA_USER_TOKENS_PER_MINUTE = int(os.environ.get("OLLAMA_USER_TOKENS_PER_MINUTE", "0"))
+# 令牌桶容量，即允许的突发用量，默认等于每分钟的额度
+OLLAMA_USER_TOKEN_BURST = int(os.environ.get("OLLAMA_USER_TOKEN_BURST", str(OLLAMA_USER_TOKENS_PER_MINUTE)))
+# 按用户覆盖每分钟的额度，格式为 "user_id=n,user_id=n"，n 为 0 表示不限制
+OLLAMA_USER_QUOTA_OVERRIDES = {
+    int(user_id): int(limit)
+    for user_id, _, limit in (
+        item.rpartition("=")
+        for item in os.environ.get("OLLAMA_USER_QUOTA_OVERRIDES", "").split(",")
+        if item.strip()
+    )
+}
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Optional, Set, Tuple
+
+from src.core.database.models import SessionContext
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+
+
+logger = logging.getLogger(__name__)
+
+context_cache_hits = Counter("context_cache_hits_total", "命中缓存、直接复用 context 的轮次")
+context_cache_misses = Counter("context_cache_misses_total", "没有可用 context、需要预填充历史的轮次")
+context_cache_spills = Counter("context_cache_spills_total", "淘汰时写入数据库的 context 数")
+context_cache_bytes = Gauge("context_cache_bytes", "context 缓存当前占用的字节数")
+
+# 4 字节有符号整数，足够容纳各类模型的词表大小
+_TYPECODE = "i"
+
+
+def pack_context(tokens: Iterable[int]) -> array:
+    """把 Ollama 返回的 token 列表压成紧凑的整数数组"""
+    return array(_TYPECODE, tokens)
+
+
+class ContextCache:
+    """
+    按会话缓存 Ollama /api/generate 返回的 context 向量。
+
+    向量以 array('i') 存储（每个 token 4 字节，而 Python 列表约 36 字节），
+    按总字节数做 LRU 淘汰；开启 spill 后被淘汰的向量写入 SessionContext 表，
+    未命中时再读回。
+
+    每个向量记下它覆盖到的会话轮数。写入的库里的向量可能来自其他工作进程或重启之前，
+    会话此后又写入了新的轮次（message_count 更大）时向量已经过时，不再复用。
+    """
+
+    def __init__(self, max_bytes: int, max_tokens: int, spill: bool = False):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.spill = spill
+        self.bytes = 0
+        self._entries: "OrderedDict[int, Tuple[str, array, int]]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, session_id: int, model: str, message_count: int) -> Optional[array]:
+        """
+        取出会话可复用的 context。
+
+        参数:
+            session_id (int): 会话 ID。
+            model (str): 本轮使用的模型，与生成 context 的模型不同则不可复用。
+            message_count (int): 会话当前已写入的轮数，超过 context 覆盖的轮数则不可复用。
+
+        返回:
+            Optional[array]: context 向量，没有可用的则返回 None。
+        """
+        entry = self._entries.get(session_id)
+        if entry is None and self.spill:
+            entry = await self._load(session_id)
+        if entry is None or entry[0] != model or message_count > entry[2]:
+            context_cache_misses.inc()
+            return None
+        self._entries.move_to_end(session_id)
+        context_cache_hits.inc()
+        return entry[1]
+
+    def put(self, session_id: int, model: str, tokens: Iterable[int], turns: int) -> None:
+        """
+        保存一轮生成结束后返回的 context，超过 max_tokens 的直接丢弃。
+
+        参数:
+            session_id (int): 会话 ID。
+            model (str): 生成该 context 的模型。
+            tokens (Iterable[int]): Ollama 返回的 context。
+            turns (int): context 覆盖的会话轮数（包括本轮）。
+
+        返回:
+            None
+        """
+        packed = pack_context(tokens)
+        self._discard(session_id)
+        if not packed or len(packed) > self.max_tokens:
+            return
+        self._store(session_id, model, packed, turns)
+        while self.bytes > self.max_bytes and self._entries:
+            evicted_id, (evicted_model, evicted, evicted_turns) = self._entries.popitem(last=False)
+            self.bytes -= _nbytes(evicted)
+            if self.spill:
+                self._spawn(self._save(evicted_id, evicted_model, evicted, evicted_turns))
+        context_cache_bytes.set(self.bytes)
+
+    def invalidate(self, session_id: int) -> None:
+        """丢弃会话的 context（例如本轮被截断，缓存的向量已经落后于真实历史）"""
+        self._discard(session_id)
+        if self.spill:
+            self._spawn(SessionContext.filter(session_id=session_id).delete())
+
+    def _discard(self, session_id: int) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= _nbytes(entry[1])
+            context_cache_bytes.set(self.bytes)
+
+    def _store(self, session_id: int, model: str, packed: array, turns: int) -> None:
+        self._entries[session_id] = (model, packed, turns)
+        self.bytes += _nbytes(packed)
+
+    async def _load(self, session_id: int) -> Optional[Tuple[str, array, int]]:
+        row = await SessionContext.get_or_none(session_id=session_id)
+        if row is None:
+            return None
+        packed = array(_TYPECODE)
+        packed.frombytes(row.tokens)
+        self._store(session_id, row.model, packed, row.turns)
+        context_cache_bytes.set(self.bytes)
+        return row.model, packed, row.turns
+
+    async def _save(self, session_id: int, model: str, packed: array, turns: int) -> None:
+        try:
+            updated = await SessionContext.filter(session_id=session_id).update(
+                model=model, tokens=packed.tobytes(), turns=turns
+            )
+            if not updated:
+                await SessionContext.create(
+                    session_id=session_id, model=model, tokens=packed.tobytes(), turns=turns
+                )
+            context_cache_spills.inc()
+        except Exception:
+            logger.exception("Failed to spill context of session %s", session_id)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def _nbytes(packed: array) -> int:
+    return packed.itemsize * len(packed)
+
+
+context_cache = ContextCache(
+    max_bytes=config.OLLAMA_CONTEXT_CACHE_BYTES,
+    max_tokens=config.OLLAMA_CONTEXT_MAX_TOKENS,
+    spill=config.OLLAMA_CONTEXT_SPILL,
+)
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.streaming import Event, error_event, text_length
+
+
+logger = logging.getLogger(__name__)
+
+generations_started = Counter("generations_started_total", "与 HTTP 连接解耦运行的会话生成数")
+generations_reattached = Counter("generations_reattached_total", "断开后重新接上进行中或刚结束的生成的请求数")
+generations_abandoned = Counter("generations_abandoned_total", "客户端断开后超时无人接回而中止的生成数")
+generation_events_evicted = Counter("generation_events_evicted_total", "超出缓冲区上限被丢弃的回放事件数")
+generations_running = Gauge("generations_running", "正在运行的会话生成数")
+generation_buffer_bytes = Gauge("generation_buffer_bytes", "所有生成的回放缓冲区合计占用的字节数")
+
+# 每个缓冲事件除文本外的大致内存开销（元组、字典和偏移量）
+_EVENT_OVERHEAD = 200
+
+
+class OffsetEvictedError(Exception):
+    """请求的偏移量之前的内容已经被移出回放缓冲区"""
+
+
+def _event_size(event: Event) -> int:
+    kind, data = event
+    text = data.get("text") or data.get("detail") or ""
+    return len(text.encode("utf-8")) + _EVENT_OVERHEAD
+
+
+class Generation:
+    """
+    一次与 HTTP 连接解耦的生成及其回放缓冲区。
+
+    事件按顺序带上偏移量（在 text 格式响应中的结束位置，按字符计）存入缓冲区，
+    超出 max_bytes 时丢弃最早的事件。客户端从任意仍在缓冲区中的偏移量接入，
+    先收到错过的部分，再跟随后续的生成。
+    """
+
+    def __init__(self, registry: "GenerationRegistry", generation_id: str, user_id: int, session_id: int):
+        self.registry = registry
+        self.id = generation_id
+        self.user_id = user_id
+        self.session_id = session_id
+        # (起始偏移量, 事件, 字节数)，_dropped 是已丢弃的事件数，即 _events[0] 的序号
+        self._events: List[Tuple[int, Event, int]] = []
+        self._dropped = 0
+        self.offset = 0
+        self.bytes = 0
+        self.done = False
+        # 上游生成完整结束（而不是出错或被中止）
+        self.completed = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._detach_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def first_offset(self) -> int:
+        """缓冲区中最早内容的偏移量，更早的内容已无法回放"""
+        return self._events[0][0] if self._events else self.offset
+
+    def push(self, event: Event) -> None:
+        """追加一个事件，token 和 error 事件的数据中加上结束偏移量"""
+        start = self.offset
+        self.offset += text_length(event)
+        kind, data = event
+        if kind in ("token", "error"):
+            event = kind, {**data, "offset": self.offset}
+        size = _event_size(event)
+        self._events.append((start, event, size))
+        self.bytes += size
+        self.registry._resize(size)
+        if self.bytes > self.registry.buffer_bytes:
+            self.trim(self.registry.buffer_bytes * 3 // 4)
+        self._notify()
+
+    def trim(self, max_bytes: int) -> int:
+        """
+        从最早的事件开始丢弃，直到缓冲区不超过 max_bytes（至少保留最后一个事件）。
+
+        参数:
+            max_bytes (int): 目标字节数。
+
+        返回:
+            int: 释放的字节数。
+        """
+        count = freed = 0
+        while self.bytes - freed > max_bytes and count < len(self._events) - 1:
+            freed += self._events[count][2]
+            count += 1
+        if count:
+            del self._events[:count]
+            self._dropped += count
+            self.bytes -= freed
+            self.registry._resize(-freed)
+            generation_events_evicted.inc(count)
+        return freed
+
+    def finish(self, completed: bool) -> None:
+        self.done = True
+        self.completed = completed
+        self.finished_at = time.monotonic()
+        self._cancel_detach_timer()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def follow(self, offset: int = 0) -> "Follower":
+        """
+        从指定偏移量接入生成。
+
+        参数:
+            offset (int): 客户端已经收到的内容长度（text 格式的字符数，或最后一个事件的 offset）。
+
+        返回:
+            Follower: 接入句柄，迭代 events() 读取事件，结束后 leave()。
+
+        异常:
+            OffsetEvictedError: offset 之后的内容有一部分已不在缓冲区中。
+            ValueError: offset 超过了目前已生成的内容。
+        """
+        if offset > self.offset:
+            raise ValueError(f"Offset {offset} is beyond the generated output ({self.offset})")
+        if offset < self.first_offset:
+            raise OffsetEvictedError(f"Output before offset {self.first_offset} is no longer buffered")
+        # 找到第一个没有完整收到的事件；没有长度的事件（stats）在偏移量处及之后的都重新发送
+        sequence, skip = self._dropped + len(self._events), 0
+        for index, (start, event, _) in enumerate(self._events):
+            end = start + text_length(event)
+            if end > offset or (end == start and start >= offset):
+                sequence, skip = self._dropped + index, max(0, offset - start)
+                break
+        self.subscribers += 1
+        self._cancel_detach_timer()
+        return Follower(self, sequence, skip)
+
+    def _leave(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers or self.done:
+            return
+        timeout = self.registry.detach_timeout
+        if timeout > 0:
+            self._detach_timer = asyncio.get_running_loop().call_later(timeout, self._abandon)
+        else:
+            self._abandon()
+
+    def _abandon(self) -> None:
+        self._detach_timer = None
+        if not self.subscribers and not self.done and self.task is not None:
+            # 没有人在听，也没有人回来，中止上游生成
+            generations_abandoned.inc()
+            self.task.cancel()
+
+    def _cancel_detach_timer(self) -> None:
+        if self._detach_timer is not None:
+            self._detach_timer.cancel()
+            self._detach_timer = None
+
+
+class Follower:
+    """一个客户端对 Generation 的接入，leave() 可重复调用"""
+
+    def __init__(self, generation: Generation, sequence: int, skip: int):
+        self.generation = generation
+        self._sequence = sequence
+        # 第一个事件中客户端已经收到的字符数
+        self._skip = skip
+        self._left = False
+
+    async def events(self) -> AsyncIterator[Event]:
+        generation = self.generation
+        try:
+            while True:
+                changed = generation._changed
+                while self._sequence < generation._dropped + len(generation._events):
+                    if self._sequence < generation._dropped:
+                        # 客户端读得太慢，要读的内容已被丢弃
+                        yield error_event("Replay buffer overrun")
+                        return
+                    _, (kind, data), _ = generation._events[self._sequence - generation._dropped]
+                    self._sequence += 1
+                    if self._skip:
+                        data = {**data, "text": data["text"][self._skip:]} if kind == "token" else data
+                        self._skip = 0
+                    yield kind, data
+                if generation.done:
+                    return
+                await changed.wait()
+        finally:
+            self.leave()
+
+    def leave(self) -> None:
+        if not self._left:
+            self._left = True
+            self.generation._leave()
+
+
+class GenerationRegistry:
+    """
+    进程内所有与连接解耦的生成。
+
+    生成在独立任务中运行，客户端断开不影响生成；全部断开超过 detach_timeout 秒仍无人接回才中止。
+    结束的生成保留 ttl 秒供断开的客户端取回剩余内容；缓冲区合计超过 max_bytes 时
+    先淘汰最早结束的生成，仍然超出则从最大的缓冲区开始丢弃最早的内容。
+    """
+
+    def __init__(self, buffer_bytes: int, max_bytes: int, ttl: float, detach_timeout: float):
+        self.buffer_bytes = buffer_bytes
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.detach_timeout = detach_timeout
+        self.bytes = 0
+        self._running: Dict[str, Generation] = {}
+        # 已结束的生成，按结束时间排序
+        self._finished: "OrderedDict[str, Generation]" = OrderedDict()
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        """返回进行中或仍在保留期内的生成"""
+        return self._running.get(generation_id) or self._finished.get(generation_id)
+
+    def start(
+        self, user_id: int, session_id: int, run: Callable[[Generation], Awaitable[bool]]
+    ) -> Generation:
+        """
+        在独立任务中开始一次生成。
+
+        参数:
+            user_id (int): 会话所属的用户。
+            session_id (int): 会话 ID。
+            run (Callable[[Generation], Awaitable[bool]]): 执行生成、把事件 push() 到 Generation 的协程函数，
+                返回生成是否完整结束。
+
+        返回:
+            Generation: 新的生成，调用方应立即 follow() 接入。
+        """
+        generation = Generation(self, secrets.token_urlsafe(16), user_id, session_id)
+        self._running[generation.id] = generation
+        generations_started.inc()
+        generations_running.set(len(self._running))
+        generation.task = asyncio.get_running_loop().create_task(self._run(generation, run))
+        return generation
+
+    async def _run(self, generation: Generation, run: Callable[[Generation], Awaitable[bool]]) -> None:
+        completed = False
+        try:
+            completed = await run(generation)
+        except Exception:
+            logger.exception("Generation %s failed", generation.id)
+            generation.push(error_event("Ollama API error"))
+        finally:
+            self._running.pop(generation.id, None)
+            generations_running.set(len(self._running))
+            generation.finish(completed)
+            self._finished[generation.id] = generation
+            asyncio.get_running_loop().call_later(self.ttl, self._evict, generation.id)
+
+    def _evict(self, generation_id: str) -> None:
+        generation = self._finished.pop(generation_id, None)
+        if generation is not None:
+            # 还在读取的客户端会收到 Replay buffer overrun
+            generation._dropped += len(generation._events)
+            generation._events.clear()
+            self._resize(-generation.bytes)
+            generation.bytes = 0
+
+    def _resize(self, delta: int) -> None:
+        self.bytes += delta
+        generation_buffer_bytes.set(self.bytes)
+        if delta > 0 and self.bytes > self.max_bytes:
+            self._shrink()
+
+    def _shrink(self) -> None:
+        while self.bytes > self.max_bytes and self._finished:
+            self._evict(next(iter(self._finished)))
+        for generation in sorted(self._running.values(), key=lambda g: g.bytes, reverse=True):
+            if self.bytes <= self.max_bytes:
+                break
+            generation.trim(max(0, generation.bytes - (self.bytes - self.max_bytes)))
+
+    async def drain(self, timeout: float) -> int:
+        """
+        等待进行中的生成结束，包括客户端已断开、还在等人接回的生成。
+
+        参数:
+            timeout (float): 最长等待的秒数。
+
+        返回:
+            int: 超时仍未结束的生成数。
+        """
+        tasks = [generation.task for generation in self._running.values() if generation.task is not None]
+        if tasks and timeout > 0:
+            await asyncio.wait(tasks, timeout=timeout)
+        return sum(1 for task in tasks if not task.done())
+
+    async def stop(self) -> None:
+        """中止所有进行中的生成，已生成的部分按截断保存"""
+        tasks = [generation.task for generation in self._running.values() if generation.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+generation_registry = GenerationRegistry(
+    buffer_bytes=config.OLLAMA_GENERATION_BUFFER_BYTES,
+    max_bytes=config.OLLAMA_GENERATION_MAX_BYTES,
+    ttl=config.OLLAMA_GENERATION_TTL,
+    detach_timeout=config.OLLAMA_GENERATION_DETACH_TIMEOUT,
+)
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Set, Tuple
+
+from src.core.database.models import ChatSession, Conversation
+from src.core.metrics import Counter
+from src.core.ollama import config
+from src.core.ollama.client import OllamaError, generate_text
+from src.core.ollama.context_cache import context_cache
+from src.core.ollama.scheduler import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+history_cache_hits = Counter("history_cache_hits_total", "会话历史命中进程内缓存的次数")
+history_cache_misses = Counter("history_cache_misses_total", "会话历史未命中缓存、需要读库的次数")
+history_summaries = Counter("history_summaries_total", "滚动摘要的更新次数")
+history_cache_stale = Counter("history_cache_stale_total", "会话在其他工作进程中有了新的轮次、缓存作废重读的次数")
+
+SUMMARY_PROMPT = (
+    "请把下面的对话压缩成一段简洁的摘要，保留用户的目标、关键事实和结论，"
+    "不超过 {limit} 个字，只输出摘要本身。\n\n"
+    "已有摘要：\n{summary}\n\n新增对话：\n{transcript}"
+)
+
+Turn = Tuple[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数：中日韩字符约一字一个 token，其余约四个字符一个 token。
+
+    参数:
+        text (str): 要估算的文本。
+
+    返回:
+        int: 估算的 token 数。
+    """
+    wide = sum(1 for ch in text if ch >= "\u2e80")
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _turn_tokens(turn: Turn) -> int:
+    return estimate_tokens(turn[0]) + estimate_tokens(turn[1])
+
+
+def _transcript(turns: List[Turn]) -> str:
+    return "\n".join(f"用户：{user}\n助手：{ai}" for user, ai in turns)
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    """从头部裁剪文本，保留最近的内容直到满足 token 预算"""
+    while text and estimate_tokens(text) > budget:
+        text = text[max(1, len(text) // 8):]
+    return text
+
+
+class SessionHistory:
+    """一个会话在进程内缓存的历史：最近若干轮原文加上更早轮次的滚动摘要"""
+
+    __slots__ = ("turns", "tokens", "summary", "pending", "model", "count")
+
+    def __init__(self, turns: List[Turn], summary: str = "", count: int = 0):
+        self.turns: Deque[Turn] = deque(turns)
+        self.tokens = sum(_turn_tokens(t) for t in turns)
+        self.summary = summary
+        # 已移出窗口、还没有并入摘要的轮次
+        self.pending: List[Turn] = []
+        self.model = ""
+        # 会话的总轮数（本进程已知的），用来发现其他工作进程写入的轮次
+        self.count = count
+
+
+class HistoryCache:
+    """
+    会话历史的 LRU 缓存和多轮上下文组装。
+
+    每个会话保留一个受 token 预算约束的最近轮次窗口，移出窗口的轮次在后台合并进
+    滚动摘要（持久化到 ChatSession.summary）。新的对话写入时增量更新缓存，
+    只有缓存未命中时才从数据库读取最近的若干轮。
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        token_budget: int,
+        summary_budget: int,
+        max_turns: int,
+        summary_model: str = "",
+    ):
+        self.capacity = capacity
+        self.summary_budget = summary_budget
+        self.window_budget = max(0, token_budget - summary_budget)
+        self.max_turns = max_turns
+        self.summary_model = summary_model
+        self._sessions: "OrderedDict[int, SessionHistory]" = OrderedDict()
+        self._summarizing: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, session: ChatSession) -> SessionHistory:
+        """
+        获取会话历史，未命中时只读取最近 max_turns 轮。
+
+        多进程部署时同一会话的请求可能落到不同的工作进程：会话的 message_count 超过缓存已知的轮数，
+        说明有其他进程写入的轮次，缓存的窗口和 context 都已过时，丢弃后重读。
+        本进程刚写入、还没落库的轮次会推迟发现，但不会漏掉。
+
+        参数:
+            session (ChatSession): 会话对象。
+
+        返回:
+            SessionHistory: 会话历史。
+        """
+        history = self._sessions.get(session.id)
+        if history is not None and session.message_count > history.count:
+            history_cache_stale.inc()
+            self.invalidate(session.id)
+            context_cache.invalidate(session.id)
+            history = None
+        if history is not None:
+            history_cache_hits.inc()
+            self._sessions.move_to_end(session.id)
+            return history
+
+        history_cache_misses.inc()
+        rows = await Conversation.filter(session_id=session.id).order_by(
+            "-timestamp", "-id"
+        ).limit(self.max_turns).values_list("user_message", "ai_message")
+        history = SessionHistory([tuple(row) for row in reversed(rows)], session.summary or "", session.message_count)
+        # 库里的旧轮次在预算之外直接丢弃，它们已经（或本该）被摘要覆盖
+        self._fit_window(history, keep_pending=False)
+
+        # 并发读库期间可能已经有人放进了缓存
+        cached = self._sessions.get(session.id)
+        if cached is not None:
+            return cached
+        self._sessions[session.id] = history
+        while len(self._sessions) > self.capacity:
+            self._sessions.popitem(last=False)
+        return history
+
+    def build_messages(self, history: SessionHistory, message: str) -> List[Dict[str, str]]:
+        """
+        组装 /api/chat 的 messages：摘要作为 system 消息，之后是窗口内的轮次和本轮消息。
+
+        参数:
+            history (SessionHistory): 会话历史。
+            message (str): 本轮用户消息。
+
+        返回:
+            List[Dict[str, str]]: Ollama chat 格式的消息列表。
+        """
+        messages = []
+        if history.summary:
+            messages.append({"role": "system", "content": f"以下是之前对话的摘要：\n{history.summary}"})
+        for user_message, ai_message in history.turns:
+            messages.append({"role": "user", "content": user_message})
+            messages.append({"role": "assistant", "content": ai_message})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def build_prompt(self, history: SessionHistory, message: str) -> Dict[str, str]:
+        """
+        组装 /api/generate 的 system 和 prompt，用于还没有可复用 context 的会话。
+
+        参数:
+            history (SessionHistory): 会话历史。
+            message (str): 本轮用户消息。
+
+        返回:
+            Dict[str, str]: 包含 prompt（以及可能的 system）的请求字段。
+        """
+        fields = {}
+        if history.summary:
+            fields["system"] = f"以下是之前对话的摘要：\n{history.summary}"
+        if history.turns:
+            fields["prompt"] = f"{_transcript(list(history.turns))}\n用户：{message}"
+        else:
+            fields["prompt"] = message
+        return fields
+
+    def record_turn(self, session_id: int, user_message: str, ai_message: str, model: str) -> None:
+        """
+        新的一轮对话写入时增量更新缓存（会话不在缓存中则忽略，下次按需读库）。
+
+        参数:
+            session_id (int): 会话 ID。
+            user_message (str): 用户消息。
+            ai_message (str): AI 回答。
+            model (str): 本轮使用的模型，用于生成摘要。
+
+        返回:
+            None
+        """
+        history = self._sessions.get(session_id)
+        if history is None:
+            return
+        turn = (user_message, ai_message)
+        history.turns.append(turn)
+        history.tokens += _turn_tokens(turn)
+        history.count += 1
+        history.model = model
+        self._fit_window(history, keep_pending=True)
+        if history.pending and session_id not in self._summarizing:
+            self._summarizing.add(session_id)
+            task = asyncio.get_running_loop().create_task(self._summarize(session_id, history))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def invalidate(self, session_id: int) -> None:
+        self._sessions.pop(session_id, None)
+
+    def _fit_window(self, history: SessionHistory, keep_pending: bool) -> None:
+        while history.turns and (
+            history.tokens > self.window_budget or len(history.turns) > self.max_turns
+        ):
+            turn = history.turns.popleft()
+            history.tokens -= _turn_tokens(turn)
+            if keep_pending:
+                history.pending.append(turn)
+
+    async def _summarize(self, session_id: int, history: SessionHistory) -> None:
+        try:
+            while history.pending:
+                turns, history.pending = history.pending, []
+                summary = await self._fold(history, turns)
+                history.summary = _truncate_to_tokens(summary, self.summary_budget)
+                history_summaries.inc()
+            await ChatSession.filter(id=session_id).update(summary=history.summary)
+        except Exception:
+            logger.exception("Failed to update summary of session %s", session_id)
+        finally:
+            self._summarizing.discard(session_id)
+
+    async def _fold(self, history: SessionHistory, turns: List[Turn]) -> str:
+        model = self.summary_model or history.model
+        prompt = SUMMARY_PROMPT.format(
+            limit=self.summary_budget,
+            summary=history.summary or "（无）",
+            transcript=_transcript(turns),
+        )
+        try:
+            slot = await scheduler.acquire_background(model)
+            try:
+                summary = await generate_text(model, prompt)
+            finally:
+                slot.release()
+            # 推理模型会先输出 <think> 段落，摘要里不需要
+            summary = re.sub(r"<think>.*?</think>", "", summary, flags=re.S)
+            if summary.strip():
+                return summary.strip()
+        except OllamaError as e:
+            logger.warning("Falling back to extractive summary: %s", e)
+        # 摘要模型不可用时退化为拼接原文，由调用方按预算裁剪
+        return "\n".join(filter(None, [history.summary, _transcript(turns)]))
+
+
+history_cache = HistoryCache(
+    capacity=config.OLLAMA_HISTORY_CACHE_SESSIONS,
+    token_budget=config.OLLAMA_HISTORY_TOKEN_BUDGET,
+    summary_budget=config.OLLAMA_SUMMARY_TOKEN_BUDGET,
+    max_turns=config.OLLAMA_HISTORY_MAX_TURNS,
+    summary_model=config.OLLAMA_SUMMARY_MODEL,
+)
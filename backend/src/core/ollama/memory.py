@@ -0,0 +1,493 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from tortoise import timezone
+
+from src.core.database.models import Conversation
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.client import OllamaError, embed
+from src.core.ollama.history import estimate_tokens
+from src.core.ollama.scheduler import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+memory_embedded_turns = Counter("memory_embedded_turns_total", "写入向量索引的对话轮数")
+memory_embed_batches = Counter("memory_embed_batches_total", "后台批量生成向量的请求数")
+memory_embed_failures = Counter("memory_embed_failures_total", "后台生成向量失败、稍后重试的批次数")
+memory_recalls = Counter("memory_recalls_total", "带上相关历史的会话请求数")
+memory_recall_hits = Counter("memory_recall_hits_total", "注入提示词的相关历史条数")
+memory_deferred = Gauge("memory_deferred_turns", "仍在生成中、暂缓生成向量的对话轮数")
+memory_indexer_leader = Gauge("memory_indexer_leader", "本进程是否负责生成向量（共享索引目录的进程中只有一个）")
+
+MEMORY_HEADER = "以下是用户在其他对话中与本轮问题相关的内容，仅供参考：\n"
+
+# 截断的对话可能还在生成中（检查点写入的行），超过这么久（秒）仍未结束才按截断的内容生成向量
+_TRUNCATED_GRACE_SECONDS = 600
+# 水位之下跳过的 ID 可能属于还没提交的行（多个进程或批量写入并发插入时，ID 小的行可能后提交），
+# 记下这些空缺并在之后每一批中重新查询；超过这么久（秒）仍查不到的视为已回滚或已删除
+_GAP_GRACE_SECONDS = 300
+# 只跟踪水位之下这么多个 ID 以内的空缺，追赶积压的旧对话时不会为早已删除的行记下大量空缺
+_GAP_WINDOW = 1000
+# 单轮对话参与生成向量的最大字符数，其余部分对检索帮助不大
+_MAX_EMBED_CHARS = 2000
+# 同时保持映射的用户索引数
+_MAX_OPEN_INDEXES = 1024
+_COLUMNS = ("id", "user_id", "session_id", "user_message", "ai_message", "truncated", "timestamp")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _append_all(batches: List[Tuple["UserIndex", np.ndarray, np.ndarray]]) -> None:
+    for index, ids, vectors in batches:
+        index.append(ids, vectors)
+
+
+def _turn_text(user_message: str, ai_message: str) -> str:
+    return f"用户：{user_message}\n助手：{ai_message}"[:_MAX_EMBED_CHARS]
+
+
+class UserIndex:
+    """
+    一个用户的向量索引，由两个只追加的文件组成：
+    {user}.f32 为 N×dim 的归一化 float32 向量，{user}.ids 为 N×2 的 int64（对话 ID、会话 ID）。
+
+    检索时用 np.memmap 映射文件，不需要在启动时读入内存；文件变长后（包括其他进程追加的）
+    下次检索按新的长度重新映射。只读的进程（repair=False）不截断文件，以免截掉写入方正在追加的内容。
+    """
+
+    def __init__(self, prefix: str, dim: int, repair: bool = True):
+        self.vectors_path = prefix + ".f32"
+        self.ids_path = prefix + ".ids"
+        self.dim = dim
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        if repair:
+            self._repair()
+
+    def _rows(self) -> int:
+        def size(path: str) -> int:
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        return min(size(self.vectors_path) // (4 * self.dim), size(self.ids_path) // 16)
+
+    def _repair(self) -> None:
+        # 两个文件不是原子地一起追加的，中途崩溃后按较短的一个截断，保持行对齐
+        rows = self._rows()
+        for path, row_bytes in ((self.vectors_path, 4 * self.dim), (self.ids_path, 16)):
+            if os.path.exists(path) and os.path.getsize(path) != rows * row_bytes:
+                os.truncate(path, rows * row_bytes)
+
+    def __len__(self) -> int:
+        return self._rows()
+
+    def _map(self) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self._rows()
+        if self._vectors is None or len(self._vectors) != rows:
+            if rows == 0:
+                return np.empty((0, self.dim), np.float32), np.empty((0, 2), np.int64)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(rows, 2))
+        return self._vectors, self._ids
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        追加一批向量（阻塞的文件写入，在线程中调用）。
+
+        参数:
+            ids (np.ndarray): k×2 的（对话 ID、会话 ID）。
+            vectors (np.ndarray): k×dim 的归一化向量。
+
+        返回:
+            None
+        """
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        self._vectors = self._ids = None
+
+    def search(self, query: np.ndarray, k: int, exclude_session: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        余弦相似度 top-k：一次矩阵乘法算出所有分数，再用 argpartition 取前 k 个。
+
+        参数:
+            query (np.ndarray): 归一化的查询向量。
+            k (int): 返回的条数。
+            exclude_session (Optional[int]): 排除该会话的对话（当前会话已经在历史窗口里）。
+
+        返回:
+            List[Tuple[int, float]]: 按分数从高到低的（对话 ID、分数）。
+        """
+        vectors, ids = self._map()
+        if not len(vectors) or k <= 0:
+            return []
+        scores = vectors @ query.astype(np.float32)
+        if exclude_session is not None:
+            scores[ids[:, 1] == exclude_session] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i, 0]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+class SemanticMemory:
+    """
+    用户历史对话的语义检索。
+
+    后台任务按对话 ID 顺序读取新写入的对话，批量调用 /api/embed 生成向量，追加到每个用户的
+    UserIndex；进度（已处理到的 ID、暂缓的轮次和水位之下的 ID 空缺）保存在索引目录的 state.json 中，重启后继续。
+
+    ID 比水位小、却在水位推进之后才提交的行，只有落在跟踪的空缺中（水位之下 _GAP_WINDOW 个 ID 以内、
+    _GAP_GRACE_SECONDS 秒内提交）才会补上，更晚提交的不会生成向量。
+    会话请求可以检索用户其他会话中最相关的几轮，在 token 预算内注入提示词。
+
+    多个工作进程共享索引目录时，只有拿到目录锁的一个进程生成向量、追加文件和写 state.json；
+    其他进程只检索，并定期尝试接手（持锁的进程退出后锁自动释放）。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        model: str,
+        batch_size: int,
+        interval: float,
+        top_k: int,
+        token_budget: int,
+        min_score: float,
+    ):
+        self.directory = directory
+        self.model = model
+        self.batch_size = batch_size
+        self.interval = interval
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.dim: Optional[int] = None
+        self.watermark = 0
+        self._deferred: Set[int] = set()
+        # 水位之下尚未出现的对话 ID -> 首次发现空缺的时间（UNIX 时间戳）
+        self._gaps: Dict[int, float] = {}
+        self._indexes: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        # 持有目录锁的文件描述符；为 None 时本进程只检索
+        self._lock_fd: Optional[int] = None
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, "state.json")
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _try_lead(self) -> bool:
+        """尝试拿到索引目录的锁，成为生成向量的进程"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, "indexer.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        memory_indexer_leader.set(1)
+        logger.info("Memory indexer running in process %d", os.getpid())
+        return True
+
+    def _release(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            memory_indexer_leader.set(0)
+
+    def _follow_state(self) -> None:
+        """只检索的进程从 state.json 取得向量维度（写入方生成第一批向量后才有）"""
+        state = self._read_state()
+        dim = state.get("dim") if state.get("model") == self.model else None
+        if dim != self.dim:
+            self.dim = dim
+            self._indexes.clear()
+
+    def load_state(self) -> None:
+        """读取索引进度；向量模型变了则清空旧索引，从头重建"""
+        os.makedirs(self.directory, exist_ok=True)
+        state = self._read_state()
+        if state and state.get("model") != self.model:
+            logger.warning("Embedding model changed to %s, rebuilding memory index", self.model)
+            for name in os.listdir(self.directory):
+                if name.endswith((".f32", ".ids")):
+                    os.remove(os.path.join(self.directory, name))
+            state = {}
+        self.dim = state.get("dim")
+        self.watermark = state.get("watermark", 0)
+        self._deferred = set(state.get("deferred", []))
+        self._gaps = {int(conversation_id): seen for conversation_id, seen in state.get("gaps", {}).items()}
+        self._indexes.clear()
+        memory_deferred.set(len(self._deferred))
+
+    def _save_state(self) -> None:
+        state = {
+            "model": self.model, "dim": self.dim, "watermark": self.watermark,
+            "deferred": sorted(self._deferred), "gaps": self._gaps,
+        }
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._state_path)
+
+    def _index(self, user_id: int) -> Optional[UserIndex]:
+        if self.dim is None:
+            return None
+        index = self._indexes.get(user_id)
+        if index is None:
+            index = self._indexes[user_id] = UserIndex(
+                os.path.join(self.directory, str(user_id)), self.dim, repair=self.leader
+            )
+            while len(self._indexes) > _MAX_OPEN_INDEXES:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(user_id)
+        return index
+
+    def start(self) -> None:
+        """拿到目录锁则读取进度，否则只跟随 state.json；然后启动后台任务"""
+        if self._task is None:
+            if self._try_lead():
+                self.load_state()
+            else:
+                self._follow_state()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务并释放目录锁；已追加的向量和进度都已落盘，下次启动从进度处继续"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._release()
+
+    async def _run(self) -> None:
+        while not self.leader:
+            await asyncio.sleep(self.interval)
+            try:
+                if self._try_lead():
+                    self.load_state()
+                else:
+                    self._follow_state()
+            except Exception:
+                logger.exception("Failed to take over the memory indexer")
+        while True:
+            try:
+                indexed = await self.index_pending()
+            except OllamaError as e:
+                memory_embed_failures.inc()
+                logger.warning("Failed to embed conversations, retrying later: %s", e)
+                indexed = 0
+            except Exception:
+                memory_embed_failures.inc()
+                logger.exception("Failed to index conversations")
+                indexed = 0
+            # 一批满了说明还有积压，接着处理
+            if indexed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def index_pending(self) -> int:
+        """
+        为下一批新对话（以及此前暂缓的轮次和空缺中补上的行）生成向量并写入索引。
+
+        返回:
+            int: 本批读取的新对话数（不含暂缓的轮次）。
+
+        异常:
+            OllamaError: 生成向量失败，进度不变，下次重试。
+        """
+        new_rows = await Conversation.filter(id__gt=self.watermark).order_by("id").limit(
+            self.batch_size
+        ).values_list(*_COLUMNS)
+        # 暂缓的行单独查询，数量再多也不会挡住新的对话；已被删除的自然查不到
+        old_rows = []
+        if self._deferred:
+            old_rows = await Conversation.filter(id__in=list(self._deferred)).values_list(*_COLUMNS)
+        gap_rows = []
+        if self._gaps:
+            gap_rows = await Conversation.filter(id__in=list(self._gaps)).values_list(*_COLUMNS)
+        gaps = self._next_gaps(gap_rows, new_rows)
+
+        cutoff = timezone.now() - timedelta(seconds=_TRUNCATED_GRACE_SECONDS)
+        ready, deferred = [], set()
+        for row in (*old_rows, *gap_rows, *new_rows):
+            conversation_id, truncated, timestamp = row[0], row[5], row[6]
+            if truncated and timestamp > cutoff:
+                deferred.add(conversation_id)
+            else:
+                ready.append(row)
+
+        if ready:
+            slot = await scheduler.acquire_background(self.model)
+            try:
+                embeddings = await embed(self.model, [_turn_text(row[3], row[4]) for row in ready])
+            finally:
+                slot.release()
+            memory_embed_batches.inc()
+            vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            by_user: Dict[int, List[int]] = {}
+            for position, row in enumerate(ready):
+                by_user.setdefault(row[1], []).append(position)
+            batches = [
+                (
+                    self._index(user_id),
+                    np.array([(ready[p][0], ready[p][2] or 0) for p in positions], dtype=np.int64),
+                    vectors[positions],
+                )
+                for user_id, positions in by_user.items()
+            ]
+            await asyncio.to_thread(_append_all, batches)
+            memory_embedded_turns.inc(len(ready))
+
+        if new_rows or deferred != self._deferred or gaps != self._gaps:
+            if new_rows:
+                self.watermark = new_rows[-1][0]
+            self._deferred = deferred
+            self._gaps = gaps
+            memory_deferred.set(len(deferred))
+            await asyncio.to_thread(self._save_state)
+        return len(new_rows)
+
+    def _next_gaps(self, gap_rows: list, new_rows: list) -> Dict[int, float]:
+        """补上的空缺移除，过期和落出窗口的丢弃，再记下本批新对话之间跳过的 ID"""
+        now = time.time()
+        found = {row[0] for row in gap_rows}
+        gaps = {
+            conversation_id: seen
+            for conversation_id, seen in self._gaps.items()
+            if conversation_id not in found and now - seen < _GAP_GRACE_SECONDS
+        }
+        expected = self.watermark + 1
+        for row in new_rows:
+            skipped = range(max(expected, row[0] - _GAP_WINDOW), row[0])
+            gaps.update((conversation_id, now) for conversation_id in skipped)
+            expected = row[0] + 1
+        floor = (new_rows[-1][0] if new_rows else self.watermark) - _GAP_WINDOW
+        return {conversation_id: seen for conversation_id, seen in gaps.items() if conversation_id > floor}
+
+    async def recall(self, user_id: int, session_id: Optional[int], message: str) -> str:
+        """
+        检索用户其他会话中与本轮消息最相关的几轮，拼成注入提示词的一段文本。
+
+        检索只是锦上添花：生成查询向量失败时记录日志并返回空字符串。
+
+        参数:
+            user_id (int): 用户 ID。
+            session_id (Optional[int]): 当前会话 ID，其中的轮次不参与检索。
+            message (str): 本轮用户消息。
+
+        返回:
+            str: 在 token 预算内的相关历史，没有相关内容时为空字符串。
+        """
+        index = self._index(user_id)
+        if index is None or not len(index):
+            return ""
+        try:
+            [embedding] = await embed(self.model, [message])
+        except OllamaError as e:
+            logger.warning("Failed to embed query for memory recall: %s", e)
+            return ""
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        if query.shape[0] != index.dim:
+            return ""
+
+        # 崩溃重放可能写入重复的行，多取一些再去重
+        hits = await asyncio.to_thread(index.search, query, self.top_k * 2, session_id)
+        scores: Dict[int, float] = {}
+        for conversation_id, score in hits:
+            if score >= self.min_score and conversation_id not in scores:
+                scores[conversation_id] = score
+        ranked = list(scores)[: self.top_k]
+        if not ranked:
+            return ""
+        # 已删除、等待后台清理的会话中的轮次不再召回
+        rows = {
+            row[0]: row
+            for row in await Conversation.filter(id__in=ranked, session__deleted_at=None).values_list(
+                "id", "user_message", "ai_message"
+            )
+        }
+
+        budget = self.token_budget - estimate_tokens(MEMORY_HEADER)
+        snippets = []
+        for conversation_id in ranked:
+            row = rows.get(conversation_id)
+            if row is None:
+                continue  # 对话已删除或所在会话已删除
+            snippet = _turn_text(row[1], row[2])
+            cost = estimate_tokens(snippet)
+            if cost > budget:
+                # 预算不够放下整轮时截掉回答的尾部，至少保留提问
+                while snippet and estimate_tokens(snippet) > budget:
+                    snippet = snippet[: len(snippet) * 7 // 8]
+                cost = estimate_tokens(snippet)
+                if not snippet:
+                    break
+            snippets.append(snippet)
+            budget -= cost
+        memory_recalls.inc()
+        memory_recall_hits.inc(len(snippets))
+        return MEMORY_HEADER + "\n\n".join(snippets) if snippets else ""
+
+
+def inject_memory(path: str, payload: dict, memory: str) -> None:
+    """
+    把 recall() 返回的相关历史放进请求体：/api/chat 作为第一条 system 消息，
+    /api/generate 并入 system 字段（复用 context 时没有 system，放在 prompt 前面）。
+
+    参数:
+        path (str): Ollama 接口路径。
+        payload (dict): 请求体，原地修改。
+        memory (str): 相关历史，为空时不做任何修改。
+
+    返回:
+        None
+    """
+    if not memory:
+        return
+    if path == "/api/chat":
+        payload["messages"].insert(0, {"role": "system", "content": memory})
+    elif "context" in payload:
+        payload["prompt"] = f"{memory}\n\n{payload['prompt']}"
+    else:
+        payload["system"] = "\n\n".join(filter(None, [memory, payload.get("system")]))
+
+
+semantic_memory = SemanticMemory(
+    directory=config.OLLAMA_MEMORY_DIR,
+    model=config.OLLAMA_EMBED_MODEL,
+    batch_size=config.OLLAMA_EMBED_BATCH_SIZE,
+    interval=config.OLLAMA_EMBED_INTERVAL,
+    top_k=config.OLLAMA_MEMORY_TOP_K,
+    token_budget=config.OLLAMA_MEMORY_TOKEN_BUDGET,
+    min_score=config.OLLAMA_MEMORY_MIN_SCORE,
+)
@@ -0,0 +1,82 @@
+import logging
+
+from src.core.lifecycle import drain
+from src.core.ollama import config
+from src.core.ollama.backends import pool
+from src.core.ollama.batch import batch_runner
+from src.core.ollama.client import init_client, close_client, get_client
+from src.core.ollama.generations import generation_registry
+from src.core.ollama.memory import semantic_memory
+from src.core.ollama.residency import model_residency
+from src.core.ollama.titling import session_titler
+from src.core.ollama.usage import usage_ledger
+
+
+logger = logging.getLogger(__name__)
+
+
+def register_ollama(app) -> None:
+    """
+    在 FastAPI 应用的生命周期中创建和关闭 Ollama 连接池，并启动后端健康检查；
+    同时启动 token 用量的定时写入，并按配置启动会话标题生成、历史对话的向量索引、批量任务和模型常驻管理
+    （需要在 register_tortoise 之后调用）。
+
+    参数:
+        app: FastAPI 应用实例。
+
+    返回:
+        None
+    """
+    @app.on_event("startup")
+    async def init_ollama():
+        """
+        在应用启动时创建 Ollama 连接池并开始探测后端。
+
+        返回:
+            None
+        """
+        await init_client()
+        pool.start(get_client())
+        usage_ledger.start()
+        if config.OLLAMA_TITLE_ENABLED:
+            session_titler.start()
+        if config.OLLAMA_MEMORY_ENABLED:
+            semantic_memory.start()
+        if config.OLLAMA_BATCH_ENABLED:
+            batch_runner.start()
+        if config.OLLAMA_WARM_MODELS or config.OLLAMA_PIN_TOP_MODELS or config.OLLAMA_EVICT_IDLE_MODELS:
+            model_residency.start()
+
+    async def drain_ollama():
+        """
+        在应用关闭时中止与连接解耦的生成，把正在处理的批量提示词放回待处理，停止标题生成、向量索引和
+        模型常驻管理，再写完累计的 token 用量。收到 SIGTERM 排空时，先在剩余的排空时间内等客户端已断开的生成跑完。
+
+        这些都要写数据库，所以排在 register_tortoise 关闭连接之前执行。
+
+        返回:
+            None
+        """
+        if drain.draining:
+            unfinished = await generation_registry.drain(drain.remaining())
+            if unfinished:
+                logger.warning("Drain timeout exceeded, truncating %d generation(s)", unfinished)
+        await generation_registry.stop()
+        await batch_runner.stop()
+        await session_titler.stop()
+        await semantic_memory.stop()
+        await model_residency.stop()
+        await usage_ledger.close()
+
+    app.router.on_shutdown.insert(0, drain_ollama)
+
+    @app.on_event("shutdown")
+    async def close_ollama():
+        """
+        在应用关闭时停止健康检查，并关闭 Ollama 连接池。
+
+        返回:
+            None
+        """
+        await pool.stop()
+        await close_client()
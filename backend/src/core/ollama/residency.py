@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Union
+
+import httpx
+
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.backends import OllamaBackend, normalize_model, pool
+from src.core.ollama.client import get_client
+from src.core.ollama.scheduler import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+model_warmups = Counter(
+    "ollama_model_warmups_total", "预热和保活请求数：loaded 为冷加载，kept 为已加载只刷新 keep_alive，failed 为失败",
+    labelnames=("result",),
+)
+model_evictions = Counter("ollama_model_evictions_total", "主动卸载空闲模型的次数")
+resident_models = Gauge("ollama_resident_models", "至少在一个后端上已加载的模型数")
+
+# 请求分布的半衰期（秒）
+_MIX_HALF_LIFE = 600.0
+# 衰减后的请求数低于该值视为最近没有请求
+_IDLE_RATE = 0.5
+
+
+class ModelResidency:
+    """
+    模型常驻管理，避免请求撞上模型冷加载。
+
+    启动时预热 warm_models，之后每隔 interval 秒向需要常驻的模型发送不带提示词的生成请求：
+    已加载的只刷新 keep_alive，已被卸载的随即重新加载。需要常驻的是 warm_models 加上最近请求最多的
+    pin_top 个模型；请求分布取自调度器的累计名额数，按半衰期衰减。各后端已加载哪些模型以
+    BackendPool 定期从 /api/ps 探测的结果为准。evict_idle 开启时卸载最近没有请求、也不需要常驻的模型。
+    """
+
+    def __init__(self, warm_models: List[str], keep_alive: str, interval: float, pin_top: int, evict_idle: bool):
+        self.warm_models = [normalize_model(model) for model in warm_models]
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.pin_top = pin_top
+        self.evict_idle = evict_idle
+        # 模型 -> 衰减后的请求数
+        self.rates: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def resident(self) -> List[str]:
+        """需要常驻的模型"""
+        recent = [model for model, rate in self.rates.items() if rate >= _IDLE_RATE]
+        pinned = sorted(recent, key=lambda model: -self.rates[model])[: self.pin_top]
+        return list(dict.fromkeys(self.warm_models + pinned))
+
+    def _update_mix(self) -> None:
+        decay = 0.5 ** (self.interval / _MIX_HALF_LIFE)
+        counts: Dict[str, int] = {}
+        for model, count in scheduler.request_counts().items():
+            model = normalize_model(model)
+            counts[model] = counts.get(model, 0) + count
+        for model in set(self.rates) | set(counts):
+            delta = counts.get(model, 0) - self._counts.get(model, 0)
+            self.rates[model] = self.rates.get(model, 0.0) * decay + delta
+        self._counts = counts
+
+    async def touch(self, backend: OllamaBackend, model: str, keep_alive: Union[str, int]) -> bool:
+        """
+        向一个后端发送不带提示词的生成请求：未加载的模型被加载，已加载的刷新 keep_alive，keep_alive 为 0 时卸载。
+
+        参数:
+            backend (OllamaBackend): 目标后端。
+            model (str): 模型名称。
+            keep_alive (Union[str, int]): Ollama 的 keep_alive，例如 "30m" 或 0。
+
+        返回:
+            bool: 是否成功。
+        """
+        model = normalize_model(model)
+        was_loaded = model in backend.loaded_models
+        try:
+            response = await get_client().post(
+                backend.url("/api/generate"), json={"model": model, "keep_alive": keep_alive, "stream": False}
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("Failed to touch %s on %s: %s", model, backend.base_url, e)
+            model_warmups.labels("failed").inc()
+            return False
+        if keep_alive == 0:
+            backend.loaded_models.discard(model)
+            model_evictions.inc()
+        else:
+            backend.loaded_models.add(model)
+            model_warmups.labels("kept" if was_loaded else "loaded").inc()
+        return True
+
+    async def tick(self) -> None:
+        """更新请求分布，对常驻模型发送保活请求，按配置卸载空闲模型"""
+        self._update_mix()
+        backends = [backend for backend in pool.backends if backend.healthy]
+        keep = self.resident()
+        await asyncio.gather(*(self.touch(backend, model, self.keep_alive) for backend in backends for model in keep))
+        if self.evict_idle:
+            idle = [
+                (backend, model)
+                for backend in backends
+                for model in backend.loaded_models
+                if model not in keep and self.rates.get(model, 0.0) < _IDLE_RATE
+            ]
+            await asyncio.gather(*(self.touch(backend, model, 0) for backend, model in idle))
+        resident_models.set(len(set().union(*(backend.loaded_models for backend in pool.backends))))
+
+    def start(self) -> None:
+        """启动后台任务，第一次执行即为启动时的预热"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # 先探测一次，拿到各后端已加载的模型
+        await pool.probe_all(get_client())
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Model residency check failed")
+            await asyncio.sleep(self.interval)
+
+
+model_residency = ModelResidency(
+    warm_models=config.OLLAMA_WARM_MODELS,
+    keep_alive=config.OLLAMA_KEEP_ALIVE,
+    interval=config.OLLAMA_RESIDENCY_INTERVAL,
+    pin_top=config.OLLAMA_PIN_TOP_MODELS,
+    evict_idle=config.OLLAMA_EVICT_IDLE_MODELS,
+)
@@ -0,0 +1,243 @@
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Set, Tuple
+
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.cancellation import GenerationTracker
+from src.core.ollama.client import chunk_text, iter_chunks, open_stream
+from src.core.ollama.scheduler import scheduler
+from src.core.ollama.streaming import Event, error_event, stats_event, token_event
+
+
+response_cache_hits = Counter("response_cache_hits_total", "直接从响应缓存回放的请求数")
+response_cache_misses = Counter("response_cache_misses_total", "需要向 Ollama 发起新生成的请求数")
+response_cache_coalesced = Counter("response_cache_coalesced_total", "合并到进行中相同生成的请求数")
+response_cache_bytes = Gauge("response_cache_bytes", "响应缓存当前占用的字节数")
+
+CacheKey = Tuple[str, str]
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def cache_key(model: str, prompt: str) -> CacheKey:
+    """规范化提示词（Unicode NFKC、折叠空白）后与模型一起作为缓存键"""
+    normalized = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", prompt)).strip()
+    return model, normalized
+
+
+class ResponseCache:
+    """按总字节数和 TTL 约束的 LRU 响应缓存，缓存的是完整生成的 token 事件序列"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Tuple[Event, ...], int]]" = OrderedDict()
+
+    def get(self, key: CacheKey) -> Optional[Tuple[Event, ...]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, chunks, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return chunks
+
+    def put(self, key: CacheKey, events: List[Event]) -> None:
+        # 统计信息属于当次生成，回放时没有意义
+        chunks = tuple(event for event in events if event[0] == "token")
+        size = sum(len(data["text"].encode("utf-8")) for _, data in chunks)
+        if not self.max_bytes or size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, chunks, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        response_cache_bytes.set(self.bytes)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+            response_cache_bytes.set(self.bytes)
+
+
+class Flight:
+    """
+    一次进行中的上游生成，所有相同请求共享它的输出。
+
+    生成在独立任务中运行，不依附于任何一个客户端连接；订阅者全部离开后才中止上游。
+    """
+
+    def __init__(self, key: CacheKey, prompt: str):
+        self.key = key
+        # 发起者的原始提示词（键里是规范化后的版本）
+        self.prompt = prompt
+        self.chunks: List[Event] = []
+        self.done = False
+        self.failed = False
+        # 上游生成完整结束（而不是出错或被中止）
+        self.completed = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # 上游流打开后得到排队耗时，失败则是对应的异常
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    def push(self, event: Event) -> None:
+        self.chunks.append(event)
+        self._notify()
+
+    def finish(self) -> None:
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def join(self) -> "Subscription":
+        self.subscribers += 1
+        return Subscription(self)
+
+
+class Subscription:
+    """一个客户端对 Flight 的订阅，leave() 可重复调用"""
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self._left = False
+
+    async def chunks(self) -> AsyncIterator[Event]:
+        flight = self.flight
+        position = 0
+        try:
+            while True:
+                changed = flight._changed
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    return
+                await changed.wait()
+        finally:
+            self.leave()
+
+    def leave(self) -> None:
+        if self._left:
+            return
+        self._left = True
+        flight = self.flight
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done and flight.task is not None:
+            # 没有人在听了，中止上游生成
+            flight.task.cancel()
+
+
+class CoalescingGenerator:
+    """
+    /chat/stream 的响应缓存和相同请求合并（single-flight）。
+
+    缓存命中时直接回放；同一个键已有进行中的生成时加入它；否则发起新的生成，
+    完整结束且没有解析错误的结果写入缓存。
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+        self._flights: Dict[CacheKey, Flight] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def cached(self, key: CacheKey) -> Optional[Tuple[Event, ...]]:
+        chunks = self.cache.get(key)
+        if chunks is not None:
+            response_cache_hits.inc()
+        return chunks
+
+    def subscribe(self, key: CacheKey, prompt: str, user_key: Hashable) -> Subscription:
+        """
+        订阅指定键的生成，必要时发起新的上游请求。
+
+        参数:
+            key (CacheKey): cache_key() 返回的键。
+            prompt (str): 原始提示词，发起新的生成时使用。
+            user_key (Hashable): 发起者的排队标识。
+
+        返回:
+            Subscription: 订阅；先 await subscription.flight.ready 再读取 chunks()。
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            response_cache_coalesced.inc()
+            return flight.join()
+
+        response_cache_misses.inc()
+        flight = self._flights[key] = Flight(key, prompt)
+        # 没人等待 ready 时也不要报 "exception was never retrieved"
+        flight.ready.add_done_callback(lambda f: f.cancelled() or f.exception())
+        subscription = flight.join()
+        flight.task = asyncio.get_running_loop().create_task(self._run(flight, user_key))
+        self._tasks.add(flight.task)
+        flight.task.add_done_callback(self._tasks.discard)
+        return subscription
+
+    async def _run(self, flight: Flight, user_key: Hashable) -> None:
+        model = flight.key[0]
+        tracker = GenerationTracker()
+        slot = None
+        try:
+            slot = await scheduler.acquire(model, user_key)
+            wait_seconds = slot.wait_seconds
+            stream = await open_stream(
+                "/api/generate", {"model": model, "prompt": flight.prompt, "stream": True}
+            )
+            flight.ready.set_result(slot.wait_seconds)
+            chunks = iter_chunks(stream)
+            try:
+                async for chunk in chunks:
+                    if chunk is None:
+                        flight.failed = True
+                        flight.push(error_event("Error parsing chunk"))
+                        continue
+                    if "error" in chunk:
+                        flight.failed = True
+                        tracker.fail()
+                        flight.push(error_event(str(chunk["error"])))
+                        break
+                    tracker.feed(chunk)
+                    text = chunk_text(chunk)
+                    if text:
+                        flight.push(token_event(text))
+                    if chunk.get("done"):
+                        flight.push(stats_event(chunk, queue_wait_ms=round(wait_seconds * 1000)))
+                else:
+                    tracker.finish()
+            finally:
+                await tracker.close(chunks)
+        except Exception as e:
+            if not flight.ready.done():
+                flight.ready.set_exception(e)
+            else:
+                flight.push(error_event("Ollama API error"))
+            flight.failed = True
+        finally:
+            if slot is not None:
+                slot.release()
+            if not flight.ready.done():
+                flight.ready.cancel()
+            self._flights.pop(flight.key, None)
+            flight.completed = tracker.finished
+            flight.finish()
+            if tracker.finished and not flight.failed:
+                self.cache.put(flight.key, flight.chunks)
+
+
+coalescer = CoalescingGenerator(
+    ResponseCache(config.OLLAMA_RESPONSE_CACHE_BYTES, config.OLLAMA_RESPONSE_CACHE_TTL)
+)
@@ -0,0 +1,256 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional
+
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+
+
+queue_admitted = Counter("ollama_queue_admitted_total", "获得生成名额的请求数")
+queue_rejected = Counter("ollama_queue_rejected_total", "因队列已满被拒绝（429）的请求数")
+queue_wait_seconds = Counter("ollama_queue_wait_seconds_total", "请求在队列中等待的累计秒数")
+queue_depth = Gauge("ollama_queue_depth", "当前排队等待的请求数")
+active_generations = Gauge("ollama_active_generations", "当前占用名额的生成数")
+
+
+class QueueFullError(Exception):
+    """模型的等待队列已满"""
+
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"Queue for model {model} is full")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class Slot:
+    """一个已获得的生成名额，用完后必须 release()，重复调用无副作用"""
+
+    def __init__(self, queue: "_ModelQueue", wait_seconds: float, background: bool = False):
+        self._queue = queue
+        self.wait_seconds = wait_seconds
+        self.background = background
+        self._acquired_at = time.monotonic()
+        self._released = False
+
+    @property
+    def model(self) -> str:
+        return self._queue.model
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._queue.release(time.monotonic() - self._acquired_at, self.background)
+
+
+class _ModelQueue:
+    """
+    单个模型的并发名额和等待队列。
+
+    等待者按用户分组，放行时在用户之间轮转，单个用户的突发请求不会挤占其他用户。
+    后台任务（摘要、标题、向量）单独排队：只有没有用户请求在等待时才放行，
+    并且在并发上限大于 1 时总是留出一个名额给随时到来的用户请求。
+    """
+
+    # 服务时长滑动平均的平滑系数
+    _EWMA_ALPHA = 0.2
+
+    def __init__(self, model: str, concurrency: int, max_queue: int):
+        self.model = model
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        # 用户 -> 该用户的等待者；字典顺序即轮转顺序
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._background: Deque[asyncio.Future] = deque()
+        self.background_active = 0
+        # 累计获得过名额的请求数（包括后台任务），用于统计各模型的请求分布
+        self.requests = 0
+        self._avg_service_seconds = 10.0
+
+    def retry_after(self) -> int:
+        """按平均服务时长估算队列腾出位置所需的秒数"""
+        rounds = (self.queued + 1) / max(1, self.concurrency)
+        return max(1, math.ceil(rounds * self._avg_service_seconds))
+
+    def _background_allowed(self) -> bool:
+        return (
+            not self._waiters
+            and self.active < self.concurrency
+            and self.background_active < max(1, self.concurrency - 1)
+        )
+
+    async def acquire_background(self) -> Slot:
+        if not self._background and self._background_allowed():
+            self._grant(background=True)
+            return Slot(self, 0.0, background=True)
+
+        future = asyncio.get_running_loop().create_future()
+        self._background.append(future)
+        enqueued_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(0.0, background=True)
+            elif future in self._background:
+                self._background.remove(future)
+            raise
+        return Slot(self, time.monotonic() - enqueued_at, background=True)
+
+    async def acquire(self, user_key: Hashable) -> Slot:
+        if self.active < self.concurrency and not self.queued:
+            self._grant()
+            return Slot(self, 0.0)
+
+        if self.queued >= self.max_queue:
+            queue_rejected.inc()
+            raise QueueFullError(self.model, self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_key, deque()).append(future)
+        self.queued += 1
+        queue_depth.inc()
+        enqueued_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已经分配但请求被取消了，直接归还
+                self.release(0.0)
+            else:
+                self._discard(user_key, future)
+            raise
+
+        wait_seconds = time.monotonic() - enqueued_at
+        queue_wait_seconds.inc(wait_seconds)
+        return Slot(self, wait_seconds)
+
+    def release(self, service_seconds: float, background: bool = False) -> None:
+        self.active -= 1
+        active_generations.dec()
+        if background:
+            self.background_active -= 1
+        elif service_seconds:
+            # 后台任务的耗时不代表用户请求，不计入 Retry-After 的估算
+            self._avg_service_seconds += self._EWMA_ALPHA * (
+                service_seconds - self._avg_service_seconds
+            )
+        self._dispatch()
+
+    def _grant(self, background: bool = False) -> None:
+        self.active += 1
+        self.requests += 1
+        active_generations.inc()
+        if background:
+            self.background_active += 1
+        else:
+            queue_admitted.inc()
+
+    def _dispatch(self) -> None:
+        while self.active < self.concurrency and self._waiters:
+            user_key, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                # 该用户还有请求，排到轮转队尾
+                self._waiters.move_to_end(user_key)
+            else:
+                del self._waiters[user_key]
+            self.queued -= 1
+            queue_depth.dec()
+            if future.done():
+                # 与 release 在同一轮事件循环中被取消（客户端断开、wait_for 超时），
+                # 等待者发现不在队列中不会再减计数，这里跳过，名额留给下一个
+                continue
+            self._grant()
+            future.set_result(None)
+        while self._background and self._background_allowed():
+            future = self._background.popleft()
+            if future.done():
+                # 已被取消，等待者自己清理
+                continue
+            self._grant(background=True)
+            future.set_result(None)
+
+    def _discard(self, user_key: Hashable, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(user_key)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        if not waiters:
+            del self._waiters[user_key]
+        self.queued -= 1
+        queue_depth.dec()
+
+
+class OllamaScheduler:
+    """
+    Ollama 请求的准入控制：每个模型独立的并发上限、按用户轮转的公平排队、有界队列。
+    """
+
+    def __init__(
+        self,
+        default_concurrency: int,
+        concurrency_overrides: Optional[Dict[str, int]] = None,
+        max_queue: int = 64,
+    ):
+        self.default_concurrency = default_concurrency
+        self.concurrency_overrides = concurrency_overrides or {}
+        self.max_queue = max_queue
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue_for(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            concurrency = self.concurrency_overrides.get(model, self.default_concurrency)
+            queue = self._queues[model] = _ModelQueue(model, concurrency, self.max_queue)
+        return queue
+
+    async def acquire(self, model: str, user_key: Hashable) -> Slot:
+        """
+        为某个用户获取指定模型的生成名额，必要时排队等待。
+
+        参数:
+            model (str): 模型名称（MessageRequest.model）。
+            user_key (Hashable): 用于公平轮转的用户标识。
+
+        返回:
+            Slot: 获得的名额，wait_seconds 为排队耗时。
+
+        异常:
+            QueueFullError: 该模型的等待队列已满。
+        """
+        return await self._queue_for(model).acquire(user_key)
+
+    async def acquire_background(self, model: str) -> Slot:
+        """
+        为后台任务获取指定模型的名额：排在所有用户请求之后，且不会占满全部名额。
+
+        后台队列不设上限（调用方自己限制并发的任务数），不会抛出 QueueFullError。
+
+        参数:
+            model (str): 模型名称。
+
+        返回:
+            Slot: 获得的名额。
+        """
+        return await self._queue_for(model).acquire_background()
+
+    def users_waiting(self, model: str) -> int:
+        """正在排队等待该模型的用户请求数，长时间运行的后台任务据此让出名额"""
+        queue = self._queues.get(model)
+        return queue.queued if queue is not None else 0
+
+    def request_counts(self) -> Dict[str, int]:
+        """各模型累计获得过名额的请求数"""
+        return {model: queue.requests for model, queue in self._queues.items()}
+
+
+scheduler = OllamaScheduler(
+    default_concurrency=config.OLLAMA_MODEL_CONCURRENCY,
+    concurrency_overrides=config.OLLAMA_MODEL_CONCURRENCY_OVERRIDES,
+    max_queue=config.OLLAMA_MAX_QUEUE,
+)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+from typing import AsyncIterator, Callable, Dict, List, Literal, Mapping, Optional, Tuple
+
+import anyio
+from fastapi.responses import StreamingResponse
+
+from src.core.instrumentation import StageTimer, stage_timer
+from src.core.metrics import Counter
+from src.core.ollama import config
+
+
+# 流式事件：(类型, 数据)，类型为 token / stats / error / done
+Event = Tuple[str, dict]
+# 客户端可选的流式响应格式
+StreamFormat = Literal["text", "sse", "ndjson"]
+
+# Ollama 结束块中随 stats 事件转发的统计字段
+_STATS_FIELDS = (
+    "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration",
+)
+
+stream_token_events = Counter("stream_token_events_total", "合并前流式响应中的 token 事件数")
+stream_frames = Counter("stream_frames_total", "流式响应实际写出的帧数")
+
+
+def token_event(text: str, **extra) -> Event:
+    return "token", {"text": text, **extra}
+
+
+def error_event(detail: str, **extra) -> Event:
+    return "error", {"detail": detail, **extra}
+
+
+def stats_event(chunk: dict, **extra) -> Event:
+    """从 Ollama 的 done 块中取出统计信息"""
+    return "stats", {**{name: chunk[name] for name in _STATS_FIELDS if name in chunk}, **extra}
+
+
+def done_event(**data) -> Event:
+    return "done", data
+
+
+def _encode_text(kind: str, data: dict) -> str:
+    # 纯文本格式保持原来的输出：只有回答内容，错误以文本标记混在其中
+    if kind == "token":
+        return data["text"]
+    if kind == "error":
+        return f"\n[{data['detail']}]\n"
+    return ""
+
+
+def text_length(event: Event) -> int:
+    """事件在 text 格式中占用的字符数，可断点续传的生成以此计算偏移量"""
+    return len(_encode_text(*event))
+
+
+def _encode_sse(kind: str, data: dict) -> str:
+    # 带偏移量的事件同时作为 SSE 的事件 ID，EventSource 重连时会在 Last-Event-ID 中带回
+    event_id = f"id: {data['offset']}\n" if "offset" in data else ""
+    return f"{event_id}event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _encode_ndjson(kind: str, data: dict) -> str:
+    return json.dumps({"type": kind, **data}, ensure_ascii=False) + "\n"
+
+
+_FORMATS: Dict[str, Tuple[str, Callable[[str, dict], str]]] = {
+    "text": ("text/plain", _encode_text),
+    "sse": ("text/event-stream", _encode_sse),
+    "ndjson": ("application/x-ndjson", _encode_ndjson),
+}
+
+
+async def coalesce_tokens(events: AsyncIterator[Event], window: float, max_bytes: int) -> AsyncIterator[Event]:
+    """
+    合并相邻的 token 事件，减少写出的帧数和系统调用。
+
+    第一个 token 立即发送，不影响首 token 延迟；之后的 token 累积到 window 秒或
+    max_bytes 字节后一起发送，其他类型的事件到来前先发送已累积的内容。
+    合并后的事件带有最后一个被合并 token 的其他字段（例如 offset）。
+
+    参数:
+        events (AsyncIterator[Event]): 事件流（异步生成器），结束或中断时会被关闭。
+        window (float): 合并的时间窗口（秒），不大于 0 时不合并。
+        max_bytes (int): 累积到这么多字节立即发送。
+
+    返回:
+        AsyncIterator[Event]: 合并后的事件流。
+    """
+    loop = asyncio.get_running_loop()
+    # 正在读取上游下一个事件的任务；等待超时不会取消它，下次继续等
+    pending: Optional[asyncio.Future] = None
+    parts: List[str] = []
+    # 最后一个被合并的 token 事件的数据
+    tail: dict = {}
+    size = 0
+    deadline: Optional[float] = None
+    first = True
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(events.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            await asyncio.wait((pending,), timeout=timeout)
+            if not pending.done():
+                yield "token", {**tail, "text": "".join(parts)}
+                parts, size, deadline = [], 0, None
+                continue
+
+            done, pending = pending, None
+            try:
+                kind, data = done.result()
+            except StopAsyncIteration:
+                break
+
+            if kind == "token":
+                stream_token_events.inc()
+                if window > 0 and not first:
+                    parts.append(data["text"])
+                    tail = data
+                    size += len(data["text"].encode("utf-8"))
+                    if deadline is None:
+                        deadline = loop.time() + window
+                    if size >= max_bytes:
+                        yield "token", {**tail, "text": "".join(parts)}
+                        parts, size, deadline = [], 0, None
+                    continue
+                first = False
+            if parts:
+                yield "token", {**tail, "text": "".join(parts)}
+                parts, size, deadline = [], 0, None
+            yield kind, data
+
+        if parts:
+            yield "token", {**tail, "text": "".join(parts)}
+    finally:
+        # 客户端断开时上游可能还在读取中，取消它并确保上游生成器的清理逻辑执行完
+        with anyio.CancelScope(shield=True):
+            if pending is not None:
+                pending.cancel()
+                await asyncio.wait((pending,))
+                if not pending.cancelled():
+                    pending.exception()
+            await events.aclose()
+
+
+def stream_response(
+    events: AsyncIterator[Event],
+    fmt: StreamFormat = "text",
+    headers: Optional[Mapping[str, str]] = None,
+    timer: Optional[StageTimer] = None,
+) -> StreamingResponse:
+    """
+    按客户端选择的格式输出事件流，相邻 token 按配置合并。
+
+    参数:
+        events (AsyncIterator[Event]): 事件流（异步生成器）。
+        fmt (StreamFormat): text 只输出回答文本；sse 为 Server-Sent Events；ndjson 每行一个事件。
+        headers (Optional[Mapping[str, str]]): 额外的响应头。
+        timer (Optional[StageTimer]): 请求的阶段计时器，记录首 token 延迟和生成速度。
+
+    返回:
+        StreamingResponse: 流式响应。
+    """
+    media_type, encode = _FORMATS[fmt]
+    timer = timer or stage_timer("unknown")
+
+    async def body():
+        coalesced = coalesce_tokens(
+            events, config.OLLAMA_STREAM_COALESCE_WINDOW, config.OLLAMA_STREAM_COALESCE_BYTES
+        )
+        timer.stream_started()
+        try:
+            async for kind, data in coalesced:
+                timer.event(kind, data)
+                frame = encode(kind, data)
+                if frame:
+                    stream_frames.inc()
+                    yield frame
+        finally:
+            timer.stream_finished()
+            await coalesced.aclose()
+
+    headers = dict(headers or {})
+    if fmt == "sse":
+        # 防止反向代理缓冲事件流
+        headers.update({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
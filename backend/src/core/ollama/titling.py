@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import re
+from itertools import groupby
+from typing import List, Optional, Set
+
+from src.core.database.models import ChatSession
+from src.core.events import event_hub
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+from src.core.ollama.client import OllamaError, generate_text
+from src.core.ollama.scheduler import scheduler
+
+
+logger = logging.getLogger(__name__)
+
+titles_generated = Counter("session_titles_generated_total", "自动生成并写入的会话标题数")
+title_batches = Counter("session_title_batches_total", "生成标题的模型请求数")
+title_fallbacks = Counter("session_title_fallbacks_total", "模型没有给出可用标题、改用截取用户消息的次数")
+title_jobs_dropped = Counter("session_title_jobs_dropped_total", "排队已满被丢弃的标题任务数")
+title_pending = Gauge("session_title_pending", "排队和正在生成标题的会话数")
+
+# 新建会话的默认标题，只有仍是默认标题的会话才会被自动命名
+DEFAULT_SESSION_TITLE = "新对话"
+# 标题的最大字符数
+TITLE_MAX_CHARS = 20
+
+TITLE_PROMPT = (
+    "为下面每段对话各起一个简短的标题，概括用户想做的事，不超过 {limit} 个字，不要引号和句末标点。"
+    '只输出 JSON，格式为 {{"titles": ["标题", ...]}}，按顺序共 {count} 个。\n\n{items}'
+)
+
+# 单段对话放进提示词的最大字符数，标题只需要开头的内容
+_EXCERPT_CHARS = 500
+
+
+class TitleJob:
+    """一个等待生成标题的会话及其第一轮对话"""
+
+    __slots__ = ("session_id", "user_id", "user_message", "ai_message", "model")
+
+    def __init__(self, session_id: int, user_id: int, user_message: str, ai_message: str, model: str):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.user_message = user_message
+        self.ai_message = ai_message
+        self.model = model
+
+
+def _clean_title(text: str) -> str:
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.S)
+    quotes, punctuation = " \"'“”‘’《》「」【】#*", "。.！!？?，,；;：:"
+    text = " ".join(text.split()).rstrip(quotes + punctuation).strip(quotes)
+    return text[:TITLE_MAX_CHARS]
+
+
+def fallback_title(user_message: str) -> str:
+    """模型不可用时截取用户消息的第一行作为标题"""
+    line = next((line for line in user_message.splitlines() if line.strip()), "")
+    return _clean_title(line) or DEFAULT_SESSION_TITLE
+
+
+def _parse_titles(text: str, count: int) -> List[Optional[str]]:
+    """从模型输出中取出按顺序的标题，缺失或不可用的位置为 None"""
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.S)
+    match = re.search(r"\{.*\}", text, flags=re.S)
+    titles = []
+    if match:
+        try:
+            value = json.loads(match.group(0)).get("titles")
+            if isinstance(value, list):
+                titles = [_clean_title(item) if isinstance(item, str) else "" for item in value]
+        except (ValueError, AttributeError):
+            pass
+    elif count == 1:
+        # 小模型经常忽略格式要求直接输出标题
+        titles = [_clean_title(text)]
+    return [(titles[i] or None) if i < len(titles) else None for i in range(count)]
+
+
+class SessionTitler:
+    """
+    后台为新会话生成标题。
+
+    会话的第一轮结束后 enqueue() 一个任务（同一会话排队中只保留一个），少量后台任务
+    凑批后一次请求为多个会话生成标题，以后台优先级排在所有用户请求之后。
+    标题只在会话仍是默认标题时写入，写入后通过 event_hub 推送给该用户的客户端。
+    """
+
+    def __init__(self, model: str, workers: int, batch_size: int, batch_wait: float, max_pending: int):
+        self.model = model
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_pending = max_pending
+        # 排队或正在生成标题的会话
+        self._pending: Set[int] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def enqueue(self, session_id: int, user_id: int, user_message: str, ai_message: str, model: str) -> bool:
+        """
+        为会话排队生成标题，不等待。
+
+        参数:
+            session_id (int): 会话 ID。
+            user_id (int): 会话所属的用户，标题更新推送给该用户的客户端。
+            user_message (str): 第一轮的用户消息。
+            ai_message (str): 第一轮的回答（可能是截断的部分）。
+            model (str): 第一轮使用的模型，没有配置标题模型时使用。
+
+        返回:
+            bool: 是否已排队；已在排队、队列已满或未启动时返回 False。
+        """
+        if self._queue is None or session_id in self._pending:
+            return False
+        if len(self._pending) >= self.max_pending:
+            title_jobs_dropped.inc()
+            return False
+        self._pending.add(session_id)
+        title_pending.set(len(self._pending))
+        self._queue.put_nowait(TitleJob(
+            session_id, user_id, user_message[:_EXCERPT_CHARS], ai_message[:_EXCERPT_CHARS],
+            self.model or model,
+        ))
+        return True
+
+    def start(self) -> None:
+        """启动后台任务"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self) -> None:
+        """停止后台任务，排队中的会话保留默认标题"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+        title_pending.set(0)
+
+    async def _next_batch(self) -> List[TitleJob]:
+        jobs = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(jobs) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return jobs
+
+    async def _worker(self) -> None:
+        while True:
+            jobs = await self._next_batch()
+            try:
+                jobs.sort(key=lambda job: job.model)
+                for model, group in groupby(jobs, key=lambda job: job.model):
+                    await self._title(model, list(group))
+            except Exception:
+                logger.exception("Failed to title %d sessions", len(jobs))
+            finally:
+                for job in jobs:
+                    self._pending.discard(job.session_id)
+                title_pending.set(len(self._pending))
+
+    async def _title(self, model: str, jobs: List[TitleJob]) -> None:
+        items = "\n\n".join(
+            f"对话 {i}：\n用户：{job.user_message}\n助手：{job.ai_message}" for i, job in enumerate(jobs, 1)
+        )
+        prompt = TITLE_PROMPT.format(limit=TITLE_MAX_CHARS, count=len(jobs), items=items)
+        try:
+            slot = await scheduler.acquire_background(model)
+            try:
+                text = await generate_text(
+                    model, prompt, format="json",
+                    options={"temperature": 0.2, "num_predict": 48 * len(jobs) + 32},
+                )
+            finally:
+                slot.release()
+            title_batches.inc()
+            titles = _parse_titles(text, len(jobs))
+        except OllamaError as e:
+            logger.warning("Falling back to truncated titles: %s", e)
+            titles = [None] * len(jobs)
+
+        for job, title in zip(jobs, titles):
+            if title is None:
+                title_fallbacks.inc()
+                title = fallback_title(job.user_message)
+            # 用户期间自己改过标题或已删除会话的不覆盖
+            updated = await ChatSession.filter(
+                id=job.session_id, title=DEFAULT_SESSION_TITLE, deleted_at=None
+            ).update(title=title)
+            if updated:
+                titles_generated.inc()
+                event_hub.publish(job.user_id, "title", {"session_id": job.session_id, "title": title})
+
+
+session_titler = SessionTitler(
+    model=config.OLLAMA_TITLE_MODEL,
+    workers=config.OLLAMA_TITLE_WORKERS,
+    batch_size=config.OLLAMA_TITLE_BATCH_SIZE,
+    batch_wait=config.OLLAMA_TITLE_BATCH_WAIT,
+    max_pending=config.OLLAMA_TITLE_MAX_PENDING,
+)
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from tortoise import timezone
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+
+from src.core.database.models import TokenUsage
+from src.core.metrics import Counter, Gauge
+from src.core.ollama import config
+
+
+logger = logging.getLogger(__name__)
+
+usage_tokens = Counter("usage_tokens_total", "记入用量的 token 数", labelnames=("kind",))
+usage_flushes = Counter("usage_flushes_total", "用量写入数据库的批次数")
+usage_rows_written = Counter("usage_rows_written_total", "写入（新建或累加）的用量行数")
+usage_write_failures = Counter("usage_write_failures_total", "写入失败、留到下次重试的批次数")
+usage_pending = Gauge("usage_pending", "等待写入的用量行数")
+quota_rejections = Counter("quota_rejections_total", "超出 token 额度被拒绝的请求数")
+
+# (用户 ID, 模型, 所在小时)
+UsageKey = Tuple[int, str, object]
+
+
+class QuotaExceededError(Exception):
+    """用户的 token 额度已用完"""
+
+    def __init__(self, user_id: int, retry_after: int):
+        super().__init__(f"Token quota of user {user_id} is exhausted")
+        self.user_id = user_id
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    """一个用户的令牌桶，余量可以被一次较长的回答扣成负数，之后按速率恢复"""
+
+    __slots__ = ("level", "updated")
+
+    def __init__(self, capacity: float):
+        self.level = capacity
+        self.updated = time.monotonic()
+
+
+class UsageLedger:
+    """
+    按用户和模型统计 token 用量，并按令牌桶限制每个用户的用量。
+
+    每轮生成结束时用 Ollama 最后一个 chunk 中的 prompt_eval_count、eval_count 和 eval_duration 记账：
+    先在内存中按（用户, 模型, 小时）累加，每隔 flush_interval 秒批量写入 TokenUsage，每个键每次只写一行。
+    额度在请求发给 Ollama 之前检查：回答的长度事先不知道，所以只要求桶里还有余量，
+    实际用量在结束后扣除，超出的部分由之后的恢复抵扣。令牌桶只在本进程内生效，多进程部署时每个进程各算各的。
+    """
+
+    def __init__(self, flush_interval: float, tokens_per_minute: int, burst: int, overrides: Dict[int, int]):
+        self.flush_interval = flush_interval
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self.overrides = overrides
+        # 等待写入的累计：键 -> [请求数, 提示词 token, 回答 token, 生成耗时毫秒]
+        self._pending: Dict[UsageKey, List[int]] = {}
+        self._buckets: Dict[int, _Bucket] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def limit(self, user_id: int) -> Tuple[int, int]:
+        """用户每分钟的额度和令牌桶容量，额度为 0 表示不限制"""
+        per_minute = self.overrides.get(user_id, self.tokens_per_minute)
+        if user_id in self.overrides or not self.burst:
+            return per_minute, per_minute
+        return per_minute, self.burst
+
+    def _refill(self, user_id: int) -> Optional[_Bucket]:
+        per_minute, capacity = self.limit(user_id)
+        if per_minute <= 0:
+            return None
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(capacity)
+        now = time.monotonic()
+        bucket.level = min(capacity, bucket.level + (now - bucket.updated) * per_minute / 60)
+        bucket.updated = now
+        return bucket
+
+    def check(self, user_id: int) -> None:
+        """
+        在向 Ollama 发送请求前检查用户的额度。
+
+        参数:
+            user_id (int): 用户 ID。
+
+        异常:
+            QuotaExceededError: 额度已用完，retry_after 为恢复到有余量需要的秒数。
+        """
+        bucket = self._refill(user_id)
+        if bucket is not None and bucket.level <= 0:
+            quota_rejections.inc()
+            per_minute, _ = self.limit(user_id)
+            raise QuotaExceededError(user_id, max(1, math.ceil(-bucket.level * 60 / per_minute)))
+
+    def quota(self, user_id: int) -> Optional[dict]:
+        """用户当前的额度状态，不限制时返回 None"""
+        bucket = self._refill(user_id)
+        if bucket is None:
+            return None
+        per_minute, capacity = self.limit(user_id)
+        return {
+            "tokens_per_minute": per_minute,
+            "burst": capacity,
+            "remaining": max(0, int(bucket.level)),
+            "retry_after": 0 if bucket.level > 0 else max(1, math.ceil(-bucket.level * 60 / per_minute)),
+        }
+
+    def record(self, user_id: int, model: str, stats: dict) -> None:
+        """
+        记录一次生成的用量，扣除令牌桶并累加到待写入的统计中。
+
+        参数:
+            user_id (int): 用户 ID。
+            model (str): 使用的模型。
+            stats (dict): Ollama 最后一个 chunk，读取 prompt_eval_count、eval_count 和 eval_duration（纳秒）；
+                生成被中断时由调用方按已收到的 chunk 数估算 eval_count。
+
+        返回:
+            None
+        """
+        prompt_tokens = int(stats.get("prompt_eval_count") or 0)
+        completion_tokens = int(stats.get("eval_count") or 0)
+        eval_ms = int((stats.get("eval_duration") or 0) / 1e6)
+        usage_tokens.labels("prompt").inc(prompt_tokens)
+        usage_tokens.labels("completion").inc(completion_tokens)
+
+        bucket = self._refill(user_id)
+        if bucket is not None:
+            bucket.level -= prompt_tokens + completion_tokens
+
+        period = timezone.now().replace(minute=0, second=0, microsecond=0)
+        totals = self._pending.setdefault((user_id, model, period), [0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += completion_tokens
+        totals[3] += eval_ms
+        usage_pending.set(len(self._pending))
+
+    def start(self) -> None:
+        """在事件循环中启动定时写入任务"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """停止定时写入，并写完所有待写入的用量"""
+        if self._task is not None:
+            # 不能直接取消：写到一半被打断，重试时会重复累加
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush token usage")
+            self._prune()
+
+    def _prune(self) -> None:
+        # 已经恢复满的令牌桶和新建的没有区别，不必保留
+        for user_id in list(self._buckets):
+            _, capacity = self.limit(user_id)
+            bucket = self._refill(user_id)
+            if bucket is None or bucket.level >= capacity:
+                self._buckets.pop(user_id, None)
+
+    async def flush(self) -> None:
+        """把当前累计的用量写入数据库，没写成功的并回内存等下次重试"""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            usage_flushes.inc()
+            try:
+                await self._write(batch)
+            except Exception:
+                usage_write_failures.inc()
+                logger.exception("Failed to write %d token usage rows", len(batch))
+            # _write 删掉已写入的键，剩下的留到下次
+            for key, totals in batch.items():
+                pending = self._pending.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(totals):
+                    pending[i] += value
+            usage_pending.set(len(self._pending))
+
+    async def _write(self, batch: Dict[UsageKey, List[int]]) -> None:
+        # 已有的行原地累加，本小时第一次出现的一次批量插入
+        missing = []
+        for key in list(batch):
+            if await self._add(key, batch[key]):
+                del batch[key]
+                usage_rows_written.inc()
+            else:
+                missing.append(key)
+        if not missing:
+            return
+        try:
+            await TokenUsage.bulk_create([self._row(key, batch[key]) for key in missing])
+        except IntegrityError:
+            # 其他进程同时插入了同一小时的行，逐行改为累加
+            for key in missing:
+                if not await self._add(key, batch[key]):
+                    await self._row(key, batch[key]).save()
+                del batch[key]
+                usage_rows_written.inc()
+            return
+        for key in missing:
+            del batch[key]
+        usage_rows_written.inc(len(missing))
+
+    @staticmethod
+    def _row(key: UsageKey, totals: List[int]) -> TokenUsage:
+        user_id, model, period = key
+        return TokenUsage(
+            user_id=user_id, model=model, period=period, requests=totals[0],
+            prompt_tokens=totals[1], completion_tokens=totals[2], eval_ms=totals[3],
+        )
+
+    async def _add(self, key: UsageKey, totals: List[int]) -> bool:
+        user_id, model, period = key
+        return bool(await TokenUsage.filter(user_id=user_id, model=model, period=period).update(
+            requests=F("requests") + totals[0],
+            prompt_tokens=F("prompt_tokens") + totals[1],
+            completion_tokens=F("completion_tokens") + totals[2],
+            eval_ms=F("eval_ms") + totals[3],
+        ))
+
+
+usage_ledger = UsageLedger(
+    flush_interval=config.OLLAMA_USAGE_FLUSH_INTERVAL,
+    tokens_per_minute=config.OLLAMA_USER_TOKENS_PER_MINUTE,
+    burst=config.OLLAMA_USER_TOKEN_BURST,
+    overrides=config.OLLAMA_USER_QUOTA_OVERRIDES,
+)
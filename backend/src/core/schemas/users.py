@@ -1,18 +1,32 @@
+from pydantic import BaseModel
 from tortoise.contrib.pydantic import pydantic_model_creator
 
 from src.core.database.models import Users
 
 
-# 创建一个名为 UserIn 的 Pydantic 模型，用于表示用户输入数据，不包括只读字段
+# 创建一个名为 UserIn 的 Pydantic 模型，用于表示用户输入数据，不包括只读字段和删除标记
 UserInSchema = pydantic_model_creator(
-    Users, name="UserIn", exclude_readonly=True
+    Users, name="UserIn", exclude_readonly=True, exclude=["deleted_at"]
 )
 
-# 创建一个名为 UserOut 的 Pydantic 模型，用于表示用户输出数据，不包括密码、创建时间和修改时间字段
+# 创建一个名为 UserOut 的 Pydantic 模型，用于表示用户输出数据，不包括密码、创建时间、修改时间和删除标记字段；
+# 也不包括反向关联：否则会带出用户全部的会话、消息、批量任务和用量（其中还有二进制字段，无法编码成 JSON），
+# 已删除但尚未清理的会话也会出现在返回中
 UserOutSchema = pydantic_model_creator(
-    Users, name="UserOut", exclude=["password", "created_at", "modified_at"]
+    Users,
+    name="UserOut",
+    exclude=[
+        "password", "created_at", "modified_at", "deleted_at",
+        "sessions", "conversations", "batch_jobs", "token_usage",
+    ],
 )
 
+
+class CurrentUser(BaseModel):#认证得到的用户身份，按令牌缓存；只有标量字段，大小与用户的历史记录无关
+    id: int
+    username: str
+
+
 # 创建一个名为 User 的 Pydantic 模型，用于表示数据库中的用户数据，不包括创建时间和修改时间字段
 # UserDatabaseSchema = pydantic_model_creator(
 #     Users, name="User", exclude=["created_at", "modified_at"]
@@ -1,18 +1,27 @@
+from src.core.lifecycle import register_lifecycle, startup_timer
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from src.core.auth.hashing import register_hashing
 from src.core.database.config import TORTOISE_ORM
 from src.core.database.register import register_tortoise
+from src.core.instrumentation import register_metrics
+from src.core.ollama.register import register_ollama
 from tortoise import Tortoise
 
+# 启动耗时从第一行导入 lifecycle 开始计，依次记录各阶段
+startup_timer.phase("import")
+
 # enable schemas to read relationship between models
 Tortoise.init_models(["src.core.database.models"], "models")
+startup_timer.phase("init_models")
 
 """
 import 'from src.routes import users, notes' must be after 'Tortoise.init_models'
 why?
 https://stackoverflow.com/questions/65531387/tortoise-orm-for-python-no-returns-relations-of-entities-pyndantic-fastapi
 """
-from src.routes import users, ollama_chat
+from src.routes import users, ollama_chat, metrics, search, batch, usage, export, health
+startup_timer.phase("routes")
 
 app = FastAPI()
 
@@ -27,8 +36,19 @@
 
 app.include_router(users.router)
 app.include_router(ollama_chat.router)
+app.include_router(metrics.router)
+app.include_router(search.router)
+app.include_router(batch.router)
+app.include_router(usage.router)
+app.include_router(export.router)
+app.include_router(health.router)
 
 register_tortoise(app, config=TORTOISE_ORM, generate_schemas=False)
+register_metrics(app)
+register_ollama(app)
+register_hashing(app)
+# 放在最后，才能把其他模块的启动事件都计入启动耗时
+register_lifecycle(app)
 
 
 @app.get("/")
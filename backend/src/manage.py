@@ -0,0 +1,108 @@
+"""
+运维命令，在 backend 目录下执行（容器中为 docker-compose exec backend python -m src.manage ...）:
+    python -m src.manage search-index [--batch-size 5000]
+    python -m src.manage backfill-sessions [--batch-size 500]
+    python -m src.manage export --user-id 1 [--output history-1.ndjson.gz]
+    python -m src.manage import --user-id 1 --input history-1.ndjson.gz
+"""
+import argparse
+import asyncio
+import sys
+
+from tortoise import Tortoise
+
+from src.core.database.config import TORTOISE_ORM
+
+
+async def search_index(args) -> None:
+    """安装全文检索的触发器，补齐已有对话记录的 search_vector，再建 GIN 索引"""
+    from src.core.crud.search import backfill_search_vectors, create_search_index, install_search_trigger
+
+    def progress(done: int, total: int) -> None:
+        print(f"\rbackfill: id {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    # 先装触发器：补齐期间新写入的行由触发器处理，不会漏掉
+    await install_search_trigger()
+    updated = await backfill_search_vectors(args.batch_size, progress)
+    print(f"\nbackfilled {updated} rows, creating index", file=sys.stderr)
+    await create_search_index()
+    print("search index ready", file=sys.stderr)
+
+
+async def backfill_sessions(args) -> None:
+    """根据已有的对话记录补齐会话的消息条数、最后活动时间和最后一条消息的预览"""
+    from src.core.database.summaries import backfill_session_summaries
+
+    def progress(done: int, total: int) -> None:
+        print(f"\rbackfill: session {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    updated = await backfill_session_summaries(args.batch_size, progress)
+    print(f"\nbackfilled {updated} sessions", file=sys.stderr)
+
+
+async def export(args) -> None:
+    """把用户的全部会话和消息导出为 gzip 压缩的 NDJSON 文件"""
+    from src.core.crud.export import export_history
+
+    output = args.output or f"history-{args.user_id}.ndjson.gz"
+    written = 0
+    with open(output, "wb") as f:
+        async for data in export_history(args.user_id, args.chunk_rows):
+            f.write(data)
+            written += len(data)
+    print(f"exported user {args.user_id} to {output} ({written} bytes)", file=sys.stderr)
+
+
+async def import_(args) -> None:
+    """把 export 导出的文件导入为用户的新会话和消息"""
+    from src.core.crud.export import ImportFormatError, import_history
+
+    async def chunks():
+        with open(args.input, "rb") as f:
+            while data := f.read(1024 * 1024):
+                yield data
+
+    try:
+        counts = await import_history(args.user_id, chunks(), args.batch_rows)
+    except ImportFormatError as e:
+        sys.exit(f"import failed: {e}")
+    print(f"imported {counts['sessions']} sessions and {counts['messages']} messages", file=sys.stderr)
+
+
+async def _run(args) -> None:
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        await args.handler(args)
+    finally:
+        await Tortoise.close_connections()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("search-index", help="初始化或补齐对话记录的全文索引（可重复执行）")
+    command.add_argument("--batch-size", type=int, default=5000, help="每批更新的 ID 区间长度")
+    command.set_defaults(handler=search_index)
+
+    command = commands.add_parser("backfill-sessions", help="补齐会话列表侧边栏用的冗余字段（可重复执行）")
+    command.add_argument("--batch-size", type=int, default=500, help="每批处理的会话数")
+    command.set_defaults(handler=backfill_sessions)
+
+    command = commands.add_parser("export", help="导出用户的全部会话和消息（gzip 压缩的 NDJSON）")
+    command.add_argument("--user-id", type=int, required=True)
+    command.add_argument("--output", help="输出文件，默认 history-<user_id>.ndjson.gz")
+    command.add_argument("--chunk-rows", type=int, default=2000, help="每次查询的行数")
+    command.set_defaults(handler=export)
+
+    command = commands.add_parser("import", help="把导出文件导入为用户的新会话和消息")
+    command.add_argument("--user-id", type=int, required=True)
+    command.add_argument("--input", required=True, help="export 导出的 .ndjson.gz 或 .ndjson 文件")
+    command.add_argument("--batch-rows", type=int, default=1000, help="每个事务写入的消息数")
+    command.set_defaults(handler=import_)
+
+    asyncio.run(_run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
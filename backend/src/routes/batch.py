@@ -0,0 +1,194 @@
+from datetime import datetime
+from typing import List, Optional
+
+import orjson
+from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+
+from src.core.crud.pagination import MAX_PAGE_LIMIT, keyset_filter, next_cursor
+from src.core.crud.serialization import rows_response
+from src.core.database.models import BatchItem, BatchJob
+from src.core.ollama import config as ollama_config
+from src.core.ollama.batch import (
+    ACTIVE_JOB_STATUSES, FINISHED_ITEM_STATUSES, batch_runner, create_job, decompress_result,
+)
+
+
+router = APIRouter(tags=["batch"])
+
+JOB_FIELDS = ("id", "user_id", "model", "status", "total", "completed", "failed", "created_at", "finished_at")
+
+# follow 模式下没有新结果时重新查询的间隔（秒），其他进程处理的进度只能靠轮询发现
+_FOLLOW_POLL_SECONDS = 1.0
+
+
+# ——— Pydantic Schemas ——————————————————————————————————————————
+
+class BatchJobRequest(BaseModel):
+    user_id: int
+    model: str = "deepseek-r1:latest"
+    prompts: List[str]
+    options: Optional[dict] = None  # 随每个提示词发送给 Ollama 的 options，例如 {"temperature": 0}
+
+
+class BatchJobResponse(BaseModel):
+    id: int
+    user_id: int
+    model: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+
+# ——— 工具函数 ————————————————————————————————————————————————————
+
+
+def _check_prompts(prompts: List[str]) -> None:
+    if not prompts:
+        raise HTTPException(400, "At least one prompt is required")
+    if len(prompts) > ollama_config.OLLAMA_BATCH_MAX_ITEMS:
+        raise HTTPException(413, f"A job can have at most {ollama_config.OLLAMA_BATCH_MAX_ITEMS} prompts")
+
+
+def _parse_jsonl(data: bytes) -> List[str]:
+    """每行一个 JSON 字符串，或带 prompt 字段的对象；空行跳过"""
+    prompts = []
+    for number, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            value = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise HTTPException(400, f"Line {number} is not valid JSON")
+        if isinstance(value, dict):
+            value = value.get("prompt")
+        if not isinstance(value, str) or not value:
+            raise HTTPException(400, f"Line {number} has no prompt")
+        prompts.append(value)
+    return prompts
+
+
+async def _get_job(job_id: int) -> BatchJob:
+    job = await BatchJob.get_or_none(id=job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+def _result_line(row: tuple) -> bytes:
+    index, status, result, error, prompt_eval_count, eval_count = row
+    return orjson.dumps({
+        "index": index,
+        "status": status,
+        "response": decompress_result(result),
+        "error": error,
+        "prompt_eval_count": prompt_eval_count,
+        "eval_count": eval_count,
+    }) + b"\n"
+
+
+def _finished_items(job_id: int, after: int, limit: int):
+    return BatchItem.filter(
+        job_id=job_id, index__gt=after, status__in=FINISHED_ITEM_STATUSES
+    ).order_by("index").limit(limit).values_list("index", "status", "result", "error", "prompt_eval_count", "eval_count")
+
+
+async def _follow_results(job_id: int, after: int):
+    """按序号顺序输出结果，等待下一个提示词处理完再继续，直到任务结束"""
+    while True:
+        # 先查状态再查结果：状态是结束时，查到的结果一定是全部
+        status, total = (await BatchJob.filter(id=job_id).values_list("status", "total"))[0]
+        active = status in ACTIVE_JOB_STATUSES
+        rows = await _finished_items(job_id, after, MAX_PAGE_LIMIT)
+        progressed = False
+        for row in rows:
+            # 进行中的任务只输出连续的部分，后面的提示词可能先于前面的完成
+            if active and row[0] != after + 1:
+                break
+            yield _result_line(row)
+            after, progressed = row[0], True
+        if after + 1 >= total or (not active and len(rows) < MAX_PAGE_LIMIT):
+            return
+        if not progressed:
+            await batch_runner.wait_for_progress(_FOLLOW_POLL_SECONDS)
+
+
+# ——— 批量任务 Endpoints —————————————————————————————————————————
+
+
+@router.post("/batch/jobs", response_model=BatchJobResponse, status_code=201)
+async def submit_job(req: BatchJobRequest):
+    """提交一批提示词，后台在空闲时按顺序处理"""
+    _check_prompts(req.prompts)
+    return await create_job(req.user_id, req.model, req.prompts, req.options)
+
+
+@router.post("/batch/jobs/upload", response_model=BatchJobResponse, status_code=201)
+async def upload_job(
+    user_id: int = Form(..., description="用户 ID"),
+    model: str = Form("deepseek-r1:latest", description="使用的模型"),
+    file: UploadFile = File(..., description="JSONL 文件，每行一个 JSON 字符串或 {\"prompt\": ...}"),
+):
+    """以 JSONL 文件提交批量任务"""
+    prompts = _parse_jsonl(await file.read())
+    _check_prompts(prompts)
+    return await create_job(user_id, model, prompts)
+
+
+@router.get("/batch/jobs", response_model=List[BatchJobResponse])
+async def list_jobs(
+    user_id: int = Query(..., description="用户 ID"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT, description="单页条数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+) -> Response:
+    """按创建时间倒序分页列出用户的批量任务，下一页游标放在响应头 X-Next-Cursor 中"""
+    rows = await BatchJob.filter(
+        keyset_filter("created_at", cursor, descending=True), user_id=user_id
+    ).order_by("-created_at", "-id").limit(limit + 1).values_list(*JOB_FIELDS)
+    cursor = next_cursor(rows, limit, JOB_FIELDS.index("created_at"), JOB_FIELDS.index("id"))
+    return rows_response(JOB_FIELDS, rows[:limit], headers={"X-Next-Cursor": cursor} if cursor else None)
+
+
+@router.get("/batch/jobs/{job_id}", response_model=BatchJobResponse)
+async def get_job(job_id: int):
+    """查询任务状态和进度"""
+    return await _get_job(job_id)
+
+
+@router.post("/batch/jobs/{job_id}/cancel", response_model=BatchJobResponse)
+async def cancel_job(job_id: int):
+    """取消任务：未处理的提示词不再处理，已有的结果保留"""
+    await BatchJob.filter(id=job_id, status__in=ACTIVE_JOB_STATUSES).update(status="cancelled")
+    batch_runner.cancel_job(job_id)
+    return await _get_job(job_id)
+
+
+@router.get("/batch/jobs/{job_id}/results")
+async def get_results(
+    job_id: int,
+    after: int = Query(-1, ge=-1, description="只返回序号大于它的结果"),
+    limit: int = Query(MAX_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT, description="单页条数，follow 时忽略"),
+    follow: bool = Query(False, description="按序号顺序持续输出结果直到任务结束"),
+):
+    """
+    以 NDJSON 返回已处理完的提示词结果，每行包含 index、status（done / failed）、response、error 和 token 数。
+
+    默认返回目前已完成的结果（按序号排序，可能不连续），还有更多时带上 X-Next-After；
+    follow=true 时按序号顺序流式输出，等待后面的提示词处理完，直到任务结束或被取消。
+    """
+    await _get_job(job_id)
+    if follow:
+        return StreamingResponse(_follow_results(job_id, after), media_type="application/x-ndjson")
+
+    rows = await _finished_items(job_id, after, limit + 1)
+    headers = {"X-Next-After": str(rows[limit - 1][0])} if len(rows) > limit else None
+    return Response(
+        b"".join(_result_line(row) for row in rows[:limit]), media_type="application/x-ndjson", headers=headers
+    )
@@ -0,0 +1,75 @@
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+
+from src.core.auth.jwthandler import ADMIN_USERNAMES, get_current_user
+from src.core.crud.export import ImportFormatError, export_history, import_history
+from src.core.database.reaper import live_users
+from src.core.schemas.users import CurrentUser
+
+
+router = APIRouter(tags=["export"])
+
+# 读取上传文件的块大小（字节）
+_UPLOAD_CHUNK_BYTES = 256 * 1024
+
+
+async def _target_user(current_user: CurrentUser, user_id: Optional[int]) -> int:
+    """不指定 user_id 时为当前用户；指定其他用户需要管理员权限"""
+    if user_id is None or user_id == current_user.id:
+        return current_user.id
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(403, "Admin privileges required")
+    if not await live_users().filter(id=user_id).exists():
+        raise HTTPException(404, "User not found")
+    return user_id
+
+
+@router.get("/history/export")
+async def export_user_history(
+    user_id: Optional[int] = Query(None, description="导出的用户，默认当前用户；导出其他用户需要管理员权限"),
+    current_user: CurrentUser = Depends(get_current_user),
+) -> StreamingResponse:
+    """
+    以 gzip 压缩的 NDJSON 文件下载用户的全部会话和消息，边读数据库边压缩输出。
+
+    返回:
+        StreamingResponse: history-{user_id}.ndjson.gz 附件。
+    """
+    target = await _target_user(current_user, user_id)
+    return StreamingResponse(
+        export_history(target),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="history-{target}.ndjson.gz"'},
+    )
+
+
+@router.post("/history/import")
+async def import_user_history(
+    file: UploadFile = File(..., description="/history/export 导出的 .ndjson.gz（或解压后的 .ndjson）文件"),
+    user_id: Optional[int] = Query(None, description="导入到的用户，默认当前用户；导入到其他用户需要管理员权限"),
+    current_user: CurrentUser = Depends(get_current_user),
+) -> Dict[str, int]:
+    """
+    导入导出文件中的会话和消息，作为新会话追加到用户名下。
+
+    返回:
+        Dict[str, int]: 导入的会话数 sessions 和消息数 messages。
+
+    异常:
+        HTTPException: 文件格式不正确时返回 400，之前已写入的批次保留。
+    """
+    target = await _target_user(current_user, user_id)
+
+    async def chunks():
+        while True:
+            data = await file.read(_UPLOAD_CHUNK_BYTES)
+            if not data:
+                return
+            yield data
+
+    try:
+        return await import_history(target, chunks())
+    except ImportFormatError as e:
+        raise HTTPException(400, str(e))
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from tortoise import Tortoise
+
+from src.core.lifecycle import drain, startup_timer
+from src.core.ollama.backends import pool
+
+
+router = APIRouter(tags=["health"])
+
+# 就绪检查中数据库查询的超时时间（秒）
+HEALTH_DB_TIMEOUT = float(os.environ.get("HEALTH_DB_TIMEOUT", "2"))
+
+_process_started = time.monotonic()
+
+
+@router.get("/healthz")
+async def liveness() -> dict:
+    """
+    存活检查：能响应就说明进程和事件循环都正常。
+
+    不检查数据库和 Ollama：它们不可用时重启工作进程也无济于事，由 /readyz 把流量摘走；
+    依赖的状态只在 /readyz 中报告。
+
+    返回:
+        dict: 进程 ID、运行时长、是否正在排空和启动耗时。
+    """
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.monotonic() - _process_started, 1),
+        "draining": drain.draining,
+        "startup_seconds": round(startup_timer.total, 3) if startup_timer.total is not None else None,
+    }
+
+
+@router.get("/readyz")
+async def readiness() -> JSONResponse:
+    """
+    就绪检查：数据库能执行查询、至少有一个健康的 Ollama 后端、且进程没有在排空时返回 200，否则返回 503。
+
+    Ollama 的健康状态取自后端池的后台探测，检查本身不请求 Ollama。
+
+    返回:
+        JSONResponse: 各项检查的结果。
+    """
+    try:
+        await asyncio.wait_for(
+            Tortoise.get_connection("default").execute_query("SELECT 1"), HEALTH_DB_TIMEOUT
+        )
+        database = "ok"
+    except Exception as e:
+        database = f"error: {type(e).__name__}"
+    healthy = sum(1 for backend in pool.backends if backend.healthy)
+    checks = {
+        "database": database,
+        "ollama": f"{healthy}/{len(pool.backends)} backends healthy",
+        "draining": drain.draining,
+    }
+    ready = database == "ok" and healthy > 0 and not drain.draining
+    return JSONResponse({"status": "ok" if ready else "unavailable", **checks}, status_code=200 if ready else 503)
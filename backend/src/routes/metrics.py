@@ -0,0 +1,31 @@
+from typing import Dict
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.core import metrics
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/stats")
+async def read_stats() -> Dict[str, float]:
+    """
+    获取进程内的运行指标。
+
+    返回:
+        Dict[str, float]: 指标名到取值的映射。
+    """
+    return metrics.snapshot()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics() -> PlainTextResponse:
+    """
+    以 Prometheus 文本格式导出全部指标，供 Prometheus 抓取。
+
+    返回:
+        PlainTextResponse: 指标文本。
+    """
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,35 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Query
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, Header, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import requests, json
+from tortoise import timezone
+from typing import List, Optional, Tuple
 from datetime import datetime
+import asyncio
 
 # Tortoise ORM models
+from src.core.crud.pagination import (
+    MAX_PAGE_LIMIT, keyset_filter, next_cursor, parse_fields, query_columns,
+)
+from src.core.crud.serialization import rows_response
 from src.core.database.models import ChatSession, Conversation
+from src.core.database.reaper import live_sessions, live_users, reaper
+from src.core.database.writer import conversation_writer
+from src.core.events import event_hub, sse_frames
+from src.core.instrumentation import stage_timer
+from src.core.ollama import config as ollama_config
+from src.core.ollama.cancellation import DisconnectCheck, GenerationTracker
+from src.core.ollama.client import OllamaError, open_stream, iter_chunks, chunk_text
+from src.core.ollama.context_cache import context_cache
+from src.core.ollama.generations import Follower, Generation, OffsetEvictedError, generation_registry, generations_reattached
+from src.core.ollama.history import history_cache
+from src.core.ollama.memory import inject_memory, semantic_memory
+from src.core.ollama.response_cache import cache_key, coalescer
+from src.core.ollama.scheduler import QueueFullError, Slot, scheduler
+from src.core.ollama.streaming import (
+    StreamFormat, done_event, error_event, stats_event, stream_response, token_event,
+)
+from src.core.ollama.titling import DEFAULT_SESSION_TITLE, session_titler
+from src.core.ollama.usage import QuotaExceededError, usage_ledger
 
 router = APIRouter(tags=["chat"])
 
@@ -16,11 +39,12 @@
 class MessageRequest(BaseModel):
     message: str
     model: str = "deepseek-r1:latest"
+    memory: bool = False  # 会话请求是否带上用户其他会话中的相关内容（需开启 OLLAMA_MEMORY_ENABLED）
 
 
 class SessionCreateRequest(BaseModel):
     user_id: int
-    title: str = "新对话"
+    title: str = DEFAULT_SESSION_TITLE
 
 
 class SessionResponse(BaseModel):
@@ -33,20 +57,102 @@ class Config:
         orm_mode = True
 
 
+class SidebarEntry(BaseModel):
+    id: int
+    title: str
+    last_message_preview: Optional[str]  # 最后一轮的回答（为空时是提问）的开头，没有消息时为 null
+    message_count: int
+    last_activity: datetime  # 最后一轮的时间，没有消息时为创建时间
+
+
 class ConversationResponse(BaseModel):
     id: int
     user_message: str
     ai_message: str
     timestamp: datetime
     session_id: Optional[int]
+    truncated: bool = False
 
     class Config:
         orm_mode = True
 
 
-# ——— 配置 ———————————————————————————————————————————————————————
+# 列表接口允许投影的字段
+SESSION_FIELDS = ("id", "user_id", "title", "created_at")
+SIDEBAR_FIELDS = ("id", "title", "last_message_preview", "message_count", "last_activity")
+MESSAGE_FIELDS = ("id", "user_message", "ai_message", "timestamp", "session_id", "truncated")
+
 
-OLLAMA_API_URL = "http://ollama:11434/api/generate"
+# ——— 工具函数 ————————————————————————————————————————————————————
+
+
+async def _acquire_slot(model: str, user_key) -> Slot:
+    """排队获取模型的生成名额，队列已满时返回 429"""
+    try:
+        return await scheduler.acquire(model, user_key)
+    except QueueFullError as e:
+        raise HTTPException(
+            429,
+            "Too many queued requests, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def _check_quota(user_id: int) -> None:
+    """用户的 token 额度已用完时返回 429"""
+    try:
+        usage_ledger.check(user_id)
+    except QuotaExceededError as e:
+        raise HTTPException(
+            429,
+            "Token quota exceeded, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def _session_payload(session: ChatSession, request: MessageRequest, history) -> Tuple[str, dict]:
+    """
+    选择会话请求的接口和请求体。
+
+    开启 context 复用时走 /api/generate：有上一轮的 context 就只发送本轮消息，
+    否则把历史窗口拼成 prompt，并在本轮结束时拿到新的 context；关闭时走 /api/chat。
+    """
+    if not ollama_config.OLLAMA_CONTEXT_REUSE:
+        messages = history_cache.build_messages(history, request.message)
+        return "/api/chat", {"model": request.model, "messages": messages, "stream": True}
+
+    payload = {"model": request.model, "stream": True}
+    context = await context_cache.get(session.id, request.model, session.message_count)
+    if context is not None:
+        payload.update(prompt=request.message, context=context.tolist())
+    else:
+        payload.update(history_cache.build_prompt(history, request.message))
+    return "/api/generate", payload
+
+
+def _page_response(rows: List[tuple], limit: int, columns: List[str], sort_field: str, fields: List[str]) -> Response:
+    """返回一页投影后的结果，还有下一页时带上 X-Next-Cursor"""
+    cursor = next_cursor(rows, limit, columns.index(sort_field), columns.index("id"))
+    headers = {"X-Next-Cursor": cursor} if cursor else None
+    return rows_response(fields, rows, headers=headers)
+
+
+def _queue_headers(wait_seconds: float) -> dict:
+    return {"X-Queue-Wait-Ms": str(round(wait_seconds * 1000))}
+
+
+async def _follow_events(follower: Follower, http_request: Request):
+    """把接入的生成转成响应的事件流，生成完整结束时补上 done 事件"""
+    disconnect = DisconnectCheck(http_request)
+    try:
+        async for event in follower.events():
+            yield event
+            if await disconnect.disconnected():
+                return
+        if follower.generation.completed:
+            yield done_event()
+    finally:
+        follower.leave()
 
 
 # ——— 会话管理 Endpoints —————————————————————————————————————————
@@ -55,21 +161,65 @@ class Config:
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(req: SessionCreateRequest):
     """创建新对话会话"""
-    session = await ChatSession.create(user_id=req.user_id, title=req.title)
+    if not await live_users().filter(id=req.user_id).exists():
+        raise HTTPException(404, "User not found")
+    # 还没有消息时最后活动时间就是创建时间
+    now = timezone.now()
+    session = await ChatSession.create(user_id=req.user_id, title=req.title, created_at=now, last_activity=now)
     return session
 
 
 @router.get("/sessions", response_model=List[SessionResponse])
-async def list_sessions(user_id: int = Query(..., description="用户 ID")):
-    """列出指定用户的所有会话"""
-    sessions = await ChatSession.filter(user_id=user_id).order_by("-created_at")
-    return sessions
+async def list_sessions(
+    user_id: int = Query(..., description="用户 ID"),
+    limit: int = Query(MAX_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT, description="单页条数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    fields: Optional[str] = Query(None, description="只返回这些字段，逗号分隔"),
+):
+    """按创建时间倒序分页列出指定用户的会话，下一页游标放在响应头 X-Next-Cursor 中"""
+    selected = parse_fields(fields, SESSION_FIELDS)
+    columns = query_columns(selected, "id", "created_at")
+    rows = await live_sessions().filter(
+        keyset_filter("created_at", cursor, descending=True), user_id=user_id
+    ).order_by("-created_at", "-id").limit(limit + 1).values_list(*columns)
+    return _page_response(rows, limit, columns, "created_at", selected)
+
+
+@router.get("/sessions/sidebar", response_model=List[SidebarEntry])
+async def session_sidebar(
+    user_id: int = Query(..., description="用户 ID"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT, description="单页条数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+):
+    """
+    侧边栏：按最后活动时间倒序分页列出用户的会话，带标题、最后一条消息的预览和消息条数。
+
+    这些都是会话上随对话记录写入增量维护的字段，一页只需一条查询，不必再逐个会话读取消息。
+    下一页游标放在响应头 X-Next-Cursor 中。
+    """
+    rows = await live_sessions().filter(
+        keyset_filter("last_activity", cursor, descending=True), user_id=user_id
+    ).order_by("-last_activity", "-id").limit(limit + 1).values_list(*SIDEBAR_FIELDS)
+    return _page_response(rows, limit, SIDEBAR_FIELDS, "last_activity", SIDEBAR_FIELDS)
+
+
+@router.get("/sessions/events")
+async def session_events(user_id: int = Query(..., description="用户 ID")):
+    """
+    以 Server-Sent Events 推送该用户会话的变化，目前有 title 事件（自动生成的标题）：
+    data 为 {"session_id": ..., "title": ...}。空闲时定期发送注释行保活。
+    """
+    return StreamingResponse(
+        sse_frames(event_hub.subscribe(user_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/sessions/{session_id}", response_model=SessionResponse)
 async def get_session(session_id: int):
     """获取单个会话的信息"""
-    session = await ChatSession.get_or_none(id=session_id)
+    session = await live_sessions().get_or_none(id=session_id)
     if not session:
         raise HTTPException(404, "Session not found")
     return session
@@ -77,13 +227,18 @@ async def get_session(session_id: int):
 
 @router.delete("/sessions/{session_id}", status_code=204)
 async def delete_session(session_id: int):
-    """删除会话及其所有消息"""
-    # 先删消息
-    await Conversation.filter(session_id=session_id).delete()
-    # 再删会话
-    deleted = await ChatSession.filter(id=session_id).delete()
+    """
+    删除会话及其所有消息。
+
+    只给会话打上删除标记，之后的请求立即看不到它；消息由后台清理分批删除，
+    所以无论会话有多少消息，这里都只执行一条按主键的 UPDATE。
+    """
+    deleted = await ChatSession.filter(id=session_id, deleted_at=None).update(deleted_at=timezone.now())
+    history_cache.invalidate(session_id)
+    context_cache.invalidate(session_id)
     if not deleted:
         raise HTTPException(404, "Session not found")
+    reaper.wake()
     return
 
 
@@ -91,10 +246,21 @@ async def delete_session(session_id: int):
 
 
 @router.get("/sessions/{session_id}/messages", response_model=List[ConversationResponse])
-async def get_session_messages(session_id: int):
-    """获取某个会话下的所有消息（按时间）"""
-    msgs = await Conversation.filter(session_id=session_id).order_by("timestamp")
-    return msgs
+async def get_session_messages(
+    session_id: int,
+    limit: int = Query(MAX_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT, description="单页条数"),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    fields: Optional[str] = Query(None, description="只返回这些字段，逗号分隔"),
+):
+    """按时间分页获取某个会话下的消息，下一页游标放在响应头 X-Next-Cursor 中"""
+    if not await live_sessions().filter(id=session_id).exists():
+        raise HTTPException(404, "Session not found")
+    selected = parse_fields(fields, MESSAGE_FIELDS)
+    columns = query_columns(selected, "id", "timestamp")
+    rows = await Conversation.filter(
+        keyset_filter("timestamp", cursor, descending=False), session_id=session_id
+    ).order_by("timestamp", "id").limit(limit + 1).values_list(*columns)
+    return _page_response(rows, limit, columns, "timestamp", selected)
 
 
 @router.post("/sessions/{session_id}/messages/stream")
@@ -102,86 +268,205 @@ async def send_message_stream(
     session_id: int,
     request: MessageRequest,
     background_tasks: BackgroundTasks,
+    http_request: Request,
+    format: StreamFormat = Query("text", description="text 只返回回答文本；sse / ndjson 返回带类型的事件"),
 ):
     """
-    流式发送用户消息给 Ollama，并在后台保存对话记录。
+    流式发送用户消息给 Ollama（携带会话历史），并在后台保存对话记录。
+
+    生成与连接解耦，响应头 X-Generation-Id 是本次生成的 ID。客户端中途断开后，
+    生成继续运行 OLLAMA_GENERATION_DETACH_TIMEOUT 秒，期间可以从
+    /sessions/{session_id}/generations/{generation_id}/stream 接回；超时无人接回则中止上游生成，
+    已生成的部分回答标记为截断后保存。
+
+    用户的 token 额度（OLLAMA_USER_TOKENS_PER_MINUTE）已用完时返回 429，Retry-After 为恢复所需的秒数。
     """
 
-    # 确保会话存在
-    session = await ChatSession.get_or_none(id=session_id)
+    timer = stage_timer("session")
+
+    # 确保会话存在且没有被删除
+    session = await live_sessions().get_or_none(id=session_id)
     if not session:
         raise HTTPException(404, "Session not found")
-
-    # 向 Ollama 请求流式回答
-    payload = {
-        "model": request.model,
-        "prompt": request.message,
-        "stream": True
-    }
-    headers = {"Content-Type": "application/json"}
-    ollama_resp = requests.post(
-        OLLAMA_API_URL, json=payload, headers=headers, stream=True
-    )
-    if ollama_resp.status_code != 200:
-        raise HTTPException(500, f"Ollama API error: {ollama_resp.text}")
-
-    # 累积 AI 完整回答
-    ai_response_parts: List[str] = []
-
-    async def event_generator():
-        for line in ollama_resp.iter_lines(decode_unicode=True):
-            if not line:
-                continue
-            try:
-                chunk = json.loads(line)
-                text = chunk.get("response", "")
-                ai_response_parts.append(text)
-                yield text
-            except Exception:
-                yield "\n[Error parsing chunk]\n"
-
-        # 整体对话结束后，后台存库
-        full_ai_resp = "".join(ai_response_parts)
-        background_tasks.add_task(
-            Conversation.create,
-            user_id=session.user_id,
-            session_id=session.id,
-            user_message=request.message,
-            ai_message=full_ai_resp
+    _check_quota(session.user_id)
+    timer.stage("session_lookup")
+
+    # 带上历史窗口和滚动摘要（或上一轮的 context）请求
+    history = await history_cache.get(session)
+    # 第一轮结束后为仍是默认标题的会话生成标题
+    first_exchange = not history.turns and not history.summary and session.title == DEFAULT_SESSION_TITLE
+    path, payload = await _session_payload(session, request, history)
+    timer.stage("history")
+
+    if request.memory and ollama_config.OLLAMA_MEMORY_ENABLED:
+        memory = await semantic_memory.recall(session.user_id, session.id, request.message)
+        inject_memory(path, payload, memory)
+        timer.stage("memory")
+
+    # 排队获取名额后再向 Ollama 请求流式回答
+    slot = await _acquire_slot(request.model, session.user_id)
+    timer.stage("queue")
+    try:
+        ollama_resp = await open_stream(path, payload)
+    except OllamaError as e:
+        slot.release()
+        raise HTTPException(500, f"Ollama API error: {e.detail}")
+    timer.stage("upstream_connect")
+
+    async def generate(generation: Generation) -> bool:
+        tracker = GenerationTracker()
+        # 回答边生成边记录，长时间的生成会定期写检查点，结束后批量入库
+        turn = conversation_writer.begin(
+            user_id=session.user_id, session_id=session.id, user_message=request.message
         )
+        chunks = iter_chunks(ollama_resp)
+        # 最后一个 chunk 带有 token 数和耗时；中途结束时按收到的 chunk 数估算回答的 token 数
+        stats, streamed = {}, 0
+        try:
+            async for chunk in chunks:
+                if chunk is None:
+                    generation.push(error_event("Error parsing chunk"))
+                    continue
+                if "error" in chunk:
+                    # 生成中途出错，Ollama 会在输出 error 行后结束流
+                    tracker.fail()
+                    generation.push(error_event(str(chunk["error"])))
+                    break
+                tracker.feed(chunk)
+                if chunk.get("context"):
+                    # 本轮还没有计入 history.count
+                    context_cache.put(session.id, request.model, chunk["context"], history.count + 1)
+                text = chunk_text(chunk)
+                if text:
+                    streamed += 1
+                    turn.append(text)
+                    generation.push(token_event(text))
+                if chunk.get("done"):
+                    stats = chunk
+                    generation.push(stats_event(chunk, queue_wait_ms=round(slot.wait_seconds * 1000)))
+            else:
+                tracker.finish()
+        finally:
+            await tracker.close(chunks)
+            slot.release()
+            usage_ledger.record(session.user_id, request.model, stats or {"eval_count": streamed})
+            ai_message = turn.ai_message
+            history_cache.record_turn(session.id, request.message, ai_message, request.model)
+            if not tracker.finished:
+                # 截断的这一轮没有返回 context，缓存中的旧 context 已经过时
+                context_cache.invalidate(session.id)
+            # 无人接回被中止时也会执行到这里，截断的回答同样入库
+            conversation_writer.finish(turn, ai_message, truncated=not tracker.finished)
+            if first_exchange and ollama_config.OLLAMA_TITLE_ENABLED:
+                session_titler.enqueue(session.id, session.user_id, request.message, ai_message, request.model)
+        return tracker.finished
+
+    generation = generation_registry.start(session.user_id, session.id, generate)
+    follower = generation.follow()
+    # 响应体未开始迭代客户端就断开时，由后台任务兜底离开
+    background_tasks.add_task(follower.leave)
+    return stream_response(
+        _follow_events(follower, http_request),
+        format,
+        headers={"X-Generation-Id": generation.id, **_queue_headers(slot.wait_seconds)},
+        timer=timer,
+    )
 
-    return StreamingResponse(event_generator(), media_type="text/plain")
+
+@router.get("/sessions/{session_id}/generations/{generation_id}/stream")
+async def resume_generation(
+    session_id: int,
+    generation_id: str,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
+    offset: Optional[int] = Query(None, ge=0, description="已收到的回答长度：text 格式为字符数，sse / ndjson 为最后一个事件的 offset"),
+    last_event_id: Optional[int] = Header(None, ge=0, description="EventSource 重连时自动带上的最后一个事件 ID"),
+    format: StreamFormat = Query("text", description="text 只返回回答文本；sse / ndjson 返回带类型的事件"),
+):
+    """
+    接回断开的生成：先发送 offset 之后已生成的内容，再跟随后续的生成。
+
+    生成结束 OLLAMA_GENERATION_TTL 秒后不再保留，返回 404；offset 之后的内容已被移出回放缓冲区时返回 410，
+    此时可以等生成结束后从消息列表读取完整回答。
+    """
+    generation = generation_registry.get(generation_id)
+    if generation is None or generation.session_id != session_id:
+        raise HTTPException(404, "Generation not found")
+    try:
+        follower = generation.follow(offset if offset is not None else last_event_id or 0)
+    except OffsetEvictedError as e:
+        raise HTTPException(410, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    generations_reattached.inc()
+    background_tasks.add_task(follower.leave)
+    return stream_response(
+        _follow_events(follower, http_request),
+        format,
+        headers={"X-Generation-Id": generation.id},
+        timer=stage_timer("resume"),
+    )
 
 
 @router.post("/chat/stream")
-async def chat_stream(request: MessageRequest):
+async def chat_stream(
+    request: MessageRequest,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
+    format: StreamFormat = Query("text", description="text 只返回回答文本；sse / ndjson 返回带类型的事件"),
+):
+    """
+    无状态的流式对话。相同模型和提示词的请求直接回放缓存，或合并到进行中的同一次生成。
+    """
+    timer = stage_timer("chat")
+    key = cache_key(request.model, request.message)
+    cached = coalescer.cached(key)
+    if cached is not None:
+        async def replay_stream():
+            for event in cached:
+                yield event
+            yield done_event()
+
+        return stream_response(replay_stream(), format, headers={"X-Cache": "HIT"}, timer=timer)
+
+    # 无状态接口没有用户 ID，按客户端地址公平排队
+    user_key = http_request.client.host if http_request.client else None
+    subscription = coalescer.subscribe(key, request.message, user_key)
+    cache_status = "COALESCED" if subscription.flight.subscribers > 1 else "MISS"
     try:
-        data = {
-            "model": request.model,
-            "prompt": request.message,
-            "stream": True
-        }
-
-        headers = {
-            "Content-Type": "application/json"
-        }
-
-        ollama_response = requests.post(f"{OLLAMA_API_URL}", json=data, headers=headers, stream=True)
-
-        if ollama_response.status_code != 200:
-            raise HTTPException(status_code=500, detail="Ollama API error")
-
-        def generate_stream():
-            for line in ollama_response.iter_lines(decode_unicode=True):
-                if line:
-                    try:
-                        json_data = json.loads(line)
-                        content = json_data.get("response", "")
-                        yield content
-                    except Exception as e:
-                        yield f"\n[Error parsing chunk]: {e}"
-
-        return StreamingResponse(generate_stream(), media_type="text/plain")
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        # 当前请求被取消不应影响其他共享这次生成的请求
+        wait_seconds = await asyncio.shield(subscription.flight.ready)
+    except QueueFullError as e:
+        subscription.leave()
+        raise HTTPException(
+            429,
+            "Too many queued requests, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except OllamaError:
+        subscription.leave()
+        raise HTTPException(status_code=500, detail="Ollama API error")
+    except BaseException:
+        subscription.leave()
+        raise
+    background_tasks.add_task(subscription.leave)
+    timer.stage("queue")
+
+    async def generate_stream():
+        disconnect = DisconnectCheck(http_request)
+        try:
+            async for event in subscription.chunks():
+                yield event
+                if await disconnect.disconnected():
+                    return
+            if subscription.flight.completed:
+                yield done_event()
+        finally:
+            subscription.leave()
+
+    return stream_response(
+        generate_stream(),
+        format,
+        headers={"X-Cache": cache_status, **_queue_headers(wait_seconds)},
+        timer=timer,
+    )
@@ -0,0 +1,48 @@
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from src.core.crud.search import MAX_SEARCH_LIMIT, SearchUnavailableError, search_conversations
+from src.core.crud.serialization import rows_response
+
+
+router = APIRouter(tags=["search"])
+
+SEARCH_FIELDS = ("id", "session_id", "session_title", "timestamp", "rank", "user_snippet", "ai_snippet")
+
+
+class SearchResult(BaseModel):
+    id: int
+    session_id: Optional[int]
+    session_title: str
+    timestamp: datetime
+    rank: float
+    user_snippet: str  # HTML 转义后的片段，命中词用 <mark> 标出
+    ai_snippet: str
+
+
+@router.get("/search", response_model=List[SearchResult])
+async def search(
+    user_id: int = Query(..., description="用户 ID"),
+    q: str = Query(..., min_length=1, max_length=200, description="搜索词，支持 \"短语\"、or、-排除"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_LIMIT, description="单页条数"),
+    offset: int = Query(0, ge=0, description="上一页响应头 X-Next-Offset 的值"),
+) -> Response:
+    """
+    在用户所有会话的历史消息中全文检索，按相关度排序，还有下一页时带上 X-Next-Offset。
+
+    返回:
+        Response: 搜索结果数组。
+
+    异常:
+        HTTPException: 数据库不支持全文检索或索引尚未初始化时返回 503。
+    """
+    try:
+        rows = await search_conversations(user_id, q, limit + 1, offset)
+    except SearchUnavailableError as e:
+        raise HTTPException(503, str(e))
+    headers = {"X-Next-Offset": str(offset + limit)} if len(rows) > limit else None
+    return rows_response(SEARCH_FIELDS, [tuple(row[name] for name in SEARCH_FIELDS) for row in rows[:limit]], headers)
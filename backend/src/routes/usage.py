@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from pydantic import BaseModel
+from tortoise import timezone
+from tortoise.functions import Sum
+
+from src.core.auth.jwthandler import get_admin_user, get_current_user
+from src.core.crud.pagination import MAX_PAGE_LIMIT
+from src.core.crud.serialization import rows_response
+from src.core.database.models import TokenUsage
+from src.core.ollama.usage import usage_ledger
+from src.core.schemas.users import CurrentUser
+
+
+router = APIRouter(tags=["usage"])
+
+# 不指定开始时间时统计最近这么多天
+DEFAULT_USAGE_DAYS = 30
+
+USAGE_TOTALS = ("requests", "prompt_tokens", "completion_tokens", "eval_ms")
+ADMIN_USAGE_FIELDS = ("user_id", "model") + USAGE_TOTALS
+
+
+# ——— Pydantic Schemas ——————————————————————————————————————————
+
+class QuotaStatus(BaseModel):
+    tokens_per_minute: int
+    burst: int
+    remaining: int
+    retry_after: int  # 额度用完时恢复到有余量需要的秒数，否则为 0
+
+
+class UsageRow(BaseModel):
+    model: str
+    period: Optional[datetime]  # 按小时统计时为所在小时的开始时间
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    eval_ms: int
+
+
+class UsageReport(BaseModel):
+    user_id: int
+    since: datetime
+    until: Optional[datetime]
+    quota: Optional[QuotaStatus]  # 没有设置额度时为 null
+    usage: List[UsageRow]
+
+
+# ——— 工具函数 ————————————————————————————————————————————————————
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """把查询参数中的时间转成 UTC，不带时区的按 UTC 处理"""
+    if value is None:
+        return None
+    if timezone.is_naive(value):
+        return timezone.make_aware(value, "UTC")
+    return timezone.localtime(value, "UTC")
+
+
+def _period_filter(since: Optional[datetime], until: Optional[datetime]) -> dict:
+    """时间范围的过滤条件（均为 UTC），返回的 period__gte 总是有值"""
+    since = _utc(since) or timezone.now() - timedelta(days=DEFAULT_USAGE_DAYS)
+    until = _utc(until)
+    if until is not None and until <= since:
+        raise HTTPException(400, "until must be later than since")
+    filters = {"period__gte": since}
+    if until is not None:
+        filters["period__lt"] = until
+    return filters
+
+
+def _sum_totals(queryset):
+    # 汇总值不能与字段同名，先以 total_ 前缀聚合
+    return queryset.annotate(**{f"total_{name}": Sum(name) for name in USAGE_TOTALS})
+
+
+# ——— 用量 Endpoints —————————————————————————————————————————————
+
+
+@router.get("/usage", response_model=UsageReport)
+async def read_usage(
+    since: Optional[datetime] = Query(None, description=f"开始时间，默认最近 {DEFAULT_USAGE_DAYS} 天"),
+    until: Optional[datetime] = Query(None, description="结束时间（不含）"),
+    granularity: Literal["model", "hour"] = Query("model", description="model 按模型汇总；hour 按模型和小时列出"),
+    current_user: CurrentUser = Depends(get_current_user),
+) -> UsageReport:
+    """
+    查看当前用户的 token 用量和额度。
+
+    用量在内存中累计后每隔 OLLAMA_USAGE_FLUSH_INTERVAL 秒写入数据库，最近的请求可能还没有计入。
+
+    返回:
+        UsageReport: 用量和当前的额度状态。
+    """
+    filters = _period_filter(since, until)
+    queryset = TokenUsage.filter(user_id=current_user.id, **filters)
+    if granularity == "hour":
+        rows = await queryset.order_by("period", "model").values("model", "period", *USAGE_TOTALS)
+    else:
+        totals = await _sum_totals(queryset).group_by("model").order_by("model").values(
+            "model", *(f"total_{name}" for name in USAGE_TOTALS)
+        )
+        rows = [
+            {"model": row["model"], "period": None, **{name: int(row[f"total_{name}"] or 0) for name in USAGE_TOTALS}}
+            for row in totals
+        ]
+    return UsageReport(
+        user_id=current_user.id,
+        since=filters["period__gte"],
+        until=filters.get("period__lt"),
+        quota=usage_ledger.quota(current_user.id),
+        usage=rows,
+    )
+
+
+@router.get("/admin/usage", dependencies=[Depends(get_admin_user)])
+async def read_all_usage(
+    since: Optional[datetime] = Query(None, description=f"开始时间，默认最近 {DEFAULT_USAGE_DAYS} 天"),
+    until: Optional[datetime] = Query(None, description="结束时间（不含）"),
+    user_id: Optional[int] = Query(None, description="只看这个用户"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT, description="最多返回的行数"),
+) -> Response:
+    """
+    按用户和模型汇总所有用户的 token 用量，按回答 token 数从多到少排序（仅管理员）。
+
+    返回:
+        Response: 每行包含 user_id、model、requests、prompt_tokens、completion_tokens 和 eval_ms。
+    """
+    queryset = TokenUsage.filter(**_period_filter(since, until))
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    rows = await _sum_totals(queryset).group_by("user_id", "model").order_by(
+        "-total_completion_tokens", "user_id", "model"
+    ).limit(limit).values_list("user_id", "model", *(f"total_{name}" for name in USAGE_TOTALS))
+    return rows_response(ADMIN_USAGE_FIELDS, [row[:2] + tuple(int(v or 0) for v in row[2:]) for row in rows])
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.encoders import jsonable_encoder
@@ -8,13 +9,15 @@
 from tortoise.contrib.fastapi import HTTPNotFoundError
 
 import src.core.crud.users as crud
+from src.core.auth.user_cache import user_cache
 from src.core.auth.users import validate_user
 from src.core.schemas.token import Status
-from src.core.schemas.users import UserInSchema, UserOutSchema
+from src.core.schemas.users import CurrentUser, UserInSchema, UserOutSchema
 
 from src.core.auth.jwthandler import (
     create_access_token,
     get_current_user,
+    optional_security,
     ACCESS_TOKEN_EXPIRE_MINUTES,
 )
 
@@ -82,12 +85,12 @@ async def login(user: OAuth2PasswordRequestForm = Depends()):
 @router.get(
     "/users/whoami", response_model=UserOutSchema, dependencies=[Depends(get_current_user)]
 )
-async def read_users_me(current_user: UserOutSchema = Depends(get_current_user)):
+async def read_users_me(current_user: CurrentUser = Depends(get_current_user)):
     """
     获取当前登录用户的信息。
 
     参数:
-        current_user (UserOutSchema): 当前登录用户的信息。
+        current_user (CurrentUser): 当前登录用户的信息。
 
     返回:
         UserOutSchema: 当前登录用户的信息。
@@ -103,14 +106,14 @@ async def read_users_me(current_user: UserOutSchema = Depends(get_current_user))
     dependencies=[Depends(get_current_user)],
 )
 async def delete_user(
-    user_id: int, current_user: UserOutSchema = Depends(get_current_user)
+    user_id: int, current_user: CurrentUser = Depends(get_current_user)
 ) -> Status:
     """
     删除指定 ID 的用户。
 
     参数:
         user_id (int): 要删除的用户 ID。
-        current_user (UserOutSchema): 当前登录用户的信息。
+        current_user (CurrentUser): 当前登录用户的信息。
 
     返回:
         Status: 删除操作的状态信息。
@@ -119,7 +122,10 @@ async def delete_user(
 
 
 @router.post("/user/logout")
-async def logout(response: Response):
+async def logout(response: Response, token: Optional[str] = Depends(optional_security)):
+    # 丢弃该令牌缓存的用户
+    if token:
+        user_cache.invalidate_token(token)
     # 清空 Authorization cookie（让其立刻过期）
     response.delete_cookie("Authorization")
     return {"message": "Logged out successfully"}
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""
+生产环境的启动入口，在 backend 目录下执行（开发时仍可用 uvicorn src.main:app --reload）:
+    python -m src.serve
+
+多个工作进程共享一个监听端口，每个进程各自导入应用、在启动事件中建立自己的数据库连接池
+（主进程不导入应用、不连接数据库），之后所有请求复用该进程的连接池。
+
+收到 SIGTERM 后每个工作进程：/readyz 立即返回 503，不再接受新连接，空闲的长连接被关闭；
+进行中的流式响应继续输出到结束，会话事件的订阅被结束（客户端自动重连）；客户端已断开的生成也等它跑完。
+总共最多等待 WEB_DRAIN_TIMEOUT 秒，超时仍未结束的生成截断保存，然后写完待写入的数据再退出。
+容器的停止宽限期（docker-compose 的 stop_grace_period）需要大于 WEB_DRAIN_TIMEOUT。
+
+以下状态在每个工作进程内各自维护：Ollama 并发名额和排队上限、用户的 token 额度（均按进程生效，
+总量是配置值乘以进程数）、断线后接回生成（需要落到同一进程）和会话事件推送（只推送给同一进程的订阅）。
+/metrics 和 /stats 同样只报告恰好响应这次抓取的那个进程，不是所有进程的汇总。
+语义检索（OLLAMA_MEMORY_ENABLED）的向量只由持有索引目录锁的一个进程生成，其他进程只检索，
+在该进程退出、锁被释放后接手。
+"""
+import os
+import sys
+
+import uvicorn
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import Multiprocess
+
+from src.core.lifecycle import WEB_DRAIN_TIMEOUT, drain
+
+
+# 工作进程数
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "2"))
+WEB_HOST = os.environ.get("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("WEB_PORT", "5000"))
+# 空闲的 keep-alive 连接保持多久（秒）
+WEB_KEEP_ALIVE = int(os.environ.get("WEB_KEEP_ALIVE", "5"))
+
+
+class DrainingServer(uvicorn.Server):
+    """收到 SIGTERM / SIGINT 时先把进程标记为排空，再按 uvicorn 原来的流程优雅关闭"""
+
+    def handle_exit(self, sig, frame) -> None:
+        drain.begin()
+        super().handle_exit(sig, frame)
+
+
+def main() -> None:
+    config = uvicorn.Config(
+        "src.main:app",
+        host=WEB_HOST,
+        port=WEB_PORT,
+        workers=WEB_WORKERS,
+        timeout_keep_alive=WEB_KEEP_ALIVE,
+        # uvicorn 先等进行中的连接结束，超时后取消它们；剩余的生成在应用关闭事件中按剩余时间再等
+        timeout_graceful_shutdown=WEB_DRAIN_TIMEOUT,
+    )
+    server = DrainingServer(config)
+    try:
+        if config.workers > 1:
+            # 与 uvicorn.run 相同：主进程绑定端口，工作进程以 spawn 方式启动并接收连接，
+            # 主进程收到 SIGTERM 后转发给工作进程并等待它们全部退出
+            sock = config.bind_socket()
+            Multiprocess(config, target=server.run, sockets=[sock]).run()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass
+    if config.workers == 1 and not server.started:
+        sys.exit(STARTUP_FAILURE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+测试共用的环境：临时 SQLite 数据库，进程内的模拟 Ollama 和应用，在后台线程的事件循环中运行。
+
+应用的配置在导入时读取，所以环境变量在导入 src 之前设置好。测试通过 HTTP 访问应用，
+需要直接操作数据库或模块内对象时用 server.run() 把协程交给应用所在的事件循环执行。
+"""
+import asyncio
+import os
+import tempfile
+import threading
+
+import pytest
+
+from tools.bench_context_cache import _free_port, _serve
+
+# 模拟 Ollama 每次生成在首个 token 之前的固定延迟（秒）
+STREAM_DELAY = 0.5
+STREAM_TOKENS = 5
+
+_db_dir = tempfile.mkdtemp()
+_fake_port, _app_port = _free_port(), _free_port()
+os.environ.update(
+    DATABASE_URL=f"sqlite://{_db_dir}/test.sqlite3",
+    SECRET_KEY="test",
+    OLLAMA_BASE_URLS=f"http://127.0.0.1:{_fake_port}",
+    OLLAMA_TITLE_ENABLED="0",
+    OLLAMA_BATCH_ENABLED="0",
+    OLLAMA_MODEL_CONCURRENCY="32",
+    CONVERSATION_FLUSH_INTERVAL="0.05",
+)
+
+
+class Server:
+    def __init__(self):
+        self.url = f"http://127.0.0.1:{_app_port}"
+        self.stream_delay = STREAM_DELAY
+        self.stream_tokens = STREAM_TOKENS
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._stop: asyncio.Event = None
+        self._thread = threading.Thread(target=self.loop.run_until_complete, args=(self._main(),), daemon=True)
+
+    async def _main(self):
+        from tortoise import Tortoise
+
+        from src.core.database.config import TORTOISE_ORM
+        from src.main import app
+        from tools.fake_ollama import create_app
+
+        await Tortoise.init(config=TORTOISE_ORM)
+        await Tortoise.generate_schemas()
+        await Tortoise.close_connections()
+
+        self._stop = asyncio.Event()
+        fake, fake_task = await _serve(
+            create_app(tokens=STREAM_TOKENS, token_delay=0.001, first_token_delay=STREAM_DELAY), _fake_port
+        )
+        server, task = await _serve(app, _app_port)
+        self._started.set()
+        await self._stop.wait()
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+
+    def start(self):
+        self._thread.start()
+        if not self._started.wait(30):
+            raise RuntimeError("test server did not start")
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(30)
+
+    def run(self, awaitable, timeout: float = 30):
+        """在应用的事件循环中等待协程或查询集并返回结果"""
+        async def wait():
+            return await awaitable
+
+        return asyncio.run_coroutine_threadsafe(wait(), self.loop).result(timeout)
+
+
+@pytest.fixture(scope="session")
+def server():
+    server = Server()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    import httpx
+
+    with httpx.Client(base_url=server.url, timeout=30) as client:
+        yield client
+
+
+@pytest.fixture
+def user(client):
+    """注册一个新用户并登录（令牌在 client 的 cookie 中），返回用户 ID"""
+    username = f"u{next(_usernames)}"
+    client.post("/register", json={"username": username, "password": "secret"}).raise_for_status()
+    client.post("/login", data={"username": username, "password": "secret"}).raise_for_status()
+    return client.get("/users/whoami").json()["id"]
+
+
+_usernames = iter(range(10**6))
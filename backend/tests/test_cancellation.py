@@ -0,0 +1,29 @@
+import asyncio
+
+from src.core.ollama.cancellation import DisconnectCheck
+
+
+class _Request:
+    def __init__(self):
+        self.calls = 0
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        self.calls += 1
+        return self.disconnected
+
+
+def test_disconnect_is_checked_at_most_once_per_interval():
+    async def scenario():
+        request = _Request()
+        check = DisconnectCheck(request, interval=0.2)
+        # 一个间隔内的大量 token 不会逐个调用 receive
+        assert not any([await check.disconnected() for _ in range(1000)])
+        assert request.calls == 0
+
+        request.disconnected = True
+        await asyncio.sleep(0.25)
+        assert await check.disconnected()
+        assert request.calls == 1
+
+    asyncio.run(scenario())
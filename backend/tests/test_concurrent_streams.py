@@ -0,0 +1,26 @@
+import asyncio
+import re
+import time
+
+STREAMS = 16
+
+
+def test_concurrent_streams_overlap(server):
+    import httpx
+
+    async def stream(client, index):
+        # 提示词各不相同，不会命中缓存或合并成一次生成
+        async with client.stream("POST", "/chat/stream", json={"message": f"overlap prompt {index}"}) as response:
+            assert response.status_code == 200
+            return len(re.findall(r"token\d+", "".join([text async for text in response.aiter_text()])))
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url=server.url, timeout=30) as client:
+            started = time.perf_counter()
+            tokens = await asyncio.gather(*(stream(client, i) for i in range(STREAMS)))
+            return time.perf_counter() - started, tokens
+
+    wall, tokens = asyncio.run(scenario())
+    assert tokens == [server.stream_tokens] * STREAMS
+    # 模拟 Ollama 每个流首个 token 前固定等待 stream_delay 秒，串行时至少需要 STREAMS 倍
+    assert wall < STREAMS * server.stream_delay * 0.25, wall
@@ -0,0 +1,24 @@
+from src.core.database.models import ChatSession, SessionContext
+from src.core.ollama.context_cache import ContextCache
+
+
+def test_spilled_context_is_not_reused_after_newer_turns(server, user):
+    async def scenario():
+        session = await ChatSession.create(user_id=user, title="spill")
+        writer = ContextCache(max_bytes=0, max_tokens=100, spill=True)
+        # 容量为 0，放入后立即淘汰写入数据库
+        writer.put(session.id, "model", [1, 2, 3], turns=2)
+        while writer._tasks:
+            await next(iter(writer._tasks))
+        assert (await SessionContext.get(session_id=session.id)).turns == 2
+
+        # 重启后或另一个工作进程从数据库读回
+        reader = ContextCache(max_bytes=1024, max_tokens=100, spill=True)
+        stale = await reader.get(session.id, "model", message_count=3)
+        reader._entries.clear()
+        fresh = await reader.get(session.id, "model", message_count=2)
+        return stale, fresh
+
+    stale, fresh = server.run(scenario())
+    assert stale is None
+    assert list(fresh) == [1, 2, 3]
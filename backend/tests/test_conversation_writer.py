@@ -0,0 +1,49 @@
+import asyncio
+
+from src.core.database.models import ChatSession, Conversation
+from src.core.database.writer import ConversationWriter
+
+
+def test_close_writes_finished_and_in_progress_turns(server, user):
+    async def scenario():
+        session = await ChatSession.create(user_id=user, title="writer")
+        # 定时写入和检查点都不会在测试期间触发，只有 close() 会写入
+        writer = ConversationWriter(batch_size=100, flush_interval=60, checkpoint_interval=0)
+        writer.start()
+        for i in range(5):
+            turn = writer.begin(user_id=user, session_id=session.id, user_message=f"question {i}")
+            writer.finish(turn, f"answer {i}")
+        active = writer.begin(user_id=user, session_id=session.id, user_message="still generating")
+        active.append("partial")
+        assert not await Conversation.filter(session_id=session.id).exists()
+
+        await writer.close()
+        rows = await Conversation.filter(session_id=session.id).order_by("id").values_list(
+            "user_message", "ai_message", "truncated"
+        )
+        return rows, (await ChatSession.get(id=session.id)).message_count
+
+    rows, message_count = server.run(scenario())
+    assert rows == [(f"question {i}", f"answer {i}", False) for i in range(5)] + [
+        ("still generating", "partial", True)
+    ]
+    assert message_count == 6
+
+
+def test_flush_interval_writes_without_close(server, user):
+    async def scenario():
+        session = await ChatSession.create(user_id=user, title="writer")
+        writer = ConversationWriter(batch_size=100, flush_interval=0.05, checkpoint_interval=0)
+        writer.start()
+        try:
+            turn = writer.begin(user_id=user, session_id=session.id, user_message="question")
+            writer.finish(turn, "answer")
+            for _ in range(100):
+                if await Conversation.filter(session_id=session.id).exists():
+                    return True
+                await asyncio.sleep(0.02)
+            return False
+        finally:
+            await writer.close()
+
+    assert server.run(scenario())
@@ -0,0 +1,44 @@
+import tempfile
+
+from tortoise.functions import Max
+
+from src.core.database.models import ChatSession, Conversation
+from src.core.ollama.memory import SemanticMemory
+
+
+def test_row_committed_below_the_watermark_is_still_indexed(server, user):
+    directory = tempfile.mkdtemp()
+
+    def new_memory():
+        memory = SemanticMemory(directory, "embed", 32, 0.05, 4, 512, 0.0)
+        memory.load_state()
+        return memory
+
+    async def scenario():
+        session = await ChatSession.create(user_id=user, title="memory")
+        start = (await Conversation.annotate(top=Max("id")).first().values("top"))["top"] or 0
+        memory = new_memory()
+        memory.watermark = start
+
+        def turn(offset, text):
+            return Conversation.create(
+                id=start + offset, user_id=user, session_id=session.id, user_message=text, ai_message=text
+            )
+
+        # ID 大的行先提交，水位越过了还没提交的 start + 2
+        await turn(1, "first")
+        await turn(3, "third")
+        await memory.index_pending()
+        assert memory.watermark == start + 3
+        assert list(memory._gaps) == [start + 2]
+
+        # 晚提交的行在下一批中补上，重启后不会丢掉空缺
+        await turn(2, "second")
+        restarted = new_memory()
+        await restarted.index_pending()
+        index = restarted._index(user)
+        return sorted(int(i) for i in index._map()[1][:, 0]), restarted._gaps, start
+
+    indexed, gaps, start = server.run(scenario())
+    assert indexed == [start + 1, start + 2, start + 3]
+    assert gaps == {}
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from src.core.ollama.scheduler import OllamaScheduler
+
+
+def test_waiter_cancelled_during_release_does_not_leak_the_slot():
+    async def scenario():
+        scheduler = OllamaScheduler(default_concurrency=1)
+        held = await scheduler.acquire("model", "alice")
+        waiter = asyncio.create_task(scheduler.acquire("model", "bob"))
+        await asyncio.sleep(0)
+
+        # 客户端断开与上一个请求结束落在同一轮事件循环中
+        waiter.cancel()
+        held.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        queue = scheduler._queue_for("model")
+        assert (queue.active, queue.queued) == (0, 0)
+        slot = await asyncio.wait_for(scheduler.acquire("model", "carol"), 1)
+        slot.release()
+
+    asyncio.run(scenario())
+
+
+def test_waiters_are_admitted_round_robin_across_users():
+    async def scenario():
+        scheduler = OllamaScheduler(default_concurrency=1)
+        held = await scheduler.acquire("model", "alice")
+        order = []
+
+        async def request(user):
+            slot = await scheduler.acquire("model", user)
+            order.append(user)
+            await asyncio.sleep(0)
+            slot.release()
+
+        tasks = [asyncio.create_task(request(user)) for user in ("alice", "alice", "bob")]
+        await asyncio.sleep(0)
+        held.release()
+        await asyncio.gather(*tasks)
+        assert order == ["alice", "bob", "alice"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+import gzip
+import json
+import time
+
+from src.core.database.models import Conversation
+from src.core.database.reaper import reaper
+
+
+def _wait_for_rows(server, session_id: int, count: int) -> None:
+    deadline = time.monotonic() + 5
+    while server.run(Conversation.filter(session_id=session_id).count()) < count:
+        assert time.monotonic() < deadline, "conversation was not written"
+        time.sleep(0.05)
+
+
+def test_deleted_session_is_hidden_before_it_is_reaped(server, client, user):
+    kept = client.post("/sessions", json={"user_id": user, "title": "kept"}).json()["id"]
+    deleted = client.post("/sessions", json={"user_id": user, "title": "doomed"}).json()["id"]
+    for session_id in (kept, deleted):
+        client.post(f"/sessions/{session_id}/messages/stream", json={"message": f"hello {session_id}"})
+        _wait_for_rows(server, session_id, 1)
+
+    # 暂停后台清理，检查的是删除标记本身，而不是清理之后的结果
+    server.run(reaper.close())
+    try:
+        assert client.delete(f"/sessions/{deleted}").status_code == 204
+        assert server.run(Conversation.filter(session_id=deleted).count()) == 1
+
+        assert client.get(f"/sessions/{deleted}").status_code == 404
+        assert client.get(f"/sessions/{deleted}/messages").status_code == 404
+        for path in ("/sessions", "/sessions/sidebar"):
+            ids = [entry["id"] for entry in client.get(path, params={"user_id": user}).json()]
+            assert ids == [kept], path
+
+        # 用户信息只有自身的字段，不带出会话和消息
+        assert set(client.get("/users/whoami").json()) == {"id", "username"}
+
+        records = [
+            json.loads(line)
+            for line in gzip.decompress(client.get("/history/export").content).splitlines()
+        ]
+        assert [r["id"] for r in records if r["type"] == "session"] == [kept]
+        assert {r["session_id"] for r in records if r["type"] == "message"} == {kept}
+    finally:
+        server.loop.call_soon_threadsafe(reaper.start)
@@ -0,0 +1,10 @@
+def test_usage_accepts_times_without_timezone(client, user):
+    response = client.get("/usage", params={"since": "2026-10-01T00:00:00", "until": "2099-10-18T00:00:00"})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["since"].startswith("2026-10-01T00:00:00")
+    assert report["until"].startswith("2099-10-18T00:00:00")
+
+    # 带时区的时间按 UTC 比较：东八区 08:00 就是 UTC 00:00
+    response = client.get("/usage", params={"since": "2026-10-01T08:00:00+08:00", "until": "2026-10-01T00:00:00"})
+    assert response.status_code == 400
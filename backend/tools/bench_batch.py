@@ -0,0 +1,223 @@
+"""
+批量任务和模型常驻管理的端到端检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_batch --prompts 30
+
+1. 批量任务：提交 --prompts 个提示词（另有一个 JSONL 上传的小任务），follow=true 按顺序流式读取全部结果，
+   内容与模拟服务的输出一致；统计结果压缩后占用的字节数。
+2. 让出名额：并发上限为 2（后台最多占 1 个）时，在批量任务运行期间发出一批用户请求，
+   对比它们与空闲时的排队耗时；排队的用户请求会让正在生成的批量提示词让出名额。
+3. 续跑：任务处理到一半时停止 worker（模拟重启），正在处理的提示词放回待处理，
+   已完成的结果保留；租约过期的 running 提示词（模拟进程崩溃）也会被重新领取；重新启动后任务完成。
+4. 常驻：模拟服务冷加载模型需要 --load-delay 秒、空闲 --idle-unload 秒后卸载。
+   配置为常驻的模型在空闲之后仍是热的，没有配置的再次请求时重新冷加载；
+   chat_time_to_first_token_by_load_seconds 中分别记录了 cold 和 warm。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+WARM_MODEL = "warm-model:latest"
+COLD_MODEL = "cold-model:latest"
+
+
+async def _chat(client, session_id: int, message: str, model: str = "deepseek-r1:latest") -> dict:
+    """发送一轮消息，返回排队耗时和首 token 延迟（毫秒）"""
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream(
+        "POST", f"/sessions/{session_id}/messages/stream", json={"message": message, "model": model}
+    ) as response:
+        queue_ms = int(response.headers.get("X-Queue-Wait-Ms", 0))
+        async for chunk in response.aiter_text():
+            if ttft is None and chunk:
+                ttft = (time.perf_counter() - started) * 1000
+    return {"queue_ms": queue_ms, "ttft_ms": ttft}
+
+
+async def _wait_for(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def _batch(client, user_id: int, prompts: int, tokens: int) -> dict:
+    from src.core.database.models import BatchItem, BatchJob
+    from src.core.ollama.batch import batch_items_preempted
+
+    expected = "".join(f"token{i} " for i in range(tokens))
+    started = time.perf_counter()
+    job = (await client.post("/batch/jobs", json={
+        "user_id": user_id, "model": "deepseek-r1:latest", "prompts": [f"summarize document {i}" for i in range(prompts)],
+    })).json()
+
+    # 任务运行期间的用户请求
+    session_id = (await client.post("/sessions", json={"user_id": user_id, "title": "bench"})).json()["id"]
+    await asyncio.sleep(0.1)
+    preempted = batch_items_preempted.value
+    busy = await asyncio.gather(*(_chat(client, session_id, f"busy question {i}") for i in range(4)))
+
+    lines = []
+    async with client.stream("GET", f"/batch/jobs/{job['id']}/results", params={"follow": "true"}) as response:
+        async for line in response.aiter_lines():
+            if line:
+                lines.append(json.loads(line))
+    elapsed = time.perf_counter() - started
+    status = (await client.get(f"/batch/jobs/{job['id']}")).json()
+
+    idle = await asyncio.gather(*(_chat(client, session_id, f"idle question {i}") for i in range(4)))
+
+    upload = (await client.post(
+        "/batch/jobs/upload", data={"user_id": str(user_id), "model": "deepseek-r1:latest"},
+        files={"file": ("prompts.jsonl", b'"first"\n{"prompt": "second"}\n\n', "application/x-ndjson")},
+    )).json()
+    await _wait_for(lambda: BatchJob.filter(id=upload["id"], status="completed").exists(), 10)
+    page = await client.get(f"/batch/jobs/{upload['id']}/results", params={"limit": 1})
+
+    stored = await BatchItem.filter(job_id=job["id"]).values_list("result", flat=True)
+    raw_bytes = len(expected.encode()) * prompts
+    return {
+        "prompts": prompts,
+        "seconds": round(elapsed, 2),
+        "prompts_per_second": round(prompts / elapsed, 1),
+        "results_in_order": [line["index"] for line in lines] == list(range(prompts)),
+        "results_correct": all(line["status"] == "done" and line["response"] == expected for line in lines),
+        "job_completed": status["status"] == "completed" and status["completed"] == prompts,
+        "stored_bytes": sum(len(r) for r in stored if r),
+        "raw_bytes": raw_bytes,
+        "user_queue_ms_p50_during_batch": statistics.median(r["queue_ms"] for r in busy),
+        "user_queue_ms_p50_idle": statistics.median(r["queue_ms"] for r in idle),
+        "batch_items_preempted": int(batch_items_preempted.value - preempted),
+        "jsonl_upload": upload["total"] == 2 and page.headers.get("X-Next-After") == "0",
+    }
+
+
+async def _resume(client, user_id: int, prompts: int) -> dict:
+    from tortoise import timezone
+
+    from src.core.database.models import BatchItem, BatchJob
+    from src.core.ollama.batch import batch_runner
+
+    job = (await client.post("/batch/jobs", json={
+        "user_id": user_id, "model": "deepseek-r1:latest", "prompts": [f"resume {i}" for i in range(prompts)],
+    })).json()
+
+    async def half_done() -> bool:
+        return await BatchItem.filter(job_id=job["id"], status="done").count() >= prompts // 2
+
+    await _wait_for(half_done, 30)
+    await batch_runner.stop()
+    done_before = await BatchItem.filter(job_id=job["id"], status="done").count()
+    running_after_stop = await BatchItem.filter(job_id=job["id"], status="running").count()
+
+    # 模拟崩溃的进程留下的 running 提示词
+    orphan = await BatchItem.filter(job_id=job["id"], status="pending").order_by("-index").first()
+    await BatchItem.filter(id=orphan.id).update(
+        status="running", claimed_at=timezone.now() - timedelta(seconds=batch_runner.lease * 2)
+    )
+
+    batch_runner.start()
+
+    async def finished() -> bool:
+        return await BatchJob.filter(id=job["id"], status="completed").exists()
+
+    completed = await _wait_for(finished, 60)
+    final = await BatchJob.get(id=job["id"])
+    return {
+        "done_before_restart": done_before,
+        "released_on_stop": running_after_stop == 0,
+        "kept_completed_results": done_before >= prompts // 2,
+        "completed_after_restart": completed and final.completed == prompts,
+        "orphan_reclaimed": await BatchItem.filter(id=orphan.id, status="done").exists(),
+    }
+
+
+async def _residency(client, user_id: int, idle_unload: float) -> dict:
+    from src.core.instrumentation import chat_ttft_by_load_seconds
+
+    session_id = (await client.post("/sessions", json={"user_id": user_id, "title": "bench"})).json()["id"]
+    await _chat(client, session_id, "load cold model", COLD_MODEL)
+    await asyncio.sleep(idle_unload * 1.5)
+    # 常驻模型由启动时的预热加载，之后一直保活
+    warm = await _chat(client, session_id, "after idle", WARM_MODEL)
+    cold = await _chat(client, session_id, "after idle", COLD_MODEL)
+    return {
+        "warm_model_ttft_ms_after_idle": round(warm["ttft_ms"], 1),
+        "unmanaged_model_ttft_ms_after_idle": round(cold["ttft_ms"], 1),
+        "keep_alive_avoids_cold_load": warm["ttft_ms"] * 3 < cold["ttft_ms"],
+        "ttft_metric_has_cold_and_warm": chat_ttft_by_load_seconds.labels("session", "cold").value > 0
+        and chat_ttft_by_load_seconds.labels("session", "warm").value > 0,
+    }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_MODEL_CONCURRENCY="2",
+        OLLAMA_TITLE_ENABLED="0",
+        OLLAMA_BATCH_POLL_INTERVAL="0.2",
+        OLLAMA_BATCH_LEASE="3",
+        OLLAMA_WARM_MODELS=WARM_MODEL,
+        OLLAMA_RESIDENCY_INTERVAL=str(args.idle_unload / 3),
+        OLLAMA_HEALTH_INTERVAL="0.2",
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import Users
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    import httpx
+
+    fake, fake_task = await _serve(create_app(
+        models=["deepseek-r1:latest"], tokens=args.tokens, token_delay=args.token_delay,
+        load_delay=args.load_delay, idle_unload=args.idle_unload,
+    ), fake_port)
+    server, task = await _serve(app, app_port)
+    try:
+        user = await Users.create(username=f"batch{time.monotonic_ns() % 10**8}", password="bench")
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=60) as client:
+            result = {
+                "batch": await _batch(client, user.id, args.prompts, args.tokens),
+                "resume": await _resume(client, user.id, args.prompts),
+                "residency": await _residency(client, user.id, args.idle_unload),
+            }
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify batch jobs and model residency against the fake Ollama")
+    parser.add_argument("--prompts", type=int, default=30)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--load-delay", type=float, default=1.0)
+    parser.add_argument("--idle-unload", type=float, default=1.5)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    passed = all(value for checks in result.values() for value in checks.values() if isinstance(value, bool))
+    sys.exit(0 if passed else 1)
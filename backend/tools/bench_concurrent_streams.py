@@ -0,0 +1,89 @@
+"""
+并发流式请求是否真正并行的检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_concurrent_streams --streams 20 --delay 1.0
+
+同时发出 --streams 个提示词各不相同（不会命中缓存或合并）的 /chat/stream 请求，模拟 Ollama 在
+第一个 token 之前固定等待 --delay 秒。请求之间互不阻塞时总耗时接近一次的耗时；串行时是它的 N 倍。
+总耗时不到 N 倍的 --max-ratio、且每个流都收到完整回答时通过，否则以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+async def _stream(client, index: int) -> tuple:
+    """返回 (收到的 token 数, 这个流的耗时)"""
+    started = time.perf_counter()
+    received = ""
+    async with client.stream("POST", "/chat/stream", json={"message": f"concurrent prompt {index}"}) as response:
+        async for text in response.aiter_text():
+            received += text
+    return len(re.findall(r"token\d+", received)), time.perf_counter() - started
+
+
+async def main(args) -> dict:
+    import httpx
+
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_TITLE_ENABLED="0",
+        OLLAMA_BATCH_ENABLED="0",
+        # 只检验连接池和流式转发本身，不让准入名额限制并发
+        OLLAMA_MODEL_CONCURRENCY=str(args.streams),
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    fake, fake_task = await _serve(
+        create_app(tokens=args.tokens, token_delay=0.001, first_token_delay=args.delay), fake_port
+    )
+    server, task = await _serve(app, app_port)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=120) as client:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(_stream(client, i) for i in range(args.streams)))
+            wall = time.perf_counter() - started
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+
+    serial = args.streams * args.delay
+    return {
+        "streams": args.streams,
+        "per_stream_delay_seconds": args.delay,
+        "wall_seconds": round(wall, 2),
+        "serial_seconds": round(serial, 2),
+        "slowest_stream_seconds": round(max(seconds for _, seconds in results), 2),
+        "all_streams_complete": all(tokens == args.tokens for tokens, _ in results),
+        "streams_overlap": wall < serial * args.max_ratio,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify that concurrent /chat/stream requests overlap")
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=1.0, help="模拟 Ollama 每个流在首个 token 前的等待（秒）")
+    parser.add_argument("--tokens", type=int, default=5)
+    parser.add_argument("--max-ratio", type=float, default=0.25, help="总耗时占串行耗时的上限")
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(value for value in result.values() if isinstance(value, bool)) else 1)
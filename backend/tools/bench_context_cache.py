@@ -0,0 +1,108 @@
+"""
+对比开启 / 关闭 context 复用时，多轮会话发送给 Ollama 的提示词字节数和首 token 延迟。
+
+在进程内启动模拟 Ollama（带预填充耗时）和后端应用，使用临时 SQLite 数据库:
+    python -m tools.bench_context_cache --turns 20 --prefill-delay 0.002
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import tempfile
+import time
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _serve(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def _run_session(client, user_id: int, turns: int, words: int) -> list:
+    session = (await client.post("/sessions", json={"user_id": user_id, "title": "bench"})).json()
+    ttfts = []
+    for turn in range(turns):
+        message = " ".join(f"q{turn}w{i}" for i in range(words))
+        started = time.perf_counter()
+        async with client.stream(
+            "POST", f"/sessions/{session['id']}/messages/stream", json={"message": message}
+        ) as response:
+            first = None
+            async for _ in response.aiter_bytes():
+                if first is None:
+                    first = time.perf_counter() - started
+        ttfts.append(first)
+    return ttfts
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        # 让无缓存路径也带上完整历史，便于对比
+        OLLAMA_HISTORY_TOKEN_BUDGET="1000000",
+        OLLAMA_HISTORY_MAX_TURNS=str(args.turns + 1),
+    )
+
+    import httpx
+    from tortoise import Tortoise
+
+    from src.core.ollama import config as ollama_config
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    fake = create_app(tokens=args.tokens, token_delay=0.0, prefill_delay=args.prefill_delay)
+    sent = {"bytes": 0}
+
+    @fake.middleware("http")
+    async def count_bytes(request, call_next):
+        if request.url.path in ("/api/generate", "/api/chat"):
+            sent["bytes"] += len(await request.body())
+        return await call_next(request)
+
+    fake_server, fake_task = await _serve(fake, fake_port)
+    app_server, app_task = await _serve(app, app_port)
+    await Tortoise.generate_schemas()
+
+    results = {}
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=120) as client:
+        user = (await client.post("/register", json={"username": "bench", "password": "bench"})).json()
+        for name, reuse in (("without_cache", False), ("with_cache", True)):
+            ollama_config.OLLAMA_CONTEXT_REUSE = reuse
+            sent["bytes"] = 0
+            ttfts = await _run_session(client, user["id"], args.turns, args.words)
+            results[name] = {
+                "prompt_bytes": sent["bytes"],
+                "ttft_ms_mean": round(statistics.mean(ttfts) * 1000, 2),
+                "ttft_ms_last_turn": round(ttfts[-1] * 1000, 2),
+            }
+
+    for server, task in ((app_server, app_task), (fake_server, fake_task)):
+        server.should_exit = True
+        await task
+
+    return {"turns": args.turns, "prefill_delay": args.prefill_delay, **results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Ollama context reuse")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--words", type=int, default=30, help="每轮用户消息的单词数")
+    parser.add_argument("--tokens", type=int, default=40, help="每轮回答的 token 数")
+    parser.add_argument("--prefill-delay", type=float, default=0.002, help="每个提示词 token 的预填充耗时（秒）")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
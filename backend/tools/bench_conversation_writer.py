@@ -0,0 +1,153 @@
+"""
+对话记录批量写入的吞吐对比和关闭时不丢数据的检查，使用临时 SQLite 数据库:
+    python -m tools.bench_conversation_writer --turns 5000
+
+1. 吞吐：每轮一次 Conversation.create（原来的 BackgroundTasks 写法）对比 ConversationWriter 批量写入。
+2. 检查点：生成中的轮次在 checkpoint_interval 之后已经有部分内容入库。
+3. 关闭：通过 register_tortoise 注册的 shutdown 处理函数关闭应用，已结束和生成中的轮次都必须入库，
+   生成中的轮次标记为截断。任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+async def _seed():
+    from src.core.database.models import ChatSession, Users
+
+    user = await Users.create(username=f"bench{time.monotonic_ns()}", password="bench")
+    session = await ChatSession.create(user_id=user.id, title="bench")
+    return user.id, session.id
+
+
+def _fields(user_id: int, session_id: int, i: int) -> dict:
+    return {"user_id": user_id, "session_id": session_id, "user_message": f"question {i}"}
+
+
+async def _per_row(turns: int, user_id: int, session_id: int) -> float:
+    from src.core.database.models import Conversation
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        Conversation.create(**_fields(user_id, session_id, i), ai_message=f"answer {i} " * 40)
+        for i in range(turns)
+    ))
+    return time.perf_counter() - started
+
+
+async def _batched(turns: int, user_id: int, session_id: int, batch_size: int) -> float:
+    from src.core.database.writer import ConversationWriter
+
+    writer = ConversationWriter(batch_size=batch_size, flush_interval=0.5, checkpoint_interval=0)
+    writer.start()
+    started = time.perf_counter()
+    for i in range(turns):
+        turn = writer.begin(**_fields(user_id, session_id, i))
+        writer.finish(turn, f"answer {i} " * 40)
+    await writer.close()
+    return time.perf_counter() - started
+
+
+async def _checkpoint(user_id: int, session_id: int) -> dict:
+    from src.core.database.models import Conversation
+    from src.core.database.writer import ConversationWriter
+
+    writer = ConversationWriter(batch_size=100, flush_interval=0.05, checkpoint_interval=0.2)
+    writer.start()
+    turn = writer.begin(**_fields(user_id, session_id, -1))
+    turn.append("partial ")
+    await asyncio.sleep(0.5)
+    checkpointed = await Conversation.get_or_none(id=turn.row_id) if turn.row_id else None
+    turn.append("answer")
+    writer.finish(turn, turn.ai_message)
+    await writer.close()
+    final = await Conversation.get(id=turn.row_id)
+    return {
+        "checkpoint_written": checkpointed is not None and checkpointed.ai_message == "partial ",
+        "final_updated_in_place": final.ai_message == "partial answer" and not final.truncated,
+    }
+
+
+async def _shutdown_drain(db_url: str, finished: int, active: int) -> dict:
+    from fastapi import FastAPI
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import Conversation
+    from src.core.database.register import register_tortoise
+    from src.core.database.writer import conversation_writer
+
+    # 间隔足够长，保证关闭前一条都没有写入
+    conversation_writer.flush_interval = 3600
+    conversation_writer.checkpoint_interval = 0
+    conversation_writer.batch_size = finished + active + 1
+
+    app = FastAPI()
+    register_tortoise(app, config=TORTOISE_ORM)
+    await app.router.startup()
+    user_id, session_id = await _seed()
+    for i in range(finished):
+        turn = conversation_writer.begin(**_fields(user_id, session_id, i))
+        conversation_writer.finish(turn, f"answer {i}")
+    for i in range(active):
+        turn = conversation_writer.begin(**_fields(user_id, session_id, finished + i))
+        turn.append(f"partial {i}")
+    before = await Conversation.filter(session_id=session_id).count()
+    await app.router.shutdown()
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    rows = await Conversation.filter(session_id=session_id).count()
+    truncated = await Conversation.filter(session_id=session_id, truncated=True).count()
+    await Tortoise.close_connections()
+    return {
+        "rows_before_shutdown": before,
+        "rows_after_shutdown": rows,
+        "truncated_rows": truncated,
+        "expected_rows": finished + active,
+        "no_turns_lost": rows == finished + active and truncated == active,
+    }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    db_url = f"sqlite://{db_dir}/bench.sqlite3"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["DATABASE_URL"] = db_url
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    user_id, session_id = await _seed()
+    per_row = await _per_row(args.turns, user_id, session_id)
+    batched = await _batched(args.turns, user_id, session_id, args.batch_size)
+    checkpoint = await _checkpoint(user_id, session_id)
+    await Tortoise.close_connections()
+
+    drain = await _shutdown_drain(db_url, args.finished, args.active)
+    return {
+        "turns": args.turns,
+        "per_row_inserts": {"seconds": round(per_row, 3), "rows_per_second": round(args.turns / per_row)},
+        "batched_writer": {"seconds": round(batched, 3), "rows_per_second": round(args.turns / batched)},
+        "speedup": round(per_row / batched, 2),
+        "checkpoint": checkpoint,
+        "shutdown_drain": drain,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and verify the conversation writer")
+    parser.add_argument("--turns", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--finished", type=int, default=250, help="关闭前已结束、尚未写入的轮次")
+    parser.add_argument("--active", type=int, default=50, help="关闭时仍在生成的轮次")
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    passed = result["shutdown_drain"]["no_turns_lost"] and all(result["checkpoint"].values())
+    sys.exit(0 if passed else 1)
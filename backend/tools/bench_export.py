@@ -0,0 +1,248 @@
+"""
+历史记录流式导出和导入的基准与检查，使用临时 SQLite 数据库:
+    python -m tools.bench_export --messages 1000000
+
+1. 导出：为一个用户生成 --messages 条消息（每个会话 --per-session 条，另有少量不属于会话的消息），
+   流式导出为 .ndjson.gz，报告行数/秒、输出 MB/秒和压缩率。另用 tracemalloc 单独测峰值内存：导出全部
+   和十分之一条消息时应相近（内存不随历史记录增长），且远低于一次性查出十分之一条消息的做法。
+2. 导入：把导出文件导入给新用户，报告行数/秒；导入后再导出，内容（去掉 ID 后）与原导出一致。
+3. 接口：/history/export 和 /history/import 对当前用户可用，访问其他用户的数据返回 403。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+_WORDS = (
+    "模型 上下文 生成 the model returns a streamed answer with tokens and context window "
+    "数据库 索引 查询 batch export import session history summary latency throughput"
+).split()
+
+
+class _PeakMemory:
+    """用 tracemalloc 统计一段代码中 Python 对象的峰值内存（MB），不受分配器复用已有内存的影响"""
+
+    def __enter__(self):
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+
+
+async def _seed(user_id: int, messages: int, per_session: int) -> None:
+    from tortoise.transactions import in_transaction
+
+    from src.core.database.models import ChatSession, Conversation
+
+    rng = random.Random(user_id)
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    orphans = max(1, messages // 100)
+    sessions = max(1, (messages - orphans) // per_session)
+    batch = []
+    for s in range(sessions):
+        session = await ChatSession.create(user_id=user_id, title=f"会话 {s}", summary=None if s % 3 else "较早的摘要")
+        count = per_session if s < sessions - 1 else messages - orphans - per_session * (sessions - 1)
+        for i in range(count):
+            batch.append(Conversation(
+                user_id=user_id, session_id=session.id,
+                user_message=f"question {i} about {rng.choice(_WORDS)}",
+                ai_message=" ".join(rng.choice(_WORDS) for _ in range(60)),
+                timestamp=started + timedelta(seconds=s * per_session + i),
+                truncated=i % 50 == 49,
+            ))
+        if len(batch) >= 10000 or s == sessions - 1:
+            async with in_transaction():
+                await Conversation.bulk_create(batch, batch_size=2000)
+            batch = []
+    await Conversation.bulk_create([
+        Conversation(user_id=user_id, user_message=f"single {i}", ai_message="answer", timestamp=started)
+        for i in range(orphans)
+    ], batch_size=2000)
+
+
+async def _export(user_id: int, path: str) -> dict:
+    from src.core.crud.export import export_history
+
+    started = time.perf_counter()
+    size = 0
+    with open(path, "wb") as f:
+        async for data in export_history(user_id):
+            f.write(data)
+            size += len(data)
+    return {"seconds": time.perf_counter() - started, "bytes": size}
+
+
+async def _export_peak_mb(user_id: int) -> float:
+    from src.core.crud.export import export_history
+
+    with _PeakMemory() as peak:
+        async for _ in export_history(user_id):
+            pass
+    return peak.mb
+
+
+def _content_digest(path: str) -> tuple:
+    """去掉 ID 和导出时间后的内容摘要、各类记录的行数和解压后的字节数"""
+    digest, counts, sessions, size = hashlib.sha256(), {}, {}, 0
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            size += len(line)
+            record = json.loads(line)
+            counts[record["type"]] = counts.get(record["type"], 0) + 1
+            if record["type"] == "session":
+                sessions[record["id"]] = len(sessions)
+                record["id"] = sessions[record["id"]]
+            elif record["type"] == "message":
+                record.pop("id")
+                record["session_id"] = sessions.get(record["session_id"])
+            else:
+                continue
+            digest.update(json.dumps(record, sort_keys=True).encode())
+    return digest.hexdigest(), counts, size
+
+
+async def _import(user_id: int, path: str) -> dict:
+    from src.core.crud.export import import_history
+
+    async def chunks():
+        with open(path, "rb") as f:
+            while data := f.read(1024 * 1024):
+                yield data
+
+    started = time.perf_counter()
+    counts = await import_history(user_id, chunks())
+    return {"seconds": time.perf_counter() - started, **counts}
+
+
+async def _naive_peak_mb(user_id: int) -> float:
+    """一次性查出用户所有消息（逐个会话调用 get_session_messages 再拼起来的等价做法）时的峰值内存"""
+    from src.core.database.models import Conversation
+
+    with _PeakMemory() as peak:
+        rows = await Conversation.filter(user_id=user_id).values()
+        del rows
+    return peak.mb
+
+
+async def _endpoints(app_port: int, user_id: int, path: str) -> dict:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=600) as client:
+        await client.post("/register", json={"username": "export_user", "password": "bench-password"})
+        await client.post("/login", data={"username": "export_user", "password": "bench-password"})
+        own_id = (await client.get("/users/whoami")).json()["id"]
+        with open(path, "rb") as f:
+            imported = await client.post("/history/import", files={"file": ("history.ndjson.gz", f, "application/gzip")})
+        exported = await client.get("/history/export")
+        forbidden = await client.get("/history/export", params={"user_id": user_id})
+        bad = await client.post("/history/import", files={"file": ("bad.ndjson", b'{"type": "message"}\n')})
+    with tempfile.NamedTemporaryFile(suffix=".ndjson.gz", delete=False) as f:
+        f.write(exported.content)
+    return {
+        "imported": imported.json(),
+        "exported_own_history": exported.status_code == 200
+        and _content_digest(f.name)[0] == _content_digest(path)[0],
+        "other_user_forbidden": forbidden.status_code == 403,
+        "bad_file_400": bad.status_code == 400,
+        "user_id": own_id,
+    }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    app_port = _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BATCH_ENABLED="0",
+        OLLAMA_TITLE_ENABLED="0",
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import Users
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    large, small, target = [await Users.create(username=f"export{i}", password="x") for i in range(3)]
+
+    started = time.perf_counter()
+    await _seed(large.id, args.messages, args.per_session)
+    await _seed(small.id, max(args.messages // 10, args.per_session), args.per_session)
+    seed_seconds = time.perf_counter() - started
+
+    large_path = os.path.join(db_dir, "large.ndjson.gz")
+    small_path = os.path.join(db_dir, "small.ndjson.gz")
+    await _export(small.id, small_path)
+    large_export = await _export(large.id, large_path)
+    # 内存单独测一遍：tracemalloc 会拖慢计时的那一遍
+    peak_full = await _export_peak_mb(large.id)
+    peak_tenth = await _export_peak_mb(small.id)
+    peak_naive = await _naive_peak_mb(small.id)
+    imported = await _import(target.id, large_path)
+    reexport_path = os.path.join(db_dir, "reexport.ndjson.gz")
+    await _export(target.id, reexport_path)
+
+    original_digest, counts, uncompressed = _content_digest(large_path)
+    await Tortoise.close_connections()
+
+    from src.main import app
+
+    server, task = await _serve(app, app_port)
+    try:
+        endpoints = await _endpoints(app_port, small.id, small_path)
+    finally:
+        server.should_exit = True
+        await task
+
+    rows = counts.get("message", 0) + counts.get("session", 0)
+    return {
+        "export": {
+            "messages": counts.get("message", 0),
+            "sessions": counts.get("session", 0),
+            "seed_seconds": round(seed_seconds, 1),
+            "seconds": round(large_export["seconds"], 2),
+            "rows_per_second": round(rows / large_export["seconds"]),
+            "output_mb": round(large_export["bytes"] / 2**20, 1),
+            "output_mb_per_second": round(large_export["bytes"] / 2**20 / large_export["seconds"], 1),
+            "compression_ratio": round(uncompressed / large_export["bytes"], 1),
+            "peak_mb": peak_full,
+            "peak_mb_at_tenth_size": peak_tenth,
+            "peak_mb_naive_at_tenth_size": peak_naive,
+            "all_rows_exported": counts.get("message") == args.messages and counts.get("export") == 1,
+            "memory_flat": peak_full <= peak_tenth * 1.5 + 1 and peak_full < peak_naive,
+        },
+        "import": {
+            "seconds": round(imported["seconds"], 2),
+            "rows_per_second": round((imported["messages"] + imported["sessions"]) / imported["seconds"]),
+            "all_rows_imported": imported["messages"] == args.messages
+            and imported["sessions"] == counts.get("session"),
+            "roundtrip_identical": _content_digest(reexport_path)[0] == original_digest,
+        },
+        "endpoints": {key: value for key, value in endpoints.items() if isinstance(value, bool)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming history export and import")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--per-session", type=int, default=50)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    passed = all(value for checks in result.values() for value in checks.values() if isinstance(value, bool))
+    sys.exit(0 if passed else 1)
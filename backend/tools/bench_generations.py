@@ -0,0 +1,205 @@
+"""
+断点续传生成的端到端检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_generations --tokens 200
+
+1. 接回（text）：收到一部分回答后断开，稍后按已收到的字符数接回，拼起来的回答与完整回答一致，
+   只发生一次生成，入库的记录没有被标记为截断。
+2. 接回（ndjson）：按最后一个事件的 offset 接回，结果同样完整。
+3. 放弃：断开后无人接回，超过 OLLAMA_GENERATION_DETACH_TIMEOUT 后上游生成被中止，回答按截断入库。
+4. 淘汰：offset 之前的内容被移出缓冲区时拒绝接入（接口返回 410），结束超过 TTL 的生成不再保留
+   （接口返回 404），合计占用不超过内存上限。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+async def _read_text(client, method: str, url: str, stop_after: int = 0, **kwargs) -> tuple:
+    """读取 text 格式的响应，stop_after 大于 0 时读到这么多字符就断开"""
+    received = ""
+    async with client.stream(method, url, **kwargs) as response:
+        generation_id = response.headers.get("X-Generation-Id")
+        async for text in response.aiter_text():
+            received += text
+            if stop_after and len(received) >= stop_after:
+                break
+    return generation_id, received
+
+
+async def _read_ndjson(client, method: str, url: str, stop_after_tokens: int = 0, **kwargs) -> tuple:
+    """读取 ndjson 格式的响应，返回 (生成 ID, 回答, 最后一个 offset, 是否收到 done)"""
+    text, offset, done, tokens = "", 0, False, 0
+    async with client.stream(method, url, params={"format": "ndjson", **kwargs.pop("params", {})}, **kwargs) as response:
+        generation_id = response.headers.get("X-Generation-Id")
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                text += event["text"]
+                offset = event["offset"]
+                tokens += 1
+            done = done or event["type"] == "done"
+            if stop_after_tokens and tokens >= stop_after_tokens:
+                break
+    return generation_id, text, offset, done
+
+
+async def _stored(session_id: int, deadline: float):
+    from src.core.database.models import Conversation
+
+    while time.monotonic() < deadline:
+        row = await Conversation.filter(session_id=session_id).first()
+        if row is not None:
+            return row
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def _end_to_end(app_port: int, tokens: int, detach_timeout: float) -> dict:
+    import httpx
+
+    from src.core.database.models import Users
+    from src.core.ollama.cancellation import cancelled_generations
+    from src.core.ollama.generations import generations_abandoned, generations_started
+
+    expected = "".join(f"token{i} " for i in range(tokens))
+    user = await Users.create(username=f"gen{time.monotonic_ns() % 10**8}", password="bench")
+    result = {}
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=30) as client:
+        async def new_session() -> int:
+            return (await client.post("/sessions", json={"user_id": user.id, "title": "bench"})).json()["id"]
+
+        # 1. text 格式断开后接回
+        session_id = await new_session()
+        started = generations_started.value
+        generation_id, head = await _read_text(
+            client, "POST", f"/sessions/{session_id}/messages/stream",
+            stop_after=len(expected) // 3, json={"message": "hello"},
+        )
+        await asyncio.sleep(0.3)
+        _, tail = await _read_text(
+            client, "GET", f"/sessions/{session_id}/generations/{generation_id}/stream",
+            params={"offset": len(head)},
+        )
+        row = await _stored(session_id, time.monotonic() + 5)
+        result["text"] = {
+            "received_before_disconnect": len(head),
+            "resumed_output_complete": head + tail == expected,
+            "single_generation": generations_started.value - started == 1,
+            "stored_untruncated": row is not None and row.ai_message == expected and not row.truncated,
+        }
+
+        # 2. ndjson 格式按 offset 接回
+        session_id = await new_session()
+        generation_id, head, offset, _ = await _read_ndjson(
+            client, "POST", f"/sessions/{session_id}/messages/stream",
+            stop_after_tokens=5, json={"message": "hello"},
+        )
+        _, tail, _, done = await _read_ndjson(
+            client, "GET", f"/sessions/{session_id}/generations/{generation_id}/stream",
+            params={"offset": offset},
+        )
+        result["ndjson"] = {"resumed_output_complete": head + tail == expected and done}
+
+        # 3. 断开后无人接回
+        session_id = await new_session()
+        abandoned, cancelled = generations_abandoned.value, cancelled_generations.value
+        generation_id, head = await _read_text(
+            client, "POST", f"/sessions/{session_id}/messages/stream",
+            stop_after=20, json={"message": "hello"},
+        )
+        row = await _stored(session_id, time.monotonic() + detach_timeout + 5)
+        gone = await client.get(f"/sessions/{session_id}/generations/missing/stream")
+        result["abandon"] = {
+            "aborted_after_timeout": generations_abandoned.value - abandoned == 1
+            and cancelled_generations.value - cancelled == 1,
+            "stored_truncated": row is not None and row.truncated and len(row.ai_message) < len(expected),
+            "unknown_generation_404": gone.status_code == 404,
+        }
+    return result
+
+
+async def _eviction() -> dict:
+    from src.core.ollama.generations import GenerationRegistry, OffsetEvictedError
+    from src.core.ollama.streaming import token_event
+
+    registry = GenerationRegistry(buffer_bytes=4000, max_bytes=10000, ttl=0.2, detach_timeout=60)
+    release = asyncio.Event()
+
+    async def run(generation) -> bool:
+        for i in range(100):
+            generation.push(token_event(f"token{i} "))
+        await release.wait()
+        return True
+
+    generations = [registry.start(1, 1, run) for _ in range(4)]
+    await asyncio.sleep(0)
+    first = generations[0]
+    try:
+        first.follow(0)
+        ring_evicts = False
+    except OffsetEvictedError:
+        ring_evicts = True
+    follower = first.follow(first.first_offset)
+    within_cap = registry.bytes <= registry.max_bytes
+    release.set()
+    replayed = [event async for event in follower.events()]
+    await asyncio.sleep(0.4)
+    return {
+        "evicted_offset_rejected": ring_evicts,
+        "tail_replayable": bool(replayed) and replayed[-1][1]["offset"] == first.offset,
+        "total_bytes_capped": within_cap,
+        "expired_after_ttl": registry.get(first.id) is None and registry.bytes == 0,
+    }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_GENERATION_DETACH_TIMEOUT=str(args.detach_timeout),
+        OLLAMA_TITLE_ENABLED="0",
+        CONVERSATION_FLUSH_INTERVAL="0.05",
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    fake, fake_task = await _serve(create_app(tokens=args.tokens, token_delay=args.token_delay), fake_port)
+    server, task = await _serve(app, app_port)
+    try:
+        result = await _end_to_end(app_port, args.tokens, args.detach_timeout)
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+    result["eviction"] = await _eviction()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify resumable generations against the fake Ollama")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--detach-timeout", type=float, default=0.5)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    passed = all(value for checks in result.values() for name, value in checks.items() if isinstance(value, bool))
+    sys.exit(0 if passed else 1)
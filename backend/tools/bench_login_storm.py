@@ -0,0 +1,122 @@
+"""
+登录风暴下的聊天流延迟测试。
+
+在进程内启动模拟 Ollama 和后端应用（临时 SQLite 数据库），同时保持若干条 /chat/stream
+流，测量相邻文本块的到达间隔；分别在空闲和并发登录时，对比 bcrypt 直接在事件循环里
+计算（AUTH_HASH_WORKERS=0，原来的行为）和放到工作池中计算:
+    python -m tools.bench_login_storm --streams 4 --logins 16
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+def _summary(gaps: list) -> dict:
+    gaps = sorted(gaps)
+    return {
+        "chunks": len(gaps),
+        "gap_ms_p50": round(statistics.median(gaps) * 1000, 2),
+        "gap_ms_p99": round(gaps[int(len(gaps) * 0.99)] * 1000, 2),
+        "gap_ms_max": round(gaps[-1] * 1000, 2),
+    }
+
+
+async def _stream(client, prompt: str, gaps: list) -> None:
+    async with client.stream("POST", "/chat/stream", json={"message": prompt}) as response:
+        last = time.perf_counter()
+        async for _ in response.aiter_raw():
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+
+async def _storm(client, concurrency: int, stop: asyncio.Event) -> int:
+    logins = 0
+
+    async def worker():
+        nonlocal logins
+        while not stop.is_set():
+            response = await client.post("/login", data={"username": "bench", "password": "bench"})
+            response.raise_for_status()
+            logins += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return logins
+
+
+async def _phase(client, streams: int, logins: int, prompts) -> dict:
+    gaps = []
+    stop = asyncio.Event()
+    storm = asyncio.create_task(_storm(client, logins, stop)) if logins else None
+    started = time.perf_counter()
+    await asyncio.gather(*(_stream(client, next(prompts), gaps) for _ in range(streams)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    result = _summary(gaps)
+    if storm is not None:
+        result["logins_per_second"] = round(await storm / elapsed, 1)
+    return result
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_RESPONSE_CACHE_BYTES="0",
+        OLLAMA_MODEL_CONCURRENCY=str(args.streams),
+    )
+
+    import httpx
+    from tortoise import Tortoise
+
+    from src.core.auth import hashing
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    fake = create_app(tokens=args.tokens, token_delay=args.token_delay)
+    fake_server, fake_task = await _serve(fake, fake_port)
+    app_server, app_task = await _serve(app, app_port)
+    await Tortoise.generate_schemas()
+
+    prompts = (f"prompt {i}" for i in itertools.count())
+    workers = hashing.AUTH_HASH_WORKERS or 1
+    results = {}
+    limits = httpx.Limits(max_connections=args.streams + args.logins + 4)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=120, limits=limits) as client:
+        await client.post("/register", json={"username": "bench", "password": "bench"})
+        results["idle"] = await _phase(client, args.streams, 0, prompts)
+        for name, mode_workers in (("inline", 0), ("worker_pool", workers)):
+            hashing.shutdown()
+            hashing.AUTH_HASH_WORKERS = mode_workers
+            results[f"storm_{name}"] = await _phase(client, args.streams, args.logins, prompts)
+
+    for server, task in ((app_server, app_task), (fake_server, fake_task)):
+        server.should_exit = True
+        await task
+
+    return {
+        "streams": args.streams,
+        "concurrent_logins": args.logins,
+        "hash_workers": workers,
+        "token_delay_ms": args.token_delay * 1000,
+        **results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat stream latency during a login storm")
+    parser.add_argument("--streams", type=int, default=4, help="同时进行的聊天流数")
+    parser.add_argument("--logins", type=int, default=16, help="并发登录的客户端数")
+    parser.add_argument("--tokens", type=int, default=200, help="每条流的 token 数")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="模拟 Ollama 的 token 间隔（秒）")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
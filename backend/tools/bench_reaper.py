@@ -0,0 +1,226 @@
+"""
+软删除和后台分批清理的检查，使用临时 SQLite 数据库:
+    python -m tools.bench_reaper --messages 100000
+
+1. 常数时间：删除只有几条消息的会话和有 --messages 条消息的会话，接口耗时相近；删除后立即 404、
+   不再出现在会话列表中。
+2. 不挡写入：后台清理大会话期间持续写入其他用户的消息，最长的一次写入等待远短于
+   一条 DELETE 删掉同样多消息（原来的做法）时的等待。
+3. 删除用户：接口立即返回，令牌和登录失效；清理完成后该用户的会话、消息、用量和用户行都被删除，
+   其他用户的数据不受影响。
+4. 续做：清理到一半时关闭应用，删除标记保留，下次运行从剩下的行继续删完。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+from tools.bench_export import _seed
+
+
+PASSWORD = "bench-password"
+
+
+async def _login(client, username: str) -> int:
+    await client.post("/register", json={"username": username, "password": PASSWORD})
+    await client.post("/login", data={"username": username, "password": PASSWORD})
+    return (await client.get("/users/whoami")).json()["id"]
+
+
+async def _new_session(user_id: int, messages: int) -> int:
+    from src.core.database.models import ChatSession
+
+    before = set(await ChatSession.filter(user_id=user_id).values_list("id", flat=True))
+    await _seed(user_id, messages, messages)
+    return next(iter(set(await ChatSession.filter(user_id=user_id).values_list("id", flat=True)) - before))
+
+
+async def _wait_for(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await predicate():
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+class _WriteProbe:
+    """不断写入单条消息，记录每次写入的耗时，衡量删除期间其他写入被挡住多久"""
+
+    def __init__(self, user_id: int, session_id: int):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.latencies = []
+        self._task = None
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    async def _run(self):
+        from src.core.database.models import Conversation
+
+        while True:
+            started = time.perf_counter()
+            await Conversation.create(user_id=self.user_id, session_id=self.session_id, user_message="probe", ai_message="ok")
+            self.latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    @property
+    def max_ms(self) -> float:
+        return round(max(self.latencies, default=0) * 1000, 1)
+
+
+async def _run(base_url: str, messages: int) -> dict:
+    import httpx
+    from tortoise import timezone
+
+    from src.core.database.models import ChatSession, Conversation, TokenUsage, Users
+    from src.core.database.reaper import reaper_batches
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as other, \
+            httpx.AsyncClient(base_url=base_url, timeout=120) as doomed:
+        other_id = await _login(other, "reap_other")
+        doomed_id = await _login(doomed, "reap_doomed")
+        probe_session = await _new_session(other_id, 10)
+        small = await _new_session(other_id, 10)
+        large = await _new_session(other_id, messages)
+        naive = await _new_session(other_id, messages)
+
+        # 原来的做法：一条语句删掉整个会话的消息
+        with _WriteProbe(other_id, probe_session) as naive_probe:
+            await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            await Conversation.filter(session_id=naive).delete()
+            naive_seconds = time.perf_counter() - started
+            await ChatSession.filter(id=naive).delete()
+
+        started = time.perf_counter()
+        small_status = (await other.delete(f"/sessions/{small}")).status_code
+        small_ms = (time.perf_counter() - started) * 1000
+        with _WriteProbe(other_id, probe_session) as probe:
+            started = time.perf_counter()
+            large_status = (await other.delete(f"/sessions/{large}")).status_code
+            large_ms = (time.perf_counter() - started) * 1000
+            hidden = (await other.get(f"/sessions/{large}")).status_code == 404 \
+                and (await other.get(f"/sessions/{large}/messages")).status_code == 404 \
+                and large not in [row["id"] for row in (await other.get("/sessions", params={"user_id": other_id})).json()]
+            batches = reaper_batches.value
+            started = time.perf_counter()
+            reaped = await _wait_for(lambda: _gone(ChatSession, large), 600)
+            reap_seconds = time.perf_counter() - started
+            batches = reaper_batches.value - batches
+
+        # 删除用户
+        await _seed(doomed_id, messages // 2, 50)
+        await TokenUsage.create(user_id=doomed_id, model="bench", period=timezone.now().replace(minute=0, second=0, microsecond=0))
+        started = time.perf_counter()
+        user_status = (await doomed.delete(f"/user/{doomed_id}")).status_code
+        user_ms = (time.perf_counter() - started) * 1000
+        token_revoked = (await doomed.get("/users/whoami")).status_code == 401
+        login = await doomed.post("/login", data={"username": "reap_doomed", "password": PASSWORD})
+        user_reaped = await _wait_for(lambda: _gone(Users, doomed_id), 600)
+        leftovers = sum([
+            await ChatSession.filter(user_id=doomed_id).count(),
+            await Conversation.filter(user_id=doomed_id).count(),
+            await TokenUsage.filter(user_id=doomed_id).count(),
+        ])
+        other_intact = await Conversation.filter(session_id=probe_session).count() >= 10 \
+            and (await other.get("/users/whoami")).status_code == 200
+
+        # 留一个清理到一半的删除标记给续做检查
+        resume = await _new_session(other_id, messages)
+        await other.delete(f"/sessions/{resume}")
+        await _wait_for(lambda: _fewer(Conversation, resume, messages // 2), 600)
+
+    return {
+        "session_delete_ms_small": round(small_ms, 1),
+        "session_delete_ms_large": round(large_ms, 1),
+        "session_delete_constant_time": small_status == large_status == 204 and large_ms < small_ms * 3 + 50,
+        "hidden_immediately": hidden,
+        "reap_seconds": round(reap_seconds, 1),
+        "reap_rows_per_second": round(messages / reap_seconds),
+        "reap_batches": int(batches),
+        "session_reaped": reaped,
+        "naive_delete_seconds": round(naive_seconds, 2),
+        "max_write_ms_naive": naive_probe.max_ms,
+        "max_write_ms_during_reap": probe.max_ms,
+        "writes_not_blocked": probe.max_ms * 4 < naive_probe.max_ms,
+        "user_delete_ms": round(user_ms, 1),
+        "user_delete_ok": user_status == 200,
+        "token_revoked": token_revoked,
+        "login_rejected": login.status_code == 401,
+        "user_reaped": user_reaped and leftovers == 0,
+        "other_user_intact": other_intact,
+        "_resume_session": resume,
+    }
+
+
+async def _gone(model, row_id: int) -> bool:
+    return not await model.filter(id=row_id).exists()
+
+
+async def _fewer(model, session_id: int, count: int) -> bool:
+    return await model.filter(session_id=session_id).count() < count
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    app_port = _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BATCH_ENABLED="0",
+        OLLAMA_TITLE_ENABLED="0",
+        REAPER_BATCH_ROWS=str(args.batch_rows),
+        REAPER_BATCH_PAUSE=str(args.pause),
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import ChatSession, Conversation
+    from src.core.database.reaper import Reaper
+    from src.main import app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    server, task = await _serve(app, app_port)
+    try:
+        result = await _run(f"http://127.0.0.1:{app_port}", args.messages)
+    finally:
+        server.should_exit = True
+        await task
+
+    # 关闭时清理到一半的会话：标记还在，新的清理从剩下的行继续
+    resume = result.pop("_resume_session")
+    await Tortoise.init(config=TORTOISE_ORM)
+    remaining = await Conversation.filter(session_id=resume).count()
+    tombstone_kept = await ChatSession.filter(id=resume, deleted_at__isnull=False).exists()
+    await Reaper(batch_rows=args.batch_rows, pause=0, interval=1).reap_pending()
+    result["resume_remaining_rows"] = remaining
+    result["resumed_after_restart"] = tombstone_kept and 0 < remaining < args.messages \
+        and not await ChatSession.filter(id=resume).exists() \
+        and not await Conversation.filter(session_id=resume).exists()
+    await Tortoise.close_connections()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify soft deletion and the chunked background reaper")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--batch-rows", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.02)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(value for value in result.values() if isinstance(value, bool)) else 1)
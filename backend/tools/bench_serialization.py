@@ -0,0 +1,108 @@
+"""
+对比消息列表接口原来的序列化路径（ORM 实例 + Pydantic 校验 + jsonable_encoder）
+和 values_list() + orjson 的快速路径。
+
+使用临时 SQLite 数据库，插入一个包含 --rows 条消息的会话:
+    python -m tools.bench_serialization --rows 10000 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+
+async def _seed(rows: int) -> int:
+    from src.core.database.models import ChatSession, Conversation, Users
+
+    user = await Users.create(username="bench", password="bench")
+    session = await ChatSession.create(user_id=user.id, title="bench")
+    await Conversation.bulk_create(
+        [
+            Conversation(
+                user_id=user.id,
+                session_id=session.id,
+                user_message=f"question {i} " * 8,
+                ai_message=f"answer {i} " * 40,
+            )
+            for i in range(rows)
+        ],
+        batch_size=1000,
+    )
+    return session.id
+
+
+async def _baseline(session_id: int) -> bytes:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import parse_obj_as
+
+    from src.core.database.models import Conversation
+    from src.routes.ollama_chat import ConversationResponse
+
+    rows = await Conversation.filter(session_id=session_id).order_by("timestamp", "id")
+    # FastAPI 对 response_model=List[ConversationResponse] 做的事情
+    validated = parse_obj_as(List[ConversationResponse], rows)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+async def _fast(session_id: int) -> bytes:
+    from src.core.crud.serialization import encode_rows
+    from src.core.database.models import Conversation
+    from src.routes.ollama_chat import MESSAGE_FIELDS
+
+    rows = await Conversation.filter(session_id=session_id).order_by(
+        "timestamp", "id"
+    ).values_list(*MESSAGE_FIELDS)
+    return b"".join(encode_rows(MESSAGE_FIELDS, rows))
+
+
+async def _measure(path, session_id: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = await path(session_id)
+        timings.append(time.perf_counter() - started)
+    return {
+        "ms_median": round(statistics.median(timings) * 1000, 2),
+        "ms_min": round(min(timings) * 1000, 2),
+        "bytes": len(body),
+    }, body
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["DATABASE_URL"] = f"sqlite://{db_dir}/bench.sqlite3"
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    try:
+        session_id = await _seed(args.rows)
+        baseline, baseline_body = await _measure(_baseline, session_id, args.repeat)
+        fast, fast_body = await _measure(_fast, session_id, args.repeat)
+    finally:
+        await Tortoise.close_connections()
+
+    # 两条路径的输出必须一致
+    assert json.loads(baseline_body) == json.loads(fast_body)
+    return {
+        "rows": args.rows,
+        "baseline": baseline,
+        "fast_path": fast,
+        "speedup": round(baseline["ms_median"] / fast["ms_median"], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat history serialization")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
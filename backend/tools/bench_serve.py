@@ -0,0 +1,331 @@
+"""
+多进程生产入口（python -m src.serve）的端到端检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_serve --workers 2
+
+1. 启动耗时：在新进程中冷导入 src.main 若干次，报告各阶段（导入、Tortoise.init_models、路由、应用）
+   的中位数耗时，以及从启动命令到 /readyz 返回 200 的时间，都应在 STARTUP_BUDGET_SECONDS 之内。
+2. 多进程：新建的连接分散到全部工作进程；同一会话的轮次交替落到不同进程时，每一轮发给 Ollama 的
+   历史都包含之前所有轮次（其他进程写入的也不漏）。
+3. 就绪检查：Ollama 停掉后 /readyz 返回 503、/healthz 仍返回 200，Ollama 恢复后重新就绪。
+4. 排空：流式输出中途向主进程发送 SIGTERM，进行中的流完整输出、客户端已断开的生成跑完后完整入库，
+   会话事件的订阅立即结束，进程在 WEB_DRAIN_TIMEOUT 之内退出。
+5. 排空超时：生成比 WEB_DRAIN_TIMEOUT 更长时，进程按时退出，已生成的部分按截断入库。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+_PHASES_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import src.main
+from src.core.lifecycle import startup_timer
+print(json.dumps({"wall": time.perf_counter() - started, **startup_timer.phases}))
+"""
+
+
+class _Recorder:
+    """记录模拟 Ollama 收到的 /api/chat 请求体"""
+
+    def __init__(self, app):
+        self.app = app
+        self.bodies = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/api/chat":
+            await self.app(scope, receive, send)
+            return
+        body = b""
+
+        async def recording_receive():
+            nonlocal body
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                self.bodies.append(json.loads(body))
+            return message
+
+        await self.app(scope, recording_receive, send)
+
+
+def _import_phases(env: dict, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PHASES_SCRIPT], env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output))
+    return {name: round(statistics.median(s[name] for s in samples), 3) for name in samples[0]}
+
+
+async def _wait_ready(client, proc, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return True
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def _wait_status(client, path: str, status: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (await client.get(path)).status_code == status:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+def _launch(env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "ab")
+    return subprocess.Popen([sys.executable, "-m", "src.serve"], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def _stop(proc: subprocess.Popen) -> float:
+    """向主进程发送 SIGTERM，返回退出所用的秒数"""
+    started = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    while proc.poll() is None:
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def _pid_of_connection(base_url: str):
+    """打开一个新连接，返回 (客户端, 处理该连接的工作进程 PID)"""
+    import httpx
+
+    client = httpx.AsyncClient(base_url=base_url, timeout=60)
+    return client, (await client.get("/healthz")).json()["pid"]
+
+
+async def _coherence(base_url: str, recorder: _Recorder, user_id: int, max_turns: int) -> dict:
+    """同一会话的轮次落到不同进程时，每一轮的历史都应包含之前所有轮次"""
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        session_id = (await client.post("/sessions", json={"user_id": user_id, "title": "serve"})).json()["id"]
+    pids, complete, returns = [], True, 0
+    for turn in range(max_turns):
+        client, pid = await _pid_of_connection(base_url)
+        # 回到之前处理过这个会话、中间有其他进程写入过的工作进程
+        if pid in pids and pids[-1] != pid:
+            returns += 1
+        pids.append(pid)
+        recorder.bodies.clear()
+        try:
+            async with client.stream(
+                "POST", f"/sessions/{session_id}/messages/stream", json={"message": f"question{turn}"}
+            ) as response:
+                await response.aread()
+        finally:
+            await client.aclose()
+        sent = [m["content"] for m in recorder.bodies[-1]["messages"] if m["role"] == "user"]
+        complete = complete and sent == [f"question{i}" for i in range(turn + 1)]
+        # 等这一轮批量写入数据库
+        await asyncio.sleep(0.5)
+        if returns >= 2 and turn >= 3:
+            break
+    return {
+        "coherence_turns": len(pids),
+        "coherence_worker_returns": returns,
+        "history_complete_across_workers": complete and returns > 0,
+    }
+
+
+async def _stream_tokens(client, session_id: int, message: str, stop_after: int = 0) -> int:
+    received = ""
+    async with client.stream("POST", f"/sessions/{session_id}/messages/stream", json={"message": message}) as response:
+        async for text in response.aiter_text():
+            received += text
+            if stop_after and len(re.findall(r"token\d+", received)) >= stop_after:
+                break
+    return len(re.findall(r"token\d+", received))
+
+
+async def _subscribe(client, user_id: int) -> float:
+    """订阅会话事件直到服务端结束，返回结束的时刻"""
+    try:
+        async with client.stream("GET", "/sessions/events", params={"user_id": user_id}) as response:
+            async for _ in response.aiter_raw():
+                pass
+    except Exception:
+        pass
+    return time.perf_counter()
+
+
+async def _drain(base_url: str, proc, user_id: int, streams: int, tokens: int) -> dict:
+    import httpx
+
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=120) for _ in range(streams + 2)]
+    sessions = [
+        (await clients[0].post("/sessions", json={"user_id": user_id, "title": f"drain{i}"})).json()["id"]
+        for i in range(streams + 1)
+    ]
+    subscription = asyncio.create_task(_subscribe(clients[-1], user_id))
+    full = [asyncio.create_task(_stream_tokens(clients[i], sessions[i], "drain")) for i in range(streams)]
+    # 读到几个 token 就断开，生成在服务端继续
+    detached = await _stream_tokens(clients[streams], sessions[streams], "detached", stop_after=2)
+    await asyncio.sleep(0.3)
+    signalled = time.perf_counter()
+    exit_seconds = await _stop(proc)
+    received = await asyncio.gather(*full)
+    subscription_seconds = await subscription - signalled
+    for client in clients:
+        await client.aclose()
+    return {
+        "drain_exit_seconds": round(exit_seconds, 2),
+        "drain_streams_complete": all(count == tokens for count in received) and detached == 2,
+        "drain_subscription_closed_seconds": round(subscription_seconds, 2),
+        "drain_subscription_closed_early": subscription_seconds < exit_seconds / 2,
+        "_sessions": sessions,
+    }
+
+
+async def _saved(sessions: list) -> list:
+    """(回答中的 token 数, 是否截断)，按会话的顺序"""
+    from src.core.database.models import Conversation
+
+    rows = []
+    for session_id in sessions:
+        row = await Conversation.filter(session_id=session_id).first()
+        rows.append((len(re.findall(r"token\d+", row.ai_message)), row.truncated) if row else None)
+    return rows
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite://{db_dir}/bench.sqlite3",
+        "SECRET_KEY": "bench",
+        "OLLAMA_BASE_URLS": f"http://127.0.0.1:{fake_port}",
+        "OLLAMA_TITLE_ENABLED": "0",
+        "OLLAMA_BATCH_ENABLED": "0",
+        "OLLAMA_CONTEXT_REUSE": "0",
+        "OLLAMA_HEALTH_INTERVAL": "0.2",
+        "OLLAMA_HEALTH_TIMEOUT": "0.5",
+        "CONVERSATION_FLUSH_INTERVAL": "0.1",
+        "WEB_HOST": "127.0.0.1",
+        "WEB_PORT": str(app_port),
+        "WEB_WORKERS": str(args.workers),
+        "WEB_DRAIN_TIMEOUT": str(args.drain_timeout),
+    }
+    os.environ.update(env)
+
+    import httpx
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import Users
+    from src.core.lifecycle import STARTUP_BUDGET_SECONDS
+    from tools.fake_ollama import create_app
+
+    phases = _import_phases(env, args.import_runs)
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    user_id = (await Users.create(username="serve", password="x")).id
+    await Tortoise.close_connections()
+
+    log_path = os.path.join(db_dir, "serve.log")
+    result = {"import_phases": phases}
+    stream_seconds = args.tokens * args.token_delay
+    recorder = _Recorder(create_app(tokens=args.tokens, token_delay=args.token_delay))
+    fake, fake_task = await _serve(recorder, fake_port)
+    launched = time.perf_counter()
+    proc = _launch(env, log_path)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            ready = await _wait_ready(client, proc, 60)
+            ready_seconds = time.perf_counter() - launched
+            startup = [(await client.get("/healthz")).json()["startup_seconds"]]
+        pids = set()
+        for _ in range(args.workers * 10):
+            connection, pid = await _pid_of_connection(base_url)
+            await connection.aclose()
+            pids.add(pid)
+        result.update(
+            ready_seconds=round(ready_seconds, 2),
+            worker_startup_seconds=startup[0],
+            startup_within_budget=ready and phases["wall"] < STARTUP_BUDGET_SECONDS
+            and ready_seconds < STARTUP_BUDGET_SECONDS,
+            workers_serving=len(pids) == args.workers,
+        )
+
+        # 同一会话的请求落到不同的工作进程
+        recorder_fast = _Recorder(create_app(tokens=5, token_delay=0.001))
+        fake.should_exit = True
+        await fake_task
+        fake, fake_task = await _serve(recorder_fast, fake_port)
+        result.update(await _coherence(base_url, recorder_fast, user_id, 15))
+
+        # Ollama 停掉后不再就绪，但仍然存活
+        fake.should_exit = True
+        await fake_task
+        async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            not_ready = await _wait_status(client, "/readyz", 503, 10)
+            alive = (await client.get("/healthz")).status_code == 200
+            fake, fake_task = await _serve(recorder, fake_port)
+            ready_again = await _wait_status(client, "/readyz", 200, 10)
+        result["readiness_tracks_ollama"] = not_ready and alive and ready_again
+
+        drained = await _drain(base_url, proc, user_id, args.streams, args.tokens)
+        sessions = drained.pop("_sessions")
+        result.update(drained)
+        result["drain_exit_within_timeout"] = proc.returncode == 0 and drained["drain_exit_seconds"] < args.drain_timeout
+
+        # 生成比排空超时更长：按时退出，已生成的部分截断入库
+        env_short = {**env, "WEB_DRAIN_TIMEOUT": str(args.short_drain_timeout)}
+        proc = _launch(env_short, log_path)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            await _wait_ready(client, proc, 60)
+            session_id = (await client.post("/sessions", json={"user_id": user_id, "title": "slow"})).json()["id"]
+            stream = asyncio.create_task(_stream_tokens(client, session_id, "slow"))
+            await asyncio.sleep(0.5)
+            timeout_exit = await _stop(proc)
+            await asyncio.gather(stream, return_exceptions=True)
+        result["timeout_exit_seconds"] = round(timeout_exit, 2)
+        result["timeout_exit_on_time"] = timeout_exit < args.short_drain_timeout + 2 < stream_seconds
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        fake.should_exit = True
+        await fake_task
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    saved = await _saved(sessions + [session_id])
+    await Tortoise.close_connections()
+    result["drain_saved_complete"] = all(row == (args.tokens, False) for row in saved[:-1])
+    result["timeout_saved_truncated"] = saved[-1] is not None and saved[-1][1] and 0 < saved[-1][0] < args.tokens
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the multi-worker serving entry point and graceful draining")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-delay", type=float, default=0.1)
+    parser.add_argument("--drain-timeout", type=float, default=20)
+    parser.add_argument("--short-drain-timeout", type=float, default=1.5)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(value for value in result.values() if isinstance(value, bool)) else 1)
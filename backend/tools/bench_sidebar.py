@@ -0,0 +1,199 @@
+"""
+会话冗余字段（消息条数、最后活动时间、最后一条消息的预览）和侧边栏接口的检查，
+使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_sidebar --sessions 200 --per-session 50
+
+1. 补齐：直接批量插入的历史数据没有这些字段，backfill_session_summaries 之后与由对话记录算出的一致。
+2. 增量：通过会话接口对话若干轮、以及导入导出文件之后，字段仍与对话记录一致，对话过的会话排到侧边栏最前。
+3. 侧边栏：/sessions/sidebar 一页只执行一条查询，按游标翻页不重不漏；对比原来的做法
+   （/sessions 列出会话，再逐个会话读取消息）的耗时和查询数。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+from tools.bench_export import _seed
+
+
+class _QueryCounter(logging.Handler):
+    """统计 Tortoise 执行的 SQL 语句数（数据库客户端以 DEBUG 级别记录每条语句）"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+        self._logger = logging.getLogger("tortoise.db_client")
+
+    def emit(self, record):
+        self.count += 1
+
+    def __enter__(self):
+        self._level = self._logger.level
+        self._logger.setLevel(logging.DEBUG)
+        self._logger.addHandler(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._logger.removeHandler(self)
+        self._logger.setLevel(self._level)
+
+
+async def _expected(user_id: int) -> dict:
+    """由对话记录直接算出的 会话 ID -> (条数, 最后活动时间, 预览)"""
+    from src.core.database.models import ChatSession, Conversation
+    from src.core.database.summaries import message_preview
+
+    expected = {}
+    for session_id, created_at in await ChatSession.filter(user_id=user_id).values_list("id", "created_at"):
+        rows = await Conversation.filter(session_id=session_id).order_by("-timestamp", "-id").values_list(
+            "timestamp", "user_message", "ai_message"
+        )
+        expected[session_id] = (
+            (len(rows), rows[0][0], message_preview(rows[0][1], rows[0][2])) if rows else (0, created_at, None)
+        )
+    return expected
+
+
+async def _stored(user_id: int) -> dict:
+    from src.core.database.models import ChatSession
+
+    return {
+        row[0]: row[1:]
+        for row in await ChatSession.filter(user_id=user_id).values_list(
+            "id", "message_count", "last_activity", "last_message_preview"
+        )
+    }
+
+
+async def _consistent(user_id: int) -> bool:
+    return await _stored(user_id) == await _expected(user_id)
+
+
+async def _sidebar_pages(client, user_id: int, limit: int) -> list:
+    entries, cursor = [], None
+    while True:
+        params = {"user_id": user_id, "limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/sessions/sidebar", params=params)
+        entries.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return entries
+
+
+async def _run(base_url: str, user_id: int, turns: int, page: int) -> dict:
+    import httpx
+
+    from src.core.crud.export import export_history, import_history
+    from src.core.database.models import Users
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        # 原来的做法：列出会话，再逐个会话读取全部消息算出条数和最后一条
+        with _QueryCounter() as naive_queries:
+            started = time.perf_counter()
+            sessions = (await client.get("/sessions", params={"user_id": user_id, "limit": page})).json()
+            for session in sessions:
+                await client.get(f"/sessions/{session['id']}/messages")
+            naive_ms = (time.perf_counter() - started) * 1000
+        with _QueryCounter() as sidebar_queries:
+            started = time.perf_counter()
+            first_page = (await client.get("/sessions/sidebar", params={"user_id": user_id, "limit": page})).json()
+            sidebar_ms = (time.perf_counter() - started) * 1000
+
+        # 在最早活动的几个会话里各对话几轮，它们应排到最前
+        touched = [entry["id"] for entry in (await _sidebar_pages(client, user_id, 1000))[-3:]]
+        for i in range(turns):
+            async with client.stream(
+                "POST", f"/sessions/{touched[i % len(touched)]}/messages/stream", json={"message": f"follow-up {i}"}
+            ) as response:
+                await response.aread()
+        new_session = (await client.post("/sessions", json={"user_id": user_id, "title": "empty"})).json()["id"]
+        await asyncio.sleep(1.5)  # 等批量写入
+        entries = await _sidebar_pages(client, user_id, max(page // 4, 1))
+        incremental = await _consistent(user_id)
+
+        # 导入导出的文件
+        target = await Users.create(username="sidebar_import", password="x")
+
+        async def chunks():
+            async for data in export_history(user_id):
+                yield data
+
+        await import_history(target.id, chunks())
+        imported = await _consistent(target.id)
+
+    ids = [entry["id"] for entry in entries]
+    activity = [entry["last_activity"] for entry in entries]
+    return {
+        "sidebar_ms": round(sidebar_ms, 1),
+        "sidebar_queries": sidebar_queries.count,
+        "naive_ms": round(naive_ms, 1),
+        "naive_queries": naive_queries.count,
+        "sidebar_single_query": sidebar_queries.count == 1 and len(first_page) == min(page, len(sessions) + 1),
+        "incremental_consistent": incremental,
+        "touched_sessions_first": set(ids[:4]) == {*touched, new_session},
+        "pages_complete": len(ids) == len(set(ids)) and set(ids) == set(await _stored(user_id)),
+        "pages_ordered": activity == sorted(activity, reverse=True),
+        "import_consistent": imported,
+    }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_TITLE_ENABLED="0",
+        OLLAMA_BATCH_ENABLED="0",
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import Users
+    from src.core.database.summaries import backfill_session_summaries
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    user = await Users.create(username="sidebar", password="x")
+    await _seed(user.id, args.sessions * args.per_session, args.per_session)
+    stale = not await _consistent(user.id)
+    started = time.perf_counter()
+    backfilled = await backfill_session_summaries()
+    backfill_seconds = time.perf_counter() - started
+    consistent = await _consistent(user.id)
+    await Tortoise.close_connections()
+
+    fake, fake_task = await _serve(create_app(tokens=20, token_delay=0.001), fake_port)
+    server, task = await _serve(app, app_port)
+    try:
+        result = await _run(f"http://127.0.0.1:{app_port}", user.id, args.turns, args.page)
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+    return {
+        "backfilled_sessions": backfilled,
+        "backfill_seconds": round(backfill_seconds, 2),
+        "backfill_consistent": stale and consistent,
+        **result,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify denormalized session summaries and the sidebar endpoint")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--per-session", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--page", type=int, default=100)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(value for value in result.values() if isinstance(value, bool)) else 1)
@@ -0,0 +1,171 @@
+"""
+自动标题的端到端检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_titling --sessions 20
+
+1. 推送：订阅 /sessions/events 后并发发出 --sessions 个新会话的第一轮，统计收到 title 事件的耗时，
+   以及生成标题的模型请求数（凑批后应明显少于会话数）。模拟服务不理解提示词，
+   多个会话一批时解析不出标题，会改用截取的用户消息，流程上与真实模型相同。
+2. 去重：同一会话重复排队只保留一个任务。
+3. 优先级：并发上限为 1 时，排队中的用户请求总是先于后台任务拿到名额。
+4. 解析：几种常见的模型输出都能取出标题。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+async def _collect_titles(client, user_id: int, expected: int, received: dict, ready: asyncio.Event) -> None:
+    async with client.stream("GET", "/sessions/events", params={"user_id": user_id}) as response:
+        ready.set()
+        kind = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                kind = line[len("event: "):]
+            elif line.startswith("data: ") and kind == "title":
+                data = json.loads(line[len("data: "):])
+                received[data["session_id"]] = (data["title"], time.perf_counter())
+                if len(received) >= expected:
+                    return
+
+
+async def _first_turn(client, session_id: int, message: str) -> None:
+    async with client.stream("POST", f"/sessions/{session_id}/messages/stream", json={"message": message}) as response:
+        async for _ in response.aiter_bytes():
+            pass
+
+
+async def _end_to_end(app_port: int, sessions: int) -> dict:
+    import httpx
+
+    from src.core.database.models import ChatSession, Users
+    from src.core.ollama.titling import DEFAULT_SESSION_TITLE, session_titler, title_batches, title_fallbacks
+
+    user = await Users.create(username=f"title{time.monotonic_ns() % 10**8}", password="bench")
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=60) as client:
+        received, ready = {}, asyncio.Event()
+        listener = asyncio.create_task(_collect_titles(client, user.id, sessions, received, ready))
+        await ready.wait()
+
+        ids = [
+            (await client.post("/sessions", json={"user_id": user.id})).json()["id"]
+            for _ in range(sessions)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _first_turn(client, session_id, f"How do I tune postgres for workload {i}?")
+            for i, session_id in enumerate(ids)
+        ))
+        finished = time.perf_counter()
+        try:
+            await asyncio.wait_for(listener, 30)
+        except asyncio.TimeoutError:
+            listener.cancel()
+
+        # 第二轮不会再排队
+        await _first_turn(client, ids[0], "and what about indexes?")
+
+    titled = await ChatSession.filter(id__in=ids).exclude(title=DEFAULT_SESSION_TITLE).count()
+    latencies = sorted(at - finished for _, at in received.values())
+    queued = session_titler.enqueue(ids[0], user.id, "dup", "", "m") and not session_titler.enqueue(
+        ids[0], user.id, "dup", "", "m"
+    )
+    return {
+        "sessions": sessions,
+        "title_events": len(received),
+        "titled_in_db": titled,
+        "chat_seconds": round(finished - started, 3),
+        "title_push_after_chats_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        "model_requests": int(title_batches.value),
+        "fallback_titles": int(title_fallbacks.value),
+        "all_titled_and_pushed": len(received) == sessions == titled,
+        "batched": 0 < title_batches.value < sessions,
+        "dedupe": queued,
+    }
+
+
+async def _priority() -> bool:
+    from src.core.ollama.scheduler import OllamaScheduler
+
+    scheduler = OllamaScheduler(default_concurrency=1)
+    held = await scheduler.acquire("m", "a")
+    order = []
+
+    async def take(name, acquire):
+        slot = await acquire()
+        order.append(name)
+        slot.release()
+
+    background = asyncio.create_task(take("background", lambda: scheduler.acquire_background("m")))
+    await asyncio.sleep(0.01)
+    user = asyncio.create_task(take("user", lambda: scheduler.acquire("m", "b")))
+    await asyncio.sleep(0.01)
+    held.release()
+    await asyncio.gather(background, user)
+    return order == ["user", "background"]
+
+
+def _parsing() -> bool:
+    from src.core.ollama.titling import _parse_titles
+
+    cases = [
+        ('{"titles": ["Postgres 调优", "“索引设计”。"]}', 2, ["Postgres 调优", "索引设计"]),
+        ('<think>先想想</think>\n```json\n{"titles": ["A"]}\n```', 1, ["A"]),
+        ("数据库调优建议", 1, ["数据库调优建议"]),
+        ('{"titles": ["只有一个"]}', 2, ["只有一个", None]),
+        ("not json at all", 2, [None, None]),
+    ]
+    return all(_parse_titles(text, count) == expected for text, count, expected in cases)
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_TITLE_BATCH_WAIT="0.2",
+        OLLAMA_TITLE_BATCH_SIZE=str(args.batch_size),
+    )
+
+    from tortoise import Tortoise
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    fake, fake_task = await _serve(create_app(tokens=10, token_delay=0.01), fake_port)
+    server, task = await _serve(app, app_port)
+    try:
+        result = {"end_to_end": await _end_to_end(app_port, args.sessions)}
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+    result["user_requests_before_background"] = await _priority()
+    result["parses_model_output"] = _parsing()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the session titling pipeline against the fake Ollama")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=8)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    checks = result["end_to_end"]
+    passed = (
+        checks["all_titled_and_pushed"] and checks["batched"] and checks["dedupe"]
+        and result["user_requests_before_background"] and result["parses_model_output"]
+    )
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,143 @@
+"""
+token 用量统计和额度的端到端检查，使用临时 SQLite 数据库和进程内的模拟 Ollama:
+    python -m tools.bench_usage --users 8 --turns 5
+
+1. 记账：--users 个用户并发各发 --turns 轮消息，写入 TokenUsage 的请求数和 token 数与模拟服务返回的统计一致，
+   写入批次数远少于请求数；关闭应用时写完内存中还没写入的用量。
+2. 额度：给一个用户设置很小的每分钟额度，几轮之后返回 429 并带 Retry-After，其他用户不受影响。
+3. 接口：登录用户从 /usage 看到自己的用量和额度状态；/admin/usage 对管理员返回所有用户的汇总，
+   对普通用户返回 403。
+任何检查失败时以非零状态退出。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tools.bench_context_cache import _free_port, _serve
+
+
+ADMIN = "usage_admin"
+PASSWORD = "bench-password"
+
+
+async def _turn(client, session_id: int, message: str) -> tuple:
+    """发送一轮消息，返回 (状态码, Retry-After)"""
+    async with client.stream("POST", f"/sessions/{session_id}/messages/stream", json={"message": message}) as response:
+        await response.aread()
+        return response.status_code, int(response.headers.get("Retry-After", 0))
+
+
+async def _login(client, username: str) -> int:
+    await client.post("/register", json={"username": username, "password": PASSWORD})
+    await client.post("/login", data={"username": username, "password": PASSWORD})
+    return (await client.get("/users/whoami")).json()["id"]
+
+
+async def _run(base_url: str, users: int, turns: int) -> dict:
+    import httpx
+
+    from src.core.ollama.usage import usage_flushes
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as admin, \
+            httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await _login(admin, ADMIN)
+        user_ids = [await _login(client, f"usage{i}") for i in range(users)]
+
+        async def chat(user_id: int) -> list:
+            session_id = (await client.post("/sessions", json={"user_id": user_id, "title": "bench"})).json()["id"]
+            return [await _turn(client, session_id, f"question {i} from {user_id}") for i in range(turns)]
+
+        flushes = usage_flushes.value
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(chat(user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(1.0)
+
+        limited = [status for status, _ in statuses[0]]
+        # client 最后登录的是 usage{users-1}
+        own = (await client.get("/usage", params={"granularity": "hour"})).json()
+        summary = await admin.get("/admin/usage")
+        forbidden = await client.get("/admin/usage")
+        return {
+            "turns": users * turns,
+            "turns_per_second": round(users * turns / elapsed, 1),
+            "db_flushes": int(usage_flushes.value - flushes),
+            "quota_rejected_after_limit": limited.count(429) > 0 and limited[0] == 200
+            and all(retry_after > 0 for status, retry_after in statuses[0] if status == 429),
+            "quota_turns_allowed": limited.count(200),
+            "other_users_unaffected": all(status == 200 for result in statuses[1:] for status, _ in result),
+            "own_usage_rows": own["usage"],
+            "own_usage_visible": bool(own["usage"]) and sum(row["requests"] for row in own["usage"]) == turns
+            and own["quota"] is None,
+            "admin_summary": summary.status_code == 200 and {row["user_id"] for row in summary.json()} >= set(user_ids[1:]),
+            "non_admin_forbidden": forbidden.status_code == 403,
+        }
+
+
+async def main(args) -> dict:
+    db_dir = tempfile.mkdtemp()
+    fake_port, app_port = _free_port(), _free_port()
+    # 第一个注册的普通用户 ID 是 2（管理员先注册），额度约够 quota_turns 轮
+    per_turn = args.tokens + 20
+    os.environ.update(
+        DATABASE_URL=f"sqlite://{db_dir}/bench.sqlite3",
+        SECRET_KEY="bench",
+        OLLAMA_BASE_URLS=f"http://127.0.0.1:{fake_port}",
+        OLLAMA_TITLE_ENABLED="0",
+        OLLAMA_BATCH_ENABLED="0",
+        OLLAMA_USAGE_FLUSH_INTERVAL="0.5",
+        OLLAMA_USER_QUOTA_OVERRIDES=f"2={per_turn * args.quota_turns}",
+        ADMIN_USERNAMES=ADMIN,
+    )
+
+    from tortoise import Tortoise
+    from tortoise.functions import Sum
+
+    from src.core.database.config import TORTOISE_ORM
+    from src.core.database.models import TokenUsage
+    from src.core.ollama.usage import usage_tokens
+    from src.main import app
+    from tools.fake_ollama import create_app
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await Tortoise.generate_schemas()
+    await Tortoise.close_connections()
+
+    fake, fake_task = await _serve(create_app(tokens=args.tokens, token_delay=args.token_delay), fake_port)
+    server, task = await _serve(app, app_port)
+    try:
+        result = await _run(f"http://127.0.0.1:{app_port}", args.users, args.turns)
+    finally:
+        server.should_exit = fake.should_exit = True
+        await asyncio.gather(task, fake_task)
+
+    # 关闭时写完的用量与记账的合计一致
+    await Tortoise.init(config=TORTOISE_ORM)
+    stored = (await TokenUsage.annotate(
+        requests_sum=Sum("requests"), prompt_sum=Sum("prompt_tokens"), completion_sum=Sum("completion_tokens")
+    ).values("requests_sum", "prompt_sum", "completion_sum"))[0]
+    await Tortoise.close_connections()
+    served = result.pop("turns") - (args.turns - result["quota_turns_allowed"])
+    result["stored_requests"] = stored["requests_sum"]
+    result["stored_matches_served_turns"] = stored["requests_sum"] == served
+    result["stored_tokens_match_stats"] = stored["completion_sum"] == served * args.tokens \
+        and stored["completion_sum"] == usage_tokens.labels("completion").value \
+        and stored["prompt_sum"] == usage_tokens.labels("prompt").value
+    result["batched_writes"] = 0 < result["db_flushes"] < served
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify per-user token accounting and quotas against the fake Ollama")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=30)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--quota-turns", type=int, default=2)
+    result = asyncio.run(main(parser.parse_args()))
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if all(value for value in result.values() if isinstance(value, bool)) else 1)
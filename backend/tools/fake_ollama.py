@@ -0,0 +1,238 @@
+"""
+本地模拟的 Ollama 服务，用于在没有 GPU 的机器上联调和测试多后端负载均衡。
+
+启动多个实例:
+    python -m tools.fake_ollama --port 11435 --models deepseek-r1:latest
+    python -m tools.fake_ollama --port 11436
+然后设置 OLLAMA_BASE_URLS=http://localhost:11435,http://localhost:11436
+
+按空白切分的单词视为 token；--prefill-delay 模拟预填充每个新 token 的耗时，
+请求里带上的 context 视为已在 KV 缓存中，不计入预填充。
+
+--load-delay 模拟模型冷加载：未加载的模型先等待这么久，结束块的 load_duration 随之变化；
+--idle-unload 秒内没有请求的模型视为已被卸载。不带 prompt 的 /api/generate 只加载（或按
+keep_alive: 0 卸载）模型，与 Ollama 一致。
+
+/api/embed 返回词袋的哈希向量（--embed-dim 维）：共享词越多的文本余弦相似度越高，
+足以检验语义检索的流程。
+
+故障注入（按请求独立抽样）:
+    --error-rate         直接返回 500
+    --midstream-error-rate  输出一部分 token 后返回 {"error": ...} 行并结束
+    --malformed-rate     输出一部分 token 后混入一行无法解析的内容
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def tokenize(text: str) -> List[int]:
+    """把文本确定性地映射为 token id（每个单词一个）"""
+    return [zlib.crc32(word.encode()) % 32000 for word in text.split()]
+
+
+def embedding(text: str, dim: int) -> List[float]:
+    """把文本映射为确定性的词袋哈希向量：单词和每个中日韩字符各算一个词，模拟回答的 tokenN 不算"""
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+|[^\x00-\x7f]", text.lower()):
+        if re.fullmatch(r"token\d+", word):
+            continue
+        vector[zlib.crc32(word.encode()) % dim] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def create_app(
+    models=(),
+    tokens: int = 20,
+    token_delay: float = 0.05,
+    prefill_delay: float = 0.0,
+    first_token_delay: float = 0.0,
+    error_rate: float = 0.0,
+    midstream_error_rate: float = 0.0,
+    malformed_rate: float = 0.0,
+    seed: Optional[int] = None,
+    embed_dim: int = 256,
+    load_delay: float = 0.0,
+    idle_unload: float = 0.0,
+) -> FastAPI:
+    """
+    创建模拟 Ollama 的 FastAPI 应用。
+
+    参数:
+        models: 启动时视为已加载的模型。
+        tokens (int): 每次生成返回的 token 数。
+        token_delay (float): 相邻 token 之间的间隔（秒）。
+        prefill_delay (float): 预填充每个提示词 token 的耗时（秒）。
+        first_token_delay (float): 首个 token 之前的固定延迟（秒），例如模型加载。
+        error_rate (float): 直接返回 500 的请求比例。
+        midstream_error_rate (float): 生成到一半返回 error 行的请求比例。
+        malformed_rate (float): 生成到一半混入无法解析的行的请求比例。
+        seed (Optional[int]): 故障注入的随机种子，便于复现。
+        embed_dim (int): /api/embed 返回的向量维度。
+        load_delay (float): 冷加载未加载模型的耗时（秒）。
+        idle_unload (float): 模型空闲这么久（秒）后被卸载，0 表示从不卸载。
+
+    返回:
+        FastAPI: 模拟服务应用。
+    """
+    app = FastAPI()
+    # 已加载的模型 -> 最近一次使用的时间
+    loaded = {model: time.monotonic() for model in models}
+    rng = random.Random(seed)
+
+    def now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def expire() -> None:
+        if idle_unload > 0:
+            for model, used in list(loaded.items()):
+                if time.monotonic() - used > idle_unload:
+                    del loaded[model]
+
+    async def load(model: str) -> float:
+        """加载模型（已加载时只刷新使用时间），返回加载耗时（秒）"""
+        expire()
+        delay = 0.0 if model in loaded else load_delay
+        if delay:
+            await asyncio.sleep(delay)
+        loaded[model] = time.monotonic()
+        return delay
+
+    @app.get("/api/ps")
+    async def running_models():
+        expire()
+        return {"models": [{"name": name, "model": name} for name in sorted(loaded)]}
+
+    @app.get("/api/tags")
+    async def local_models():
+        return {"models": [{"name": name, "model": name} for name in sorted(loaded)]}
+
+    def stream(model: str, prompt_ids: List[int], context: List[int], wrap):
+        if rng.random() < error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        midstream_error = rng.random() < midstream_error_rate
+        malformed = rng.random() < malformed_rate
+
+        async def chunks():
+            load_seconds = await load(model)
+            await asyncio.sleep(first_token_delay + prefill_delay * len(prompt_ids))
+            output = []
+            for i in range(tokens):
+                if i == tokens // 2:
+                    if midstream_error:
+                        yield json.dumps({"error": "injected failure"}) + "\n"
+                        return
+                    if malformed:
+                        yield "{not json\n"
+                if i:
+                    await asyncio.sleep(token_delay)
+                word = f"token{i}"
+                output.extend(tokenize(word))
+                yield json.dumps({"model": model, "created_at": now(), **wrap(word + " "), "done": False}) + "\n"
+            final = {
+                "model": model, "created_at": now(), **wrap(""), "done": True,
+                "done_reason": "stop", "prompt_eval_count": len(prompt_ids), "eval_count": tokens,
+                "load_duration": int(load_seconds * 1e9),
+            }
+            if context is not None:
+                final["context"] = context + prompt_ids + output
+            yield json.dumps(final) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        if "prompt" not in body:
+            if body.get("keep_alive") == 0:
+                loaded.pop(model, None)
+                return {"model": model, "created_at": now(), "response": "", "done": True, "done_reason": "unload"}
+            load_seconds = await load(model)
+            return {
+                "model": model, "created_at": now(), "response": "", "done": True, "done_reason": "load",
+                "load_duration": int(load_seconds * 1e9),
+            }
+        prompt_ids = tokenize(body.get("system", "") + " " + body.get("prompt", ""))
+        return stream(
+            body.get("model", ""),
+            prompt_ids,
+            list(body.get("context") or []),
+            lambda text: {"response": text},
+        )
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        prompt_ids = tokenize(" ".join(m.get("content", "") for m in body.get("messages", [])))
+        return stream(
+            body.get("model", ""),
+            prompt_ids,
+            None,
+            lambda text: {"message": {"role": "assistant", "content": text}},
+        )
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        inputs = body.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        if rng.random() < error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        model = body.get("model", "")
+        await load(model)
+        return {"model": model, "embeddings": [embedding(text, embed_dim) for text in inputs]}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", nargs="*", default=[], help="视为已加载的模型")
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--token-rate", type=float, help="每秒生成的 token 数，指定时覆盖 --token-delay")
+    parser.add_argument("--first-token-delay", type=float, default=0.0)
+    parser.add_argument("--prefill-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--midstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--idle-unload", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(
+        args.models,
+        tokens=args.tokens,
+        token_delay=1 / args.token_rate if args.token_rate else args.token_delay,
+        prefill_delay=args.prefill_delay,
+        first_token_delay=args.first_token_delay,
+        error_rate=args.error_rate,
+        midstream_error_rate=args.midstream_error_rate,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+        embed_dim=args.embed_dim,
+        load_delay=args.load_delay,
+        idle_unload=args.idle_unload,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+对正在运行的后端做并发流式请求压测，输出 JSON 结果便于在版本之间对比。
+
+先启动模拟 Ollama 和后端，例如:
+    python -m tools.fake_ollama --port 11435 --tokens 100 --token-rate 50 --first-token-delay 0.2
+    OLLAMA_BASE_URLS=http://localhost:11435 uvicorn src.main:app --port 5000
+然后:
+    python -m tools.loadtest --base-url http://localhost:5000 --users 32 --requests 5 --endpoint both
+
+每个虚拟用户依次发送 --requests 个请求；/chat/stream 默认每次使用不同的提示词，
+避免命中响应缓存（--same-prompt 可用于测试缓存和请求合并）。
+请求使用 NDJSON 格式，按 token 事件计算首 token 延迟，token 数取 stats 事件中的 eval_count。
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+
+def _percentiles(values: List[float], scale: float = 1.0) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))] * scale, 2)
+
+    return {
+        "mean": round(statistics.mean(values) * scale, 2),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(values[-1] * scale, 2),
+    }
+
+
+class Result:
+    """单个请求的测量结果"""
+
+    __slots__ = ("endpoint", "status", "ttft", "latency", "tokens", "error")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status: Optional[int] = None
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.tokens = 0
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+async def _request(client, endpoint: str, url: str, message: str, model: str) -> Result:
+    result = Result(endpoint)
+    started = time.perf_counter()
+    token_events = 0
+    eval_count = None
+    try:
+        async with client.stream(
+            "POST", url, params={"format": "ndjson"}, json={"message": message, "model": model}
+        ) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                result.error = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                kind = event.get("type")
+                if kind == "token":
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - started
+                    token_events += 1
+                elif kind == "stats":
+                    eval_count = event.get("eval_count")
+                elif kind == "error":
+                    result.error = event.get("detail") or "stream error"
+    except Exception as e:
+        result.error = type(e).__name__
+    finally:
+        result.latency = time.perf_counter() - started
+    # 服务端会合并相邻 token，事件数只是下限
+    result.tokens = eval_count if eval_count is not None else token_events
+    return result
+
+
+async def _user(client, index: int, args, user_id: Optional[int], results: List[Result]) -> None:
+    session_id = None
+    if user_id is not None:
+        session = await client.post("/sessions", json={"user_id": user_id, "title": f"loadtest {index}"})
+        session.raise_for_status()
+        session_id = session.json()["id"]
+
+    for turn in range(args.requests):
+        targets = []
+        if args.endpoint in ("chat", "both"):
+            prompt = args.prompt if args.same_prompt else f"{args.prompt} #{index}-{turn}-{uuid.uuid4().hex[:8]}"
+            targets.append(("chat", "/chat/stream", prompt))
+        if session_id is not None:
+            targets.append(("session", f"/sessions/{session_id}/messages/stream", f"{args.prompt} (turn {turn})"))
+        for endpoint, url, message in targets:
+            results.append(await _request(client, endpoint, url, message, args.model))
+
+
+def _report(results: List[Result], wall: float) -> dict:
+    ok = [r for r in results if r.ok]
+    tokens_per_second = [
+        r.tokens / (r.latency - r.ttft) for r in ok if r.ttft is not None and r.latency > r.ttft and r.tokens > 1
+    ]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            errors[r.error or "unknown"] = errors.get(r.error or "unknown", 0) + 1
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "errors": errors,
+        "ttft_ms": _percentiles([r.ttft for r in ok if r.ttft is not None], 1000),
+        "latency_ms": _percentiles([r.latency for r in ok], 1000),
+        "tokens_per_second_per_stream": _percentiles(tokens_per_second),
+        "throughput_tokens_per_second": round(sum(r.tokens for r in ok) / wall, 2) if wall else None,
+    }
+
+
+async def main(args) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.users * 2 + 4, max_keepalive_connections=args.users * 2)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        user_id = None
+        if args.endpoint in ("session", "both"):
+            credentials = {"username": f"lt{uuid.uuid4().hex[:12]}", "password": uuid.uuid4().hex}
+            response = await client.post("/register", json=credentials)
+            response.raise_for_status()
+            user_id = response.json()["id"]
+
+        results: List[Result] = []
+        started = time.perf_counter()
+        await asyncio.gather(*(_user(client, i, args, user_id, results) for i in range(args.users)))
+        wall = time.perf_counter() - started
+
+    report = {
+        "config": {
+            "base_url": args.base_url,
+            "users": args.users,
+            "requests_per_user": args.requests,
+            "endpoint": args.endpoint,
+            "model": args.model,
+        },
+        "wall_seconds": round(wall, 3),
+        "overall": _report(results, wall),
+    }
+    for endpoint in ("chat", "session"):
+        subset = [r for r in results if r.endpoint == endpoint]
+        if subset:
+            report[endpoint] = _report(subset, wall)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chat streaming endpoints")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=10, help="并发虚拟用户数")
+    parser.add_argument("--requests", type=int, default=5, help="每个用户依次发送的请求数")
+    parser.add_argument("--endpoint", choices=("chat", "session", "both"), default="both")
+    parser.add_argument("--model", default="deepseek-r1:latest")
+    parser.add_argument("--prompt", default="Explain the CAP theorem briefly.")
+    parser.add_argument("--same-prompt", action="store_true", help="/chat/stream 全部使用相同的提示词")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="结果 JSON 写入该文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")